@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import re
+
+# fields cast to float when a template captures them
+NUMERIC_FIELDS = ('price', 'amount', 'lever')
+
+# the built-in TradingView text alert, used when no [template.*] section is configured
+#   左側拐點｜多方進場｜45m｜$1587.74
+LEFT_TURN = ('leftTurn', {
+    'pattern': r'左側拐點｜(?P<action>[^｜]*)｜(?P<interval>[^｜]*)｜\$(?P<price>[0-9.]+)',
+    'params': 'ordType=market,side=buy',
+    'when.多方進場': 'position=long',
+    'when.多方停損': 'position=flat',
+    'when.多方平倉': 'position=flat',
+})
+
+
+def parseParams(text):
+    params = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            params[key.strip()] = value.strip()
+    return params
+
+
+class AlertSignal(object):
+    '''A text alert matched by a template, as order parameters.'''
+
+    def __init__(self, template, params, fields):
+        self.template = template
+        self.params = params
+        self.fields = fields
+
+    def symbol(self, default=None):
+        return self.params.get('symbol', default)
+
+    # order parameters for runOrder, symbol/amount fall back to the account defaults
+    def orderParams(self, defaultSymbol=None, defaultAmount=None):
+        params = dict(self.params)
+        params.setdefault('symbol', defaultSymbol)
+        if 'amount' not in params and defaultAmount is not None:
+            params['amount'] = float(defaultAmount)
+        return params
+
+
+class AlertTemplate(object):
+    '''
+    One alert format compiled from a [template.<name>] section:
+
+        pattern = regex; named groups become order parameters (price, side, ...)
+        params = fixed parameters, e.g. ordType=market,side=buy
+        when.<value> = parameters added when the action group equals <value>
+        action_group = name of the action group, default action
+    '''
+
+    def __init__(self, name, options):
+        self.name = name
+        self.pattern = re.compile(options['pattern'])
+        self.params = parseParams(options.get('params'))
+        self.actionGroup = options.get('action_group', 'action')
+        self.actions = dict((key[len('when.'):].lower(), parseParams(value))
+                            for key, value in options.items() if key.startswith('when.'))
+
+    def match(self, text):
+        found = self.pattern.search(text)
+        if found is None:
+            return None
+        fields = dict((k, v) for k, v in found.groupdict().items() if v is not None)
+        params = dict(self.params)
+        for key, value in fields.items():
+            if key == self.actionGroup:
+                params.update(self.actions.get(value.strip().lower(), {}))
+            elif key in NUMERIC_FIELDS:
+                params[key] = float(value)
+            else:
+                params[key] = value
+        return AlertSignal(self.name, params, fields)
+
+
+class TemplateRegistry(object):
+    '''Templates tried in config order, the first match wins.'''
+
+    def __init__(self, templates):
+        self.templates = templates
+
+    def match(self, text):
+        if not text:
+            return None
+        for template in self.templates:
+            signal = template.match(text)
+            if signal is not None:
+                return signal
+        return None
+
+
+# sections: (name, options) pairs, e.g. from [template.<name>] config sections
+def loadTemplates(sections):
+    templates = []
+    for name, options in sections:
+        try:
+            templates.append(AlertTemplate(name, options))
+        except (KeyError, re.error) as e:
+            logging.error("[AlertTemplate] {name} skipped: {err}".format(name=name, err=e))
+    if not templates:
+        templates.append(AlertTemplate(*LEFT_TURN))
+    return TemplateRegistry(templates)
+
+
+# [template.<name>] sections of a ConfigParser, read raw so patterns may contain %
+def templateSections(config):
+    return [(section[len('template.'):], dict(config.items(section, raw=True)))
+            for section in config.sections() if section.startswith('template.')]
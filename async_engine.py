@@ -0,0 +1,600 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Asynchronous serving mode for both services. Exchange calls go through
+ccxt.async_support, independent calls (cancel + position fetch) are
+overlapped with asyncio.gather, and many webhooks are in flight on one
+event loop behind an ASGI server. The /order and /order/bybit/subN
+request and response contracts are the same as the Flask services.
+Stop loss / take profit follow the services' settings: attached to the
+entry where the exchange takes it (bybit), otherwise placed reduce-only
+once the entry fills.
+
+Not covered in this mode: duplicate alert suppression, the persistent
+state store, rounding to the instrument rules, multi-leg alerts and the
+/order/bybit/all and group routes. Run the Flask services for those.
+
+    python async_engine.py binance
+    python async_engine.py bybit
+'''
+import asyncio
+import configparser
+import json
+import logging
+import os
+import re
+import sys
+
+from alert_templates import loadTemplates, templateSections
+from log_pipeline import setupLogging, logPayloads, orderSummary, requestText
+from metrics import registry, stage, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from notifier import sharedNotifier
+from exchange_adapters import adapterFor
+from fill_watcher import FILLED_STATES, DEAD_STATES
+from protective_orders import protectionPrices, protectiveOrders
+from target_execution import SEQUENTIAL, TARGET, targetPosition, planTargetOrder
+from position_book import signedContracts
+
+JSON_TYPE = b'application/json'
+
+
+# the webhook / default amount as a number, None when it is not one
+def orderAmount(_params):
+    try:
+        return float(_params['amount'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+def loadBinanceConfig():
+    # same precedence as binance_trading.py: json first, then ini
+    config = {}
+    if os.path.exists('./binance_config.json'):
+        config = json.load(open('./binance_config.json', encoding="UTF-8"))
+    elif os.path.exists('./binance_config.ini'):
+        conf = configparser.ConfigParser()
+        conf.read("./binance_config.ini", encoding="UTF-8")
+        for i in conf.sections():
+            config[i] = dict((j, conf.get(i, j)) for j in conf.options(i))
+        config['account']['enable_proxies'] = config['account']['enable_proxies'].lower() == "true"
+        config['trading']['enable_stop_loss'] = config['trading']['enable_stop_loss'].lower() == "true"
+        config['trading']['enable_stop_gain'] = config['trading']['enable_stop_gain'].lower() == "true"
+    else:
+        raise Exception("binance_config.json / binance_config.ini not found")
+    return config
+
+
+def loadBybitConfig():
+    if not os.path.exists('./bybit_config.ini'):
+        raise Exception("bybit_config.ini not found")
+    config = configparser.ConfigParser()
+    config.read("./bybit_config.ini", encoding="UTF-8")
+    return config
+
+
+class AsyncTradingAgent(object):
+    '''
+    Async counterpart of TradingAgent. State changes of one agent are
+    serialized by an asyncio.Lock, different agents run concurrently.
+    '''
+
+    def __init__(self, exchange, accountConfig, exchangeName, executionMode=SEQUENTIAL, stopLossPct=None,
+                 takeProfitPct=None, fillWatch=None):
+        self.exchange = exchange
+        self.accountConfig = accountConfig
+        self.exchangeName = exchangeName
+        self.adapter = adapterFor(exchangeName)
+        self.executionMode = executionMode
+        self.stopLossPct = stopLossPct
+        self.takeProfitPct = takeProfitPct
+        fillWatch = fillWatch or {}
+        self.fillMinInterval = float(fillWatch.get('min_interval', 0.5))
+        self.fillMaxInterval = float(fillWatch.get('max_interval', 8))
+        self.fillTimeout = float(fillWatch.get('timeout', 300))
+        self.fillTasks = {}  # symbol -> task waiting on the fill of the last entry
+        self.lock = asyncio.Lock()
+        self.lastOrdId = 0
+        self.lastOrdType = None
+        self.lastOrdSide = None
+        self.lastOrdPosition = None
+
+    def labels(self, symbol):
+        return {'exchange': self.exchangeName, 'account': self.accountConfig.get('name'), 'symbol': symbol}
+
+    async def cancelLastOrder(self, _symbol):
+        with stage('cancelLastOrder', **self.labels(_symbol)):
+            try:
+                res = await self.exchange.cancel_all_orders(symbol=_symbol, params={})
+                logging.info("[cancelLastOrder] res: " + (json.dumps(res, default=str) if logPayloads() else orderSummary(res)))
+                return True
+            except Exception as e:
+                logging.error("[cancelLastOrder] err: " + str(e))
+                return False
+
+    async def fetchPosition(self, _symbol):
+        return signedContracts(await self.exchange.fetch_positions(symbols=[_symbol]))
+
+    # cancel resting orders and read the position at the same time
+    async def prepare(self, _symbol, needPosition=True):
+        if not needPosition:
+            return await self.cancelLastOrder(_symbol), None
+        cancelled, contracts = await asyncio.gather(self.cancelLastOrder(_symbol), self.fetchPosition(_symbol),
+                                                    return_exceptions=True)
+        if isinstance(contracts, Exception):
+            logging.error("[prepare] fetch_positions err: " + str(contracts))
+            contracts = None
+        return cancelled, contracts
+
+    async def closeAllPosition(self, _symbol, contracts=None):
+        with stage('closeAllPosition', **self.labels(_symbol)):
+            try:
+                if contracts is None:
+                    contracts = await self.fetchPosition(_symbol)
+                logging.info("[closeAllPosition] position: {contracts}".format(contracts=contracts))
+                if contracts != 0.0:
+                    await self.createOrder(_symbol=_symbol, _amount=abs(contracts),
+                                           _side="sell" if contracts > 0 else "buy", _sltp=False)
+                return True
+            except Exception as e:
+                logging.error("[closeAllPosition] err: " + str(e))
+                return False
+
+    async def createOrder(self, _symbol, _amount, _side, _price=None, _ordType='market', _reduceOnly=False, _sltp=True,
+                          _sltpAmount=None):
+        with stage('createOrder', **self.labels(_symbol)):
+            try:
+                logging.info("[createOrder] symbol:{symbol},side:{side},amount:{amount},price:{price},ordType:{ordType}"
+                             .format(symbol=_symbol, side=_side, amount=_amount, price=_price, ordType=_ordType))
+                orderParams = self.adapter.orderParams(_reduceOnly)
+                protect = _sltp and not _reduceOnly and bool(self.stopLossPct or self.takeProfitPct)
+                # protection not sent with the entry, placed once it fills
+                missing = ['stopLoss', 'takeProfit'] if protect and _ordType in ('limit', 'market') else []
+                if missing and self.adapter.attachesProtection:
+                    try:
+                        refPrice = await self.referencePrice(_symbol, _price)
+                    except Exception as e:
+                        logging.error("[createOrder] referencePrice err: " + str(e))
+                        refPrice = None
+                    if refPrice is not None:
+                        orderParams.update(self.adapter.protectionParams(
+                            *protectionPrices(_side, refPrice, self.stopLossPct, self.takeProfitPct)))
+                        missing = []
+                if _ordType == 'limit':
+                    if _price is None:
+                        return False, "price is not valid"
+                    res = await self.exchange.create_limit_order(symbol=_symbol, side=_side, amount=_amount,
+                                                                 price=_price, params=orderParams)
+                elif _ordType == 'market-limit':
+                    return False, "market-limit not support yet"
+                else:
+                    res = await self.exchange.create_market_order(symbol=_symbol, side=_side, amount=_amount,
+                                                                  params=orderParams)
+                logging.info("[createOrder] res:{res}".format(res=res if logPayloads() else orderSummary(res)))
+                if res:
+                    self.lastOrdId = res['id']
+                    if missing:
+                        logging.warning("[createOrder] {symbol} {missing} placed after the fill".format(
+                            symbol=_symbol, missing=','.join(missing)))
+                        self.watchFill(res['id'], _symbol, _side, _sltpAmount or _amount, missing)
+                    return True, "create order successfully,lastOrdId:{lastOrdId}".format(lastOrdId=self.lastOrdId)
+                return False, "create order failed"
+            except Exception as e:
+                logging.error("[createOrder] err:" + str(e))
+                return False, str(e)
+
+    # the price the percentages apply to: the limit price, else the last trade price
+    async def referencePrice(self, _symbol, _price=None):
+        if _price:
+            return float(_price)
+        return float((await self.exchange.fetch_ticker(_symbol))['last'])
+
+    # stop loss / take profit for an open position (side is the position's side), returns the missing kinds
+    async def protectPosition(self, _symbol, _side, _amount, _kinds=('stopLoss', 'takeProfit'), _refPrice=None):
+        stopLossPct = self.stopLossPct if 'stopLoss' in _kinds else None
+        takeProfitPct = self.takeProfitPct if 'takeProfit' in _kinds else None
+        if not (stopLossPct or takeProfitPct):
+            return []
+        try:
+            refPrice = float(_refPrice) if _refPrice else await self.referencePrice(_symbol)
+        except Exception as e:
+            logging.error("[protectPosition] {symbol} err: {err}".format(symbol=_symbol, err=e))
+            return list(_kinds)
+        stopLoss, takeProfit = protectionPrices(_side, refPrice, stopLossPct, takeProfitPct)
+        protective = protectiveOrders(_symbol, _side, _amount, stopLoss, takeProfit)
+        results = await asyncio.gather(*[self.exchange.create_order(r['symbol'], r['type'], r['side'], r['amount'],
+                                                                    r['price'], r['params'])
+                                         for _, r in protective], return_exceptions=True)
+        missing = []
+        for (kind, _), res in zip(protective, results):
+            if isinstance(res, Exception) or not res or not res.get('id'):
+                logging.error("[protectPosition] {symbol} {kind} err: {err}".format(symbol=_symbol, kind=kind, err=res))
+                missing.append(kind)
+        if missing:
+            logging.warning("[protectPosition] {symbol} position left without {missing}".format(
+                symbol=_symbol, missing=','.join(missing)))
+        return missing
+
+    # wait for an entry to fill in the background, a newer entry of the symbol replaces the wait
+    def watchFill(self, oid, _symbol, _side, _amount, _kinds):
+        previous = self.fillTasks.pop(_symbol, None)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.ensure_future(self.protectFill(oid, _symbol, _side, _amount, _kinds))
+        self.fillTasks[_symbol] = task
+        task.add_done_callback(lambda t: self.fillTasks.pop(_symbol, None) if self.fillTasks.get(_symbol) is t else None)
+        return task
+
+    # poll the order with backoff until it fills, then protect the fill priced off its average
+    async def protectFill(self, oid, _symbol, _side, _amount, _kinds):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.fillTimeout
+        interval = self.fillMinInterval
+        while loop.time() < deadline:
+            await asyncio.sleep(interval)
+            try:
+                order = await self.exchange.fetch_order(oid, _symbol)
+            except Exception as e:
+                logging.warning("[protectFill] {symbol} order {oid} err: {err}".format(symbol=_symbol, oid=oid, err=e))
+                order = None
+            status = (order or {}).get('status')
+            if status in FILLED_STATES:
+                async with self.lock:
+                    return await self.protectPosition(_symbol, _side, _amount, _kinds,
+                                                      order.get('average') or order.get('price'))
+            if status in DEAD_STATES:
+                return list(_kinds)
+            interval = min(interval * 2, self.fillMaxInterval)
+        logging.error("[protectFill] {symbol} order {oid} not filled within {timeout}s, left without {missing}".format(
+            symbol=_symbol, oid=oid, timeout=self.fillTimeout, missing=','.join(_kinds)))
+        return list(_kinds)
+
+    async def runTargetOrder(self, ret, _params):
+        try:
+            target = targetPosition(_params)
+        except (TypeError, ValueError):
+            ret['msg'] = "amount is not valid"
+            return ret
+        if target is None:
+            ret['msg'] = "Unknown target position"
+            return ret
+        try:
+            current = await self.fetchPosition(_params['symbol'])
+        except Exception as e:
+            logging.error("[runTargetOrder] fetch_positions err: " + str(e))
+            ret['msg'] = "fetch position failed"
+            return ret
+        plan = planTargetOrder(current, target)
+        if plan is None:
+            # nothing to trade, the resting stop loss / take profit stay in place
+            ret['msg'] = "position already at target"
+        else:
+            ret["cancelLastOrder"] = await self.cancelLastOrder(_params['symbol'])
+            _side, _amount, _reduceOnly = plan
+            ret["closedPosition"] = target == 0
+            ret["createOrderRes"], ret['msg'] = await self.createOrder(
+                _symbol=_params['symbol'], _amount=_amount, _price=_params.get('price'), _side=_side,
+                _ordType=_params.get('ordType') or 'market', _reduceOnly=_reduceOnly, _sltp=target != 0,
+                _sltpAmount=abs(target))
+            # a shrink carries no protection of its own, the cancel above removed the old one
+            if _reduceOnly and target != 0 and ret["createOrderRes"]:
+                await self.protectPosition(_params['symbol'], 'buy' if target > 0 else 'sell', abs(target))
+        self.lastOrdType = None if target == 0 else ("buy" if target > 0 else "sell")
+        self.lastOrdSide = _params.get('side')
+        self.lastOrdPosition = _params.get('position')
+        return ret
+
+    # same decisions as TradingAgent.runOrder in bybit_trading.py
+    async def runOrder(self, ret, _params, singleReset):
+        async with self.lock:
+            if _params.get('mode', self.executionMode) == TARGET:
+                return await self.runTargetOrder(ret, _params)
+            try:
+                symbol = _params['symbol']
+                resetClose = singleReset and (self.lastOrdSide != _params['side'] or
+                                              self.lastOrdPosition != _params.get('position'))
+                flatClose = _params.get('position') == 'flat' and not resetClose
+                ret["cancelLastOrder"], contracts = await self.prepare(symbol, resetClose or flatClose)
+                if resetClose or flatClose:
+                    ret["closedPosition"] = await self.closeAllPosition(symbol, contracts)
+                if flatClose:
+                    self.lastOrdType = _params.get('ordType')
+                    self.lastOrdSide = _params['side']
+                    self.lastOrdPosition = _params.get('position')
+                elif orderAmount(_params) is None:
+                    ret['msg'] = "amount is not valid"
+                elif orderAmount(_params) < 0.001:
+                    ret['msg'] = 'Amount is too small. Please increase amount.'
+                else:
+                    ret["createOrderRes"], ret['msg'] = await self.createOrder(
+                        _symbol=symbol, _amount=orderAmount(_params), _price=_params.get('price'),
+                        _side=_params['side'], _ordType=_params.get('ordType') or 'market')
+                    self.lastOrdType = _params.get('ordType')
+                    self.lastOrdSide = _params['side']
+                    self.lastOrdPosition = _params.get('position')
+            except Exception as e:
+                logging.error("[runOrder] err: {err}".format(err=e))
+            return ret
+
+    # same decisions as order() in binance_trading.py
+    async def runBinanceOrder(self, ret, _params, signalReset):
+        async with self.lock:
+            if _params.get('mode', self.executionMode) == TARGET:
+                return await self.runTargetOrder(ret, _params)
+            position = _params.get('position')
+            if position is not None and self.lastOrdPosition is not None:
+                if self.lastOrdPosition == position or position == "flat":
+                    if self.lastOrdType is not None and self.lastOrdType != _params['side']:
+                        _params['side'] = "close"
+            side = _params['side'].lower()
+            if side in ["buy", "sell"]:
+                if signalReset is False and self.lastOrdType is not None and self.lastOrdType == _params['side']:
+                    ret['msg'] = "{side} side duplacated".format(side=_params['side'])
+                    return ret
+                ret["cancelLastOrder"], contracts = await self.prepare(_params['symbol'])
+                ret["closedPosition"] = await self.closeAllPosition(_params['symbol'], contracts)
+                if orderAmount(_params) is None:
+                    ret['msg'] = "amount is not valid"
+                elif orderAmount(_params) < 0.001:
+                    ret['msg'] = 'Amount is too small. Please increase amount.'
+                else:
+                    ret["createOrderRes"], ret['msg'] = await self.createOrder(
+                        _symbol=_params['symbol'], _amount=orderAmount(_params), _price=_params.get('price'),
+                        _side=_params['side'], _ordType=_params.get('ordType') or 'market')
+                    if ret["createOrderRes"]:
+                        ret['msg'] = "create order successfully"
+                    self.lastOrdType = _params['side']
+            elif side == "close":
+                self.lastOrdType = None
+                ret["cancelLastOrder"], contracts = await self.prepare(_params['symbol'])
+                ret["closedPosition"] = await self.closeAllPosition(_params['symbol'], contracts)
+            elif side == "cancel":
+                self.lastOrdType = None
+                ret["cancelLastOrder"] = await self.cancelLastOrder(_params['symbol'])
+            if position is not None:
+                self.lastOrdPosition = position
+            return ret
+
+    async def close(self):
+        for task in list(self.fillTasks.values()):
+            task.cancel()
+        await self.exchange.close()
+
+
+class BinanceService(object):
+    def __init__(self, config, notifier):
+        import ccxt.async_support as ccxt_async
+        self.config = config
+        self.notifier = notifier
+        self.apiSec = config['service']['api_sec']
+        trading = config['trading']
+        self.defaults = {'symbol': trading['symbol'], 'amount': trading['amount'], 'tdMode': trading['td_mode']}
+        self.signalReset = trading['signal_reset']
+        exchange = ccxt_async.binance(config={
+            'apiKey': config['account']['api_key'],
+            'secret': config['account']['secret'],
+            'verbose': False,
+            'options': {'defaultType': 'future'},
+        })
+        if config['account']['enable_proxies'] is True:
+            exchange.proxies = {'http': config['account']['proxies'], 'https': config['account']['proxies']}
+        self.agent = AsyncTradingAgent(exchange, {'name': config['account']['name']}, 'binance',
+                                       trading.get('execution_mode', SEQUENTIAL),
+                                       stopLossPct=trading.get('stop_loss_trigger_price')
+                                       if trading.get('enable_stop_loss') else None,
+                                       takeProfitPct=trading.get('stop_gain_trigger_price')
+                                       if trading.get('enable_stop_gain') else None,
+                                       fillWatch=config.get('fill_watcher', {}))
+        self.listenHost = config['service']['listen_host']
+        self.listenPort = int(config['service']['listen_port'])
+
+    async def handle(self, method, path, client, body):
+        if path != '/order' or method != 'POST':
+            raise HTTPError(404)
+        try:
+            _params = json.loads(body.decode('utf-8'))
+        except Exception:
+            raise HTTPError(400)
+        if not isinstance(_params, dict):
+            raise HTTPError(400)
+        if "apiSec" not in _params or _params["apiSec"] != self.apiSec:
+            raise HTTPError(401)
+        ret = {"cancelLastOrder": False, "closedPosition": False, "createOrderRes": None, "msg": ""}
+        for key, value in self.defaults.items():
+            _params.setdefault(key, value)
+        if "side" not in _params:
+            ret['msg'] = "Please specify side parameter"
+            return ret
+        ret = await self.agent.runBinanceOrder(ret, _params, self.signalReset)
+        self.notifier.send("binance_trading.py: {ret}".format(ret=ret))
+        return ret
+
+    async def close(self):
+        await self.agent.close()
+
+
+class BybitService(object):
+    ROUTE = re.compile(r'^/order/bybit/sub(\d+)$')
+
+    def __init__(self, config, notifier):
+        import ccxt.async_support as ccxt_async
+        self.config = config
+        self.notifier = notifier
+        self.apiSec = config.get('service', 'api_sec')
+        self.ipWhiteList = frozenset(ip.strip() for ip in config.get('service', 'ip_white_list').split(","))
+        self.specificKeys = tuple(k for k in config.get('service', 'specific_keys', fallback='').split(",") if k)
+        self.alertTemplates = loadTemplates(templateSections(config))
+        self.singleReset = config.getboolean('trading', 'single_reset')
+        executionMode = config.get('trading', 'execution_mode', fallback=SEQUENTIAL)
+        stopLossPct = config.getfloat('trading', 'stop_loss_trigger_price', fallback=0) \
+            if config.getboolean('trading', 'enable_stop_loss', fallback=False) else None
+        takeProfitPct = config.getfloat('trading', 'stop_gain_trigger_price', fallback=0) \
+            if config.getboolean('trading', 'enable_stop_gain', fallback=False) else None
+        fillWatch = dict(config.items('fill_watcher')) if config.has_section('fill_watcher') else {}
+        self.agents = []
+        for section in config.sections():
+            if section.startswith("account.sub."):
+                accountConfig = {
+                    'name': config.get(section, 'name'),
+                    'default_symbol': config.get(section, 'default_symbol'),
+                    'default_amount': config.get(section, 'default_amount'),
+                }
+                exchange = ccxt_async.bybit(config={
+                    'apiKey': config.get(section, 'api_key'),
+                    'secret': config.get(section, 'secret'),
+                    'verbose': False,
+                    'options': {'defaultType': 'future'},
+                })
+                self.agents.append(AsyncTradingAgent(exchange, accountConfig, 'bybit', executionMode, stopLossPct,
+                                                     takeProfitPct, fillWatch))
+        if len(self.agents) <= 0:
+            raise Exception("No trading agents")
+        self.listenHost = config.get('service', 'listen_host')
+        self.listenPort = config.getint('service', 'listen_port')
+
+    # returns the matched text alert, if any
+    def authorize(self, client, text, payloadJson):
+        if client is None or client[0] not in self.ipWhiteList:
+            raise HTTPError(403)
+        if payloadJson is not None:
+            if payloadJson.get("apiSec") != self.apiSec:
+                raise HTTPError(401)
+            return None
+        if len(text) == 0:
+            raise HTTPError(400)
+        alert = self.alertTemplates.match(text)
+        if alert is None and not any(key in text for key in self.specificKeys):
+            raise HTTPError(404)
+        return alert
+
+    async def handle(self, method, path, client, body):
+        match = self.ROUTE.match(path)
+        if match is None or method != 'POST':
+            raise HTTPError(404)
+        text = body.decode('utf-8')
+        try:
+            payloadJson = json.loads(text)
+            if not isinstance(payloadJson, dict):
+                payloadJson = None
+        except ValueError:
+            payloadJson = None
+        alert = self.authorize(client, text, payloadJson)
+        url_num = int(match.group(1))
+        if url_num < 1 or url_num > len(self.agents):
+            raise HTTPError(404)
+        agent = self.agents[url_num - 1]
+        self.notifier.send("tradingAgents[{sub_num}]:{url_num}, accountName:{accountName}, request:{request}".format(
+            sub_num=url_num - 1, url_num=url_num, accountName=agent.accountConfig.get('name'),
+            request=requestText(text, payloadJson)))
+        if alert is not None:
+            return await self.orderAlert(agent, alert)
+        return await self.orderCommon(agent, payloadJson or {})
+
+    async def orderCommon(self, agent, _params):
+        ret = {"accountName": agent.accountConfig.get('name'), "cancelLastOrder": None,
+               "closedPosition": None, "createOrderRes": None, "msg": ""}
+        if "apiSec" not in _params or _params["apiSec"] != self.apiSec:
+            ret['msg'] = "Permission Denied."
+            return ret
+        for key in ("symbol", "amount", "side"):
+            if key not in _params:
+                ret['msg'] = "Please specify {key} parameter.".format(key=key)
+                return ret
+        return await agent.runOrder(ret, _params, self.singleReset)
+
+    async def orderAlert(self, agent, alert):
+        ret = {"case": alert.template, "accountName": agent.accountConfig.get('name'), "cancelLastOrder": None,
+               "closedPosition": None, "createOrderRes": None, "msg": ""}
+        _params = alert.orderParams(agent.accountConfig.get('default_symbol'), agent.accountConfig.get('default_amount'))
+        return await agent.runOrder(ret, _params, self.singleReset)
+
+    async def close(self):
+        await asyncio.gather(*[agent.close() for agent in self.agents], return_exceptions=True)
+
+
+def createApp(name):
+    # ASGI application serving the "binance" or "bybit" routes
+    if name == 'binance':
+        config = loadBinanceConfig()
+        notifyConfig = config.get('notify', {})
+        notifier = sharedNotifier(configPath='./core/MessageSender.cfg',
+                                  queueSize=int(notifyConfig.get('queue_size', 1000)),
+                                  batchSize=int(notifyConfig.get('batch_size', 50)),
+                                  flushInterval=float(notifyConfig.get('flush_interval', 0.5)),
+                                  overflowPolicy=notifyConfig.get('overflow_policy', 'drop_oldest'))
+        service = BinanceService(config, notifier)
+    elif name == 'bybit':
+        config = loadBybitConfig()
+        notifier = sharedNotifier(configPath='./core/MessageSender.cfg',
+                                  queueSize=config.getint('notify', 'queue_size', fallback=1000),
+                                  batchSize=config.getint('notify', 'batch_size', fallback=50),
+                                  flushInterval=config.getfloat('notify', 'flush_interval', fallback=0.5),
+                                  overflowPolicy=config.get('notify', 'overflow_policy', fallback='drop_oldest'))
+        service = BybitService(config, notifier)
+    else:
+        raise ValueError("unknown service: {name}".format(name=name))
+
+    async def respond(send, status, body, contentType=JSON_TYPE):
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', contentType)]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await service.close()
+                    notifier.stop()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        body = b''
+        more = True
+        while more:
+            message = await receive()
+            body += message.get('body', b'')
+            more = message.get('more_body', False)
+        if scope['path'] == '/metrics' and scope['method'] == 'GET':
+            await respond(send, 200, registry.render().encode('utf-8'), METRICS_CONTENT_TYPE.encode('ascii'))
+            return
+        try:
+            with stage('request', exchange=name):
+                ret = await service.handle(scope['method'], scope['path'], scope.get('client'), body)
+            await respond(send, 200, json.dumps(ret, default=str).encode('utf-8'))
+        except HTTPError as e:
+            await respond(send, e.status, json.dumps({'msg': str(e.status)}).encode('utf-8'))
+
+    app.service = service
+    return app
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('binance', 'bybit'):
+        print("usage: python async_engine.py binance|bybit")
+        sys.exit(1)
+    name = sys.argv[1]
+    config = loadBinanceConfig() if name == 'binance' else loadBybitConfig()
+    if name == 'binance':
+        settings = config.get('logging', {})
+    else:
+        settings = dict(config.items('logging')) if config.has_section('logging') else {}
+    setupLogging('{name}_trade.log'.format(name=name), settings)
+    try:
+        import uvicorn
+    except ImportError:
+        logging.error("async mode needs an ASGI server: pip install uvicorn")
+        sys.exit(1)
+    app = createApp(name)
+    uvicorn.run(app, host=app.service.listenHost, port=app.service.listenPort, log_level="info")
+
+
+if __name__ == '__main__':
+    main()
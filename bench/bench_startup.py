@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Startup benchmark. Starts binance_trading.py / bybit_trading.py /
+trading_service.py as a fresh process in a scratch directory, once with
+the default start and once with fast_start, and reports how long it takes
+until the port accepts connections and until /ready answers 200. Real
+ccxt clients are built; without network access their warm-up calls fail
+in the background, which is the case the fast start is for.
+
+    python bench/bench_startup.py --app bybit --runs 5 --accounts 8
+'''
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_webhooks import BINANCE_CONFIG, BYBIT_CONFIG, BYBIT_ACCOUNT, percentile  # noqa: E402
+
+SCRIPTS = {
+    'binance': 'binance_trading.py',
+    'bybit': 'bybit_trading.py',
+    'service': 'trading_service.py',
+}
+
+
+def freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def serviceSettings(fast, publicIp):
+    return "fast_start = {fast}\npublic_ip = {ip}\npublic_ip_timeout = 2\n".format(
+        fast=str(fast).lower(), ip=str(publicIp).lower())
+
+
+def writeConfigs(app, workdir, port, fast, publicIp, accounts):
+    settings = serviceSettings(fast, publicIp)
+    if app in ('binance', 'service'):
+        text = BINANCE_CONFIG.format(cache=os.path.join(workdir, 'binance_markets.cache.json'), mode='sequential')
+        text = text.replace('listen_port = 8080\n', 'listen_port = {port}\n'.format(port=port) + settings)
+        text += '\n[reload]\nenabled = false\n'
+        with open(os.path.join(workdir, 'binance_config.ini'), 'w', encoding='UTF-8') as f:
+            f.write(text)
+    if app in ('bybit', 'service'):
+        text = BYBIT_CONFIG.format(cache=os.path.join(workdir, 'bybit_markets.cache.json'), mode='sequential',
+                                   workers=max(accounts, 1))
+        text = text.replace('listen_port = 8080\n', 'listen_port = {port}\n'.format(port=port) + settings)
+        text += '\n[reload]\nenabled = false\n\n[clients]\nwarm_markets = false\n'
+        for n in range(1, accounts + 1):
+            text += BYBIT_ACCOUNT.format(n=n)
+        with open(os.path.join(workdir, 'bybit_config.ini'), 'w', encoding='UTF-8') as f:
+            f.write(text)
+
+
+def getReady(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+    try:
+        conn.request('GET', '/ready')
+        res = conn.getresponse()
+        res.read()
+        return res.status
+    finally:
+        conn.close()
+
+
+# (seconds to listening, seconds to ready), None for a step that did not happen before timeout
+def startOnce(app, fast, publicIp, accounts, timeout):
+    workdir = tempfile.mkdtemp(prefix='cts-start-')
+    port = freePort()
+    writeConfigs(app, workdir, port, fast, publicIp, accounts)
+    cmd = [sys.executable, os.path.join(ROOT, SCRIPTS[app])]
+    if app == 'service':
+        cmd += ['--host', '127.0.0.1', '--port', str(port)] + (['--fast-start'] if fast else [])
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    listening = ready = None
+    try:
+        while time.perf_counter() - start < timeout and proc.poll() is None:
+            try:
+                status = getReady(port)
+            except OSError:
+                time.sleep(0.005)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - start
+            if status == 200:
+                ready = time.perf_counter() - start
+                break
+            time.sleep(0.005)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return listening, ready
+
+
+def summarize(name, values):
+    done = [v for v in values if v is not None]
+    return {
+        'scenario': name,
+        'runs': len(values),
+        'failed': len(values) - len(done),
+        'min_ms': round(min(done) * 1000, 1) if done else None,
+        'p50_ms': round(percentile(done, 0.5) * 1000, 1) if done else None,
+        'max_ms': round(max(done) * 1000, 1) if done else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=sorted(SCRIPTS), default='bybit')
+    parser.add_argument('--runs', type=int, default=3, help='process starts per scenario')
+    parser.add_argument('--accounts', type=int, default=4, help='bybit sub-accounts')
+    parser.add_argument('--public-ip', action='store_true', help='also look up the public ip (in the background)')
+    parser.add_argument('--timeout', type=float, default=60, help='give up on a start after this many seconds')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    results = []
+    for fast in (False, True):
+        label = '{app} {mode}'.format(app=args.app, mode='fast_start' if fast else 'default')
+        runs = [startOnce(args.app, fast, args.public_ip, args.accounts, args.timeout) for _ in range(args.runs)]
+        results.append(summarize(label + ' listening', [r[0] for r in runs]))
+        results.append(summarize(label + ' ready', [r[1] for r in runs]))
+    print("{:<36} {:>5} {:>7} {:>9} {:>9} {:>9}".format('scenario', 'runs', 'failed', 'min ms', 'p50 ms', 'max ms'))
+    for r in results:
+        print("{scenario:<36} {runs:>5} {failed:>7} {min_ms!s:>9} {p50_ms!s:>9} {max_ms!s:>9}".format(**r))
+    if args.json:
+        with open(args.json, 'w', encoding='UTF-8') as f:
+            json.dump({'results': results, 'args': vars(args)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Offline webhook benchmark. Drives binance_trading.py / bybit_trading.py
+through their real Flask routes with FakeExchange in place of ccxt, and
+reports webhook-to-ack latency, throughput under concurrent alerts and
+thread/memory growth.
+
+    python bench/bench_webhooks.py --app both --requests 200 --concurrency 8 --latency 0.02
+'''
+import argparse
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_exchange import FakeExchange  # noqa: E402
+
+BINANCE_CONFIG = '''[account]
+name = bench
+api_key = XXXX
+secret = YYYY
+password = 123456789
+enable_proxies = False
+proxies = http://127.0.0.1:10800
+
+[trading]
+symbol = BTC/USDT:USDT
+amount = 0.01
+price = 100
+td_mode = isolated
+lever = 1
+enable_stop_loss = False
+enable_stop_gain = False
+signal_reset = True
+min_price_point = {{ "BTCUSDT": 0.1 }}
+market_cache = {cache}
+execution_mode = {mode}
+
+[service]
+api_sec = bench
+listen_host = 127.0.0.1
+listen_port = 8080
+debug_mode = False
+ip_white_list = 127.0.0.1
+'''
+
+BYBIT_CONFIG = '''[trading]
+single_reset = true
+market_cache = {cache}
+execution_mode = {mode}
+
+[service]
+api_sec = bench
+listen_host = 127.0.0.1
+listen_port = 8080
+debug_mode = false
+ip_white_list = 127.0.0.1
+specific_keys = 左側拐點
+
+[executor]
+workers = {workers}
+'''
+
+BYBIT_ACCOUNT = '''
+[account.sub.{n}]
+name = bench{n}
+api_key = XXXX
+secret = YYYY
+default_symbol = BTC/USDT:USDT
+default_amount = 0.01
+'''
+
+
+class NullSender(object):
+    def __init__(self, configPath=None):
+        pass
+
+    def sendMessageToMq(self, msg):
+        pass
+
+    def Stop(self):
+        pass
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(name, latencies, elapsed, errors):
+    return {
+        'scenario': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+
+alertIds = itertools.count(1)
+
+
+def signals(count):
+    # alternate long/short so every signal after the first reverses the position
+    for i in range(count):
+        # a distinct alert id keeps the dedup cache from answering repeated bodies
+        if i % 2 == 0:
+            yield {'side': 'buy', 'position': 'long', 'alertId': next(alertIds)}
+        else:
+            yield {'side': 'sell', 'position': 'short', 'alertId': next(alertIds)}
+
+
+def run(app, path, bodies, concurrency, environ):
+    local = threading.local()
+
+    def post(body):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        start = time.perf_counter()
+        res = client.post(path, json=body, environ_base=environ)
+        return time.perf_counter() - start, res.status_code != 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, bodies))
+    elapsed = time.perf_counter() - start
+    return [r[0] for r in results], elapsed, sum(1 for r in results if r[1])
+
+
+def loadBinance(args, workdir):
+    with open(os.path.join(workdir, 'binance_config.ini'), 'w', encoding='UTF-8') as f:
+        f.write(BINANCE_CONFIG.format(cache=os.path.join(workdir, 'binance_markets.cache.json'), mode=args.mode))
+    import binance_trading as module
+    fake = FakeExchange('binance', latency=args.latency, jitter=args.jitter, errorRate=args.error_rate, seed=args.seed)
+    module.exchange = fake
+    module.positionBook.exchange = fake
+    module.fillWatcher.exchange = fake
+    module.notifier.senderFactory = NullSender
+    module.initInstruments()
+    return module, [fake]
+
+
+# exchanges: {sub number: ccxt id} for accounts that are not on bybit
+def loadBybit(args, workdir, groups=None, exchanges=None):
+    text = BYBIT_CONFIG.format(cache=os.path.join(workdir, 'bybit_markets.cache.json'), mode=args.mode,
+                               workers=max(args.accounts, 1))
+    for name, members in sorted((groups or {}).items()):
+        text += '\n[group.{name}]\naccounts = {members}\n'.format(name=name, members=','.join(str(n) for n in members))
+    for n in range(1, args.accounts + 1):
+        text += BYBIT_ACCOUNT.format(n=n)
+        if (exchanges or {}).get(n, 'bybit') != 'bybit':
+            text += 'exchange = {id}\n'.format(id=exchanges[n])
+    with open(os.path.join(workdir, 'bybit_config.ini'), 'w', encoding='UTF-8') as f:
+        f.write(text)
+    import bybit_trading as module
+    module.notifier.senderFactory = NullSender
+    fakes = []
+    for section in module.config.sections():
+        if section.startswith('account.sub.'):
+            exchangeId = module.config.get(section, 'exchange', fallback='bybit')
+            fake = FakeExchange(exchangeId, latency=args.latency, jitter=args.jitter, errorRate=args.error_rate, seed=args.seed)
+            accountConfig = {
+                'name': module.config.get(section, 'name'),
+                'exchange': exchangeId,
+                'apiKey': module.config.get(section, 'api_key'),
+                'secret': module.config.get(section, 'secret'),
+                'default_symbol': module.config.get(section, 'default_symbol'),
+                'default_amount': module.config.get(section, 'default_amount'),
+            }
+            agent = module.TradingAgent(config=module.config, accountConfig=accountConfig, exchange=fake)
+            agent.initInstruments()
+            module.tradingAgents.append(agent)
+            fakes.append(fake)
+    return module, fakes
+
+
+def benchApp(name, module, fakes, args, routes):
+    results = []
+    environ = {'REMOTE_ADDR': '127.0.0.1'}
+    body = dict(apiSec='bench', symbol='BTC/USDT:USDT', amount=0.01, ordType='market', price=None, tdMode='isolated')
+    threadsBefore = threading.active_count()
+    tracemalloc.start()
+    for route, label in routes:
+        bodies = [dict(body, **s) for s in signals(args.requests)]
+        latencies, elapsed, errors = run(module.app, route, bodies, 1, environ)
+        results.append(summarize('{name} {label} sequential'.format(name=name, label=label), latencies, elapsed, errors))
+        bodies = [dict(body, **s) for s in signals(args.requests)]
+        latencies, elapsed, errors = run(module.app, route, bodies, args.concurrency, environ)
+        results.append(summarize('{name} {label} x{c}'.format(name=name, label=label, c=args.concurrency),
+                                 latencies, elapsed, errors))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    calls = {}
+    for fake in fakes:
+        for method, count in fake.calls.items():
+            calls[method] = calls.get(method, 0) + count
+    return {
+        'app': name,
+        'scenarios': results,
+        'threads_before': threadsBefore,
+        'threads_after': threading.active_count(),
+        'traced_peak_kb': round(peak / 1024.0, 1),
+        'traced_current_kb': round(current / 1024.0, 1),
+        'exchange_calls': calls,
+    }
+
+
+def printReport(report):
+    print("== {app} ==".format(app=report['app']))
+    print("{:<40} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+        'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for r in report['scenarios']:
+        print("{scenario:<40} {requests:>8} {errors:>7} {throughput:>10} {p50_ms:>9} {p95_ms:>9} {p99_ms:>9} {max_ms:>9}".format(**r))
+    print("threads: {b} -> {a}, traced memory: {c} KB (peak {p} KB)".format(
+        b=report['threads_before'], a=report['threads_after'], c=report['traced_current_kb'], p=report['traced_peak_kb']))
+    print("exchange calls: {calls}".format(calls=json.dumps(report['exchange_calls'], sort_keys=True)))
+    print("")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=['binance', 'bybit', 'both'], default='both')
+    parser.add_argument('--requests', type=int, default=100, help='webhooks per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent senders in the throughput scenario')
+    parser.add_argument('--accounts', type=int, default=4, help='bybit sub-accounts')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake exchange latency per call, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- latency jitter, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of exchange calls that fail')
+    parser.add_argument('--mode', choices=['sequential', 'target'], default='sequential', help='execution mode')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help='keep the services INFO logging')
+    args = parser.parse_args()
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    workdir = tempfile.mkdtemp(prefix='cts-bench-')
+    os.chdir(workdir)
+    reports = []
+    if args.app in ('binance', 'both'):
+        module, fakes = loadBinance(args, workdir)
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        reports.append(benchApp('binance', module, fakes, args, [('/order', 'order')]))
+    if args.app in ('bybit', 'both'):
+        module, fakes = loadBybit(args, workdir)
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        reports.append(benchApp('bybit', module, fakes, args, [('/order/bybit/sub1', 'sub1'),
+                                                               ('/order/bybit/all', 'all')]))
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for report in reports:
+        printReport(report)
+    print("max RSS: {rss} KB, workdir: {workdir}".format(rss=maxrss, workdir=workdir))
+    if args.json:
+        with open(args.json, 'w', encoding='UTF-8') as f:
+            json.dump({'reports': reports, 'max_rss_kb': maxrss, 'args': vars(args)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
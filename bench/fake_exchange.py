@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import threading
+import time
+
+import ccxt
+
+DEFAULT_MARKETS = [
+    {'id': 'BTCUSDT', 'symbol': 'BTC/USDT:USDT', 'base': 'BTC', 'quote': 'USDT', 'settle': 'USDT',
+     'type': 'swap', 'spot': False, 'swap': True, 'future': False, 'linear': True, 'inverse': False,
+     'contract': True, 'contractSize': 1, 'active': True,
+     'precision': {'amount': 0.001, 'price': 0.1},
+     'limits': {'amount': {'min': 0.001, 'max': 1000}, 'price': {'min': 0.1, 'max': 1000000}, 'cost': {'min': 5}},
+     'info': {'price': '1'}},
+    {'id': 'ETHUSDT', 'symbol': 'ETH/USDT:USDT', 'base': 'ETH', 'quote': 'USDT', 'settle': 'USDT',
+     'type': 'swap', 'spot': False, 'swap': True, 'future': False, 'linear': True, 'inverse': False,
+     'contract': True, 'contractSize': 1, 'active': True,
+     'precision': {'amount': 0.01, 'price': 0.01},
+     'limits': {'amount': {'min': 0.01, 'max': 10000}, 'price': {'min': 0.01, 'max': 100000}, 'cost': {'min': 5}},
+     'info': {'price': '1'}},
+]
+
+
+class FakeExchange(object):
+    '''
+    Local stand-in for the ccxt methods the trading services call. Every call
+    sleeps latency (+/- jitter) seconds, fails with ccxt.NetworkError at
+    errorRate, and updates an in-memory book of positions and orders, so
+    results look like a netting-mode futures account.
+    '''
+
+    def __init__(self, id='fake', latency=0.02, jitter=0.0, errorRate=0.0, seed=None, markets=None, price=100.0):
+        self.id = id
+        self.options = {'defaultType': 'future'}
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.errorRate = float(errorRate)
+        self.random = random.Random(seed)
+        self.marketList = markets if markets is not None else DEFAULT_MARKETS
+        self.price = float(price)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.positions = {}  # symbol -> signed contracts
+        self.orders = {}     # id -> order
+        self.calls = {}      # method -> count
+        self.has = {'createOrders': True}
+        self.precisionMode = ccxt.TICK_SIZE
+
+    def _call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            fail = self.errorRate > 0 and self.random.random() < self.errorRate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise ccxt.NetworkError("{id} {method} injected failure".format(id=self.id, method=method))
+
+    def _order(self, symbol, type, side, amount, price, params, status):
+        order = {
+            'id': str(next(self.ids)),
+            'symbol': symbol,
+            'type': type,
+            'side': side,
+            'amount': float(amount),
+            'price': price,
+            'average': self.price if status == 'closed' else None,
+            'filled': float(amount) if status == 'closed' else 0.0,
+            'status': status,
+            'timestamp': int(time.time() * 1000),
+            'reduceOnly': bool((params or {}).get('reduceOnly')),
+            'info': {},
+        }
+        self.orders[order['id']] = order
+        if status == 'closed':
+            self._fill(symbol, side, float(amount), order['reduceOnly'])
+        return dict(order)
+
+    # market orders fill at once, limit and trigger orders rest
+    def _status(self, type, params):
+        if type != 'market' or any(k in (params or {}) for k in ('stopLossPrice', 'takeProfitPrice', 'triggerPrice')):
+            return 'open'
+        return 'closed'
+
+    def _fill(self, symbol, side, amount, reduceOnly):
+        current = self.positions.get(symbol, 0.0)
+        delta = amount if side == 'buy' else -amount
+        if reduceOnly and (current == 0 or current * delta > 0 or abs(delta) > abs(current)):
+            delta = -current
+        self.positions[symbol] = current + delta
+
+    def check_required_credentials(self, error=True):
+        return True
+
+    def fetch_balance(self, params={}):
+        self._call('fetch_balance')
+        return {'USDT': {'free': 100000.0, 'used': 0.0, 'total': 100000.0}}
+
+    def fetch_ticker(self, symbol, params={}):
+        self._call('fetch_ticker')
+        return {'symbol': symbol, 'last': self.price, 'info': {}}
+
+    def fetch_markets(self, params={}):
+        self._call('fetch_markets')
+        return [dict(m) for m in self.marketList]
+
+    def create_market_order(self, symbol, side, amount, price=None, params={}):
+        self._call('create_market_order')
+        with self.lock:
+            return self._order(symbol, 'market', side, amount, None, params, 'closed')
+
+    def create_limit_order(self, symbol, side, amount, price, params={}):
+        self._call('create_limit_order')
+        with self.lock:
+            return self._order(symbol, 'limit', side, amount, price, params, 'open')
+
+    def create_order(self, symbol=None, type='market', side=None, amount=None, price=None, params={}):
+        self._call('create_order')
+        with self.lock:
+            return self._order(symbol, type, side, amount or 0, price, params, self._status(type, params))
+
+    # one round trip for the whole batch, like the exchanges' batch order endpoints
+    def create_orders(self, orders, params={}):
+        self._call('create_orders')
+        with self.lock:
+            return [self._order(o['symbol'], o['type'], o['side'], o['amount'], o.get('price'), o.get('params'),
+                                self._status(o['type'], o.get('params'))) for o in orders]
+
+    def cancel_all_orders(self, symbol=None, params={}):
+        self._call('cancel_all_orders')
+        with self.lock:
+            cancelled = []
+            for order in self.orders.values():
+                if order['status'] == 'open' and (symbol is None or order['symbol'] == symbol):
+                    order['status'] = 'canceled'
+                    cancelled.append(dict(order))
+            return cancelled
+
+    def fetch_positions(self, symbols=None, params={}):
+        self._call('fetch_positions')
+        with self.lock:
+            result = []
+            for symbol in symbols or list(self.positions.keys()):
+                contracts = self.positions.get(symbol, 0.0)
+                result.append({'symbol': symbol, 'contracts': abs(contracts),
+                               'side': None if contracts == 0 else ('long' if contracts > 0 else 'short')})
+            return result
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._call('fetch_open_orders')
+        with self.lock:
+            return [dict(o) for o in self.orders.values()
+                    if o['status'] == 'open' and (symbol is None or o['symbol'] == symbol)]
+
+    def fetch_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._call('fetch_orders')
+        with self.lock:
+            return [dict(o) for o in self.orders.values()
+                    if (symbol is None or o['symbol'] == symbol) and (since is None or o['timestamp'] >= since)]
+
+    def fetch_order(self, id, symbol=None, params={}):
+        self._call('fetch_order')
+        with self.lock:
+            order = self.orders.get(str(id))
+            if order is None:
+                raise ccxt.OrderNotFound("{id} order {oid} not found".format(id=self.id, oid=id))
+            return dict(order)
+
+    def fetch_order_trades(self, id, symbol=None, since=None, limit=None, params={}):
+        self._call('fetch_order_trades')
+        with self.lock:
+            order = self.orders.get(str(id))
+            if order is None or not order['filled']:
+                return []
+            return [{'order': order['id'], 'symbol': order['symbol'], 'side': order['side'],
+                     'amount': order['filled'], 'price': order['average']}]
+
+    # fill every resting order at the current price, e.g. to trigger the fill watcher
+    def fillOpenOrders(self):
+        with self.lock:
+            for order in self.orders.values():
+                if order['status'] == 'open':
+                    order['status'] = 'closed'
+                    order['filled'] = order['amount']
+                    order['average'] = order['price'] or self.price
+                    self._fill(order['symbol'], order['side'], order['amount'], order['reduceOnly'])
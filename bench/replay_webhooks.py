@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Replay recorded webhook traffic against the services with FakeExchange in
+place of ccxt. Alerts are read from binance_trade.log / bybit_trade.log /
+trading_service.log (text or json log format) or from a JSONL capture with
+one {"ts": epoch, "path": "/order/bybit/sub1", "body": {...} or "text",
+"accounts": [bybit sub numbers reached]} per line, and sent through the
+real Flask routes at the recorded pace, scaled, or as fast as possible. Reports latency per route, error rates and the
+final position of every fake account.
+
+    python bench/replay_webhooks.py bybit_trade.log binance_trade.log --speed 10
+    python bench/replay_webhooks.py capture.jsonl --speed 0 --concurrency 32
+    python bench/replay_webhooks.py bybit_trade.log --save capture.jsonl --dry-run
+'''
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_webhooks import ROOT, loadBinance, loadBybit, percentile  # noqa: E402
+
+sys.path.insert(0, ROOT)
+from log_pipeline import DATE_FORMAT  # noqa: E402
+
+LINE = re.compile(r'^(\d{4}/\d{2}/\d{2}/ \d{2}:\d{2}:\d{2} [AP]M) - [A-Z]+ - (.*)$')
+# log messages that carry an incoming alert, see order() / order_handler / fanOut callers;
+# each maps a match to (path, bybit sub numbers the alert reached)
+ROUTES = (
+    (re.compile(r'^order request:(.*)$', re.S), lambda m: ('/order', [])),
+    # older logs have no exchange, their accounts were all on bybit
+    (re.compile(r'^tradingAgents\[\d+\]:(\d+), (?:exchange:([^,]+), )?accountName:.*?, request:(.*)$', re.S),
+     lambda m: ('/order/{exchange}/sub{n}'.format(exchange=m.group(2) or 'bybit', n=m.group(1)), [int(m.group(1))])),
+    (re.compile(r'^broadcast to (\d+) agents, request:(.*)$', re.S),
+     lambda m: ('/order/bybit/all', list(range(1, int(m.group(1)) + 1)))),
+    (re.compile(r'^broadcast to group ([^:]+):\[([^\]]*)\], request:(.*)$', re.S),
+     lambda m: ('/order/bybit/group/' + m.group(1), [int(n) for n in m.group(2).split(',') if n.strip()])),
+)
+
+
+def parseTime(text):
+    # DATE_FORMAT pairs %H with %p, the hour is already 24h
+    return time.mktime(datetime.datetime.strptime(text, DATE_FORMAT).timetuple())
+
+
+def logRecords(path):
+    '''(ts, message) per log record; continuation lines belong to the record above.'''
+    ts, lines = None, []
+    with open(path, encoding='UTF-8', errors='replace') as f:
+        for raw in f:
+            raw = raw.rstrip('\n')
+            if raw.startswith('{'):
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    entry = None
+                if isinstance(entry, dict) and 'msg' in entry:
+                    if ts is not None:
+                        yield ts, '\n'.join(lines)
+                    ts, lines = parseTime(entry['ts']), [entry['msg']]
+                    continue
+            m = LINE.match(raw)
+            if m:
+                if ts is not None:
+                    yield ts, '\n'.join(lines)
+                ts, lines = parseTime(m.group(1)), [m.group(2)]
+            elif ts is not None:
+                lines.append(raw)
+    if ts is not None:
+        yield ts, '\n'.join(lines)
+
+
+def decodeBody(text):
+    try:
+        body = json.loads(text)
+    except ValueError:
+        return text
+    return body if isinstance(body, dict) else text
+
+
+def extractLog(path):
+    events = []
+    for ts, msg in logRecords(path):
+        for pattern, route in ROUTES:
+            m = pattern.match(msg)
+            if m:
+                path, accounts = route(m)
+                events.append({'ts': ts, 'path': path, 'body': decodeBody(m.group(m.lastindex)), 'accounts': accounts})
+                break
+    return events
+
+
+def extractCapture(path):
+    events = []
+    with open(path, encoding='UTF-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                events.append({'ts': float(entry.get('ts', 0)), 'path': entry['path'], 'body': entry['body'],
+                               'accounts': entry.get('accounts', [])})
+    return events
+
+
+def extract(paths):
+    events = []
+    for path in paths:
+        events.extend(extractCapture(path) if path.endswith('.jsonl') else extractLog(path))
+    events.sort(key=lambda e: e['ts'])
+    return events
+
+
+# /order is binance_trading.py, every /order/<exchange>/... route is served by bybit_trading.py
+def appOf(path):
+    return 'binance' if path == '/order' else 'bybit'
+
+
+SUB_PATH = re.compile(r'^/order/([^/]+)/sub(\d+)$')
+
+
+# {sub number: exchange id} of the accounts the recording addressed directly
+def accountExchanges(events):
+    exchanges = {}
+    for event in events:
+        m = SUB_PATH.match(event['path'])
+        if m:
+            exchanges[int(m.group(2))] = m.group(1)
+    return exchanges
+
+
+# recorded bodies carry the production apiSec, the bench services use their own
+def prepare(event, apiSec):
+    body = event['body']
+    if isinstance(body, dict) and 'apiSec' in body:
+        body = dict(body, apiSec=apiSec)
+    return event['path'], body
+
+
+def replay(apps, events, speed, concurrency, apiSec):
+    '''
+    Send every event, speed 1 keeps the recorded gaps, 10 is ten times
+    faster, 0 sends back to back with concurrency senders. Returns one
+    (event, latency, status, lag behind schedule, response json) per event.
+    '''
+    local = threading.local()
+    results = [None] * len(events)
+
+    def send(i, due):
+        event = events[i]
+        path, body = prepare(event, apiSec)
+        client = getattr(local, 'clients', {}).get(appOf(path))
+        if client is None:
+            local.clients = getattr(local, 'clients', {})
+            client = local.clients[appOf(path)] = apps[appOf(path)].test_client()
+        start = time.perf_counter()
+        environ = {'REMOTE_ADDR': '127.0.0.1'}
+        if isinstance(body, dict):
+            res = client.post(path, json=body, environ_base=environ)
+        else:
+            res = client.post(path, data=body.encode('utf-8'), content_type='text/plain', environ_base=environ)
+        latency = time.perf_counter() - start
+        data = res.get_json(silent=True)
+        results[i] = (event, latency, res.status_code, max(0.0, start - due) if due else 0.0, data)
+
+    begin = time.perf_counter()
+    first = events[0]['ts'] if events else 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='replay') as pool:
+        for i, event in enumerate(events):
+            due = None
+            if speed > 0:
+                due = begin + (event['ts'] - first) / speed
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            pool.submit(send, i, due)
+    return results, time.perf_counter() - begin
+
+
+# a 200 whose body reports a failed order counts as an order failure, not an HTTP error
+def orderFailed(data):
+    if not isinstance(data, dict):
+        return False
+    if 'results' in data:
+        return any(orderFailed(r) for r in data['results'].values())
+    return data.get('createOrderRes') is False
+
+
+def report(results, elapsed):
+    routes = {}
+    for event, latency, status, lag, data in results:
+        r = routes.setdefault(event['path'], {'latencies': [], 'lags': [], 'status': {}, 'orderFailures': 0})
+        r['latencies'].append(latency)
+        r['lags'].append(lag)
+        r['status'][status] = r['status'].get(status, 0) + 1
+        if status == 200 and orderFailed(data):
+            r['orderFailures'] += 1
+    rows = []
+    for path in sorted(routes):
+        r = routes[path]
+        count = len(r['latencies'])
+        errors = sum(n for status, n in r['status'].items() if status != 200)
+        rows.append({
+            'route': path,
+            'requests': count,
+            'error_rate': round(errors / float(count), 4),
+            'order_failure_rate': round(r['orderFailures'] / float(count), 4),
+            'status': dict((str(k), v) for k, v in sorted(r['status'].items())),
+            'p50_ms': round(percentile(r['latencies'], 0.5) * 1000, 3),
+            'p95_ms': round(percentile(r['latencies'], 0.95) * 1000, 3),
+            'p99_ms': round(percentile(r['latencies'], 0.99) * 1000, 3),
+            'max_ms': round(max(r['latencies']) * 1000, 3),
+            'max_lag_ms': round(max(r['lags']) * 1000, 3),
+        })
+    return {'requests': len(results), 'elapsed_s': round(elapsed, 3),
+            'throughput': round(len(results) / elapsed, 2) if elapsed > 0 else 0.0, 'routes': rows}
+
+
+def printReport(summary, positions):
+    print("{requests} alerts in {elapsed_s}s ({throughput} req/s)".format(**summary))
+    print("{:<32} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+        'route', 'requests', 'err %', 'order %', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'lag ms'))
+    for r in summary['routes']:
+        print("{route:<32} {requests:>8} {err:>7} {ord:>9} {p50_ms:>9} {p95_ms:>9} {p99_ms:>9} {max_ms:>9} {max_lag_ms:>9}".format(
+            err=round(r['error_rate'] * 100, 2), ord=round(r['order_failure_rate'] * 100, 2), **r))
+        print("    status: {status}".format(status=json.dumps(r['status'], sort_keys=True)))
+    print("")
+    print("final positions:")
+    for account in sorted(positions):
+        print("    {account:<24} {positions}".format(account=account, positions=json.dumps(positions[account], sort_keys=True)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='service logs and/or .jsonl captures')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = recorded pace, N = N times faster, 0 = max rate')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent senders')
+    parser.add_argument('--limit', type=int, default=0, help='replay only the first N alerts')
+    parser.add_argument('--accounts', type=int, default=1, help='minimum bybit sub-accounts, raised to the highest recorded sub<N>')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake exchange latency per call, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- latency jitter, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of exchange calls that fail')
+    parser.add_argument('--mode', choices=['sequential', 'target'], default='sequential', help='execution mode')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the extracted alerts to this JSONL capture')
+    parser.add_argument('--dry-run', action='store_true', help='extract (and --save) only')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help='keep the services INFO logging')
+    args = parser.parse_args()
+
+    events = extract([os.path.abspath(p) for p in args.inputs])
+    if args.limit > 0:
+        events = events[:args.limit]
+    print("{count} alerts extracted".format(count=len(events)))
+    if args.save:
+        with open(args.save, 'w', encoding='UTF-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+    if args.dry_run or not events:
+        return
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # as many fake bybit accounts as the recording reached, and its groups
+    args.accounts = max([args.accounts] + [n for e in events for n in e['accounts']])
+    groups = dict((e['path'][len('/order/bybit/group/'):], e['accounts']) for e in events
+                  if e['path'].startswith('/order/bybit/group/'))
+    workdir = tempfile.mkdtemp(prefix='cts-replay-')
+    os.chdir(workdir)
+    apps, fakes = {}, {}
+    needed = set(appOf(e['path']) for e in events)
+    if 'binance' in needed:
+        module, exchanges = loadBinance(args, workdir)
+        apps['binance'] = module.app
+        fakes[module.accountConfig['name']] = exchanges[0]
+    if 'bybit' in needed:
+        module, exchanges = loadBybit(args, workdir, groups, accountExchanges(events))
+        apps['bybit'] = module.app
+        for agent, fake in zip(module.tradingAgents, exchanges):
+            fakes[agent.accountConfig.get('name')] = fake
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results, elapsed = replay(apps, events, args.speed, args.concurrency, 'bench')
+    summary = report(results, elapsed)
+    positions = dict((name, dict((s, c) for s, c in fake.positions.items() if c)) for name, fake in fakes.items())
+    printReport(summary, positions)
+    print("workdir: {workdir}".format(workdir=workdir))
+    if args.json:
+        with open(args.json, 'w', encoding='UTF-8') as f:
+            json.dump({'summary': summary, 'positions': positions, 'args': vars(args)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
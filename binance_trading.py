@@ -1,35 +1,56 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import configparser
-from re import T
-import ccxt
 import logging
 from flask import Flask
-from flask import request, abort
+from flask import request, abort, g
 import json
-import urllib.request
-import requests
 import os
-import _thread
 import time
-import core.MessageSender as MessageSender
-
-
-# 读取配置文件，优先读取json格式，如果没有就读取ini格式
-config = {}
-if os.path.exists('./binance_config.json'):
-    config = json.load(open('./binance_config.json',encoding="UTF-8"))
-elif os.path.exists('./binance_config.ini'):
-    conf = configparser.ConfigParser()
-    conf.read("./binance_config.ini", encoding="UTF-8")
-    for i in dict(conf._sections):
-        config[i] = {}
-        for j in dict(conf._sections[i]):
-            config[i][j] = conf.get(i, j)
-    config['account']['enable_proxies'] = config['account']['enable_proxies'].lower() == "true"
-    config['trading']['enable_stop_loss'] = config['trading']['enable_stop_loss'].lower() == "true"
-    config['trading']['enable_stop_gain'] = config['trading']['enable_stop_gain'].lower() == "true"
-else:
+import threading
+import functools
+from notifier import sharedNotifier
+from exchange_adapters import adapterFor
+from order_legs import parseLegs, sizeLegs, submitLegs, recordLegs
+from protective_orders import protectionPrices, referencePrice, protectiveOrders, placeProtected, placeProtection
+from client_lifecycle import sharedClientManager
+from rate_limiter import CLOSE, OPEN, priority, prioritized, sharedScheduler, install as installScheduler
+from fill_watcher import FillWatcher
+from market_store import sharedStore
+from position_book import PositionBook
+from target_execution import SEQUENTIAL, TARGET, targetPosition, planTargetOrder
+from keyed_executor import sharedExecutor, QueueFullError
+from order_state import OrderStateBook
+from state_store import StateStore
+from dedup import DedupCache, reportsFailure
+from log_pipeline import setupLogging, logPayloads, orderSummary, requestText
+from config_reload import ConfigWatcher, installSignal
+from startup import sharedReadiness, startInBackground, announcePublicIp
+from metrics import registry, timed, beginTrace, endTrace, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+
+# 读取配置文件，优先读取json格式，如果没有就读取ini格式；不存在时返回 None
+def loadConfig():
+    config = {}
+    if os.path.exists('./binance_config.json'):
+        with open('./binance_config.json', encoding="UTF-8") as f:
+            config = json.load(f)
+    elif os.path.exists('./binance_config.ini'):
+        conf = configparser.ConfigParser()
+        conf.read("./binance_config.ini", encoding="UTF-8")
+        for i in dict(conf._sections):
+            config[i] = {}
+            for j in dict(conf._sections[i]):
+                config[i][j] = conf.get(i, j)
+        config['account']['enable_proxies'] = config['account']['enable_proxies'].lower() == "true"
+        config['trading']['enable_stop_loss'] = config['trading']['enable_stop_loss'].lower() == "true"
+        config['trading']['enable_stop_gain'] = config['trading']['enable_stop_gain'].lower() == "true"
+    else:
+        return None
+    return config
+
+config = loadConfig()
+if config is None:
     logging.info("配置文件 config.json 不存在，程序即将退出")
     exit()
 
@@ -37,7 +58,7 @@ else:
 apiSec = config['service']['api_sec']
 listenHost = config['service']['listen_host']
 listenPort = config['service']['listen_port']
-debugMode = config['service']['debug_mode']
+debugMode = str(config['service']['debug_mode']).lower() == "true"
 ipWhiteList = config['service']['ip_white_list'].split(",")
 
 # 交易对
@@ -45,7 +66,13 @@ symbol = config['trading']['symbol']
 amount = config['trading']['amount']
 tdMode = config['trading']['td_mode']
 lever = config['trading']['lever']
+# 各交易对的最小价格变动，覆盖市场信息里的 tick size
 min_price_point = json.loads(config['trading']['min_price_point'])
+# sequential: 撤单、平仓、开仓依次执行；target: 按目标仓位一笔单完成
+executionMode = config['trading'].get('execution_mode', SEQUENTIAL)
+# 止盈止损 after_fill: 等开仓成交后再挂（默认）；attached: 与开仓单同一批次提交，
+# 币安批量下单并发处理，空仓时 reduce-only 的止盈止损常被拒绝，被拒的仍在成交后补挂
+sltpMode = config['trading'].get('sltp_mode', 'after_fill')
 
 
 # 交易所API账户配置
@@ -58,88 +85,151 @@ accountConfig = {
     'proxies': {
         'http': config['account']['proxies'],  # these proxies won't work for you, they are here for example
         'https': config['account']['proxies'],
-    }
+    },
+    # 自定义 API 域名，沿用原配置项 ouyi_hostname
+    'hostname': config['account'].get('ouyi_hostname'),
 }
 
 # 格式化日志
-LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
-DATE_FORMAT = "%Y/%m/%d/ %H:%M:%S %p"
-logging.basicConfig(filename='binance_trade.log', level=logging.INFO, format=LOG_FORMAT, datefmt=DATE_FORMAT)
-logging.getLogger().addHandler(logging.StreamHandler())
-# logging.FileHandler(filename='binance_trade.log', encoding=)
-
-# CCXT初始化
-exchange = ccxt.binance(config={
-    'apiKey': accountConfig['apiKey'],
-    'secret': accountConfig['secret'],
-    'verbose': False,  # for debug output
-    'options': {
-        'defaultType': 'future',
-    },
-})
+# 日志默认经队列由后台线程写文件，见 [logging]
+setupLogging('binance_trade.log', config.get('logging', {}))
+
+# 消息通知队列，后台线程批量发送，下单流程不等待MQ
+notifyConfig = config.get('notify', {})
+notifier = sharedNotifier(configPath='./core/MessageSender.cfg',
+                          queueSize=int(notifyConfig.get('queue_size', 1000)),
+                          batchSize=int(notifyConfig.get('batch_size', 50)),
+                          flushInterval=float(notifyConfig.get('flush_interval', 0.5)),
+                          overflowPolicy=notifyConfig.get('overflow_policy', 'drop_oldest'))
+
+# CCXT初始化，代理等由 exchange_adapters 统一处理
+adapter = adapterFor('binance')
+exchange = adapter.create(accountConfig)
 #logging.info(exchange.fapiPublicGetExchangeInfo())
 
-if accountConfig['enable_proxies'] is True:
-    exchange.proxies = accountConfig['proxies']
-if 'ouyihostname' in config['account']:
-    exchange.hostname = config['account']['ouyi_hostname']
-
-
-# lastOrdId
-lastOrdId = 0
-lastOrdType = None
-lastAlgoOrdId = 0
-lastOrdPosition = None
-
-# 挂止盈止损单
-def sltpThread(oid, side, symbol, sz, tdMode, config):
-    global lastOrdType,lastAlgoOrdId
-    privatePostTradeOrderAlgoParams = {
-        "instId": symbol,
-        "tdMode": tdMode,
-        "side": "sell" if side.lower() == "buy" else "buy",
-        "ordType": "oco",
-        "sz": sz
-    }
-    if config['trading']['enable_stop_loss']:
-        privatePostTradeOrderAlgoParams['slTriggerPx'] = config['trading']['stop_loss_trigger_price']
-        privatePostTradeOrderAlgoParams['slOrdPx'] = config['trading']['stop_loss_order_price']
-    if config['trading']['enable_stop_gain']:
-        privatePostTradeOrderAlgoParams['tpTriggerPx'] = config['trading']['stop_gain_trigger_price']
-        privatePostTradeOrderAlgoParams['tpOrdPx'] = config['trading']['stop_gain_order_price']
-    while True:
-        try:
-            #privateGetTradeOrderRes = exchange.privateGetTradeOrder(params={"ordId": oid,"instId": symbol})
-            privateGetTradeOrderRes = exchange.fetch_order_trades(id=oid, symbol=symbol)
-            logging.info(privateGetTradeOrderRes)
-            if privateGetTradeOrderRes['data'][0]['state'] == "filled":
-                avgPx = float(privateGetTradeOrderRes['data'][0]['avgPx'])
-                direction = -1 if side.lower() == "buy" else 1
-                slTriggerPx = (1 + direction * float(config['trading']['stop_loss_trigger_price'])*0.01) * avgPx
-                tpOrdPx = (1 + direction * float(config['trading']['stop_gain_order_price'])*0.01) * avgPx
-                tpTriggerPx = (1 - direction * float(config['trading']['stop_gain_trigger_price'])*0.01) * avgPx
-                slOrdPx = (1 - direction * float(config['trading']['stop_loss_order_price'])*0.01) * avgPx
-                privatePostTradeOrderAlgoParams['slTriggerPx'] = '%.12f' % slTriggerPx
-                privatePostTradeOrderAlgoParams['slOrdPx'] = '%.12f' % slOrdPx
-                privatePostTradeOrderAlgoParams['tpTriggerPx'] = '%.12f' % tpTriggerPx
-                privatePostTradeOrderAlgoParams['tpOrdPx'] = '%.12f' % tpOrdPx
-                logging.info("订单{oid}设置止盈止损...".format(oid=oid))
-                #privatePostTradeOrderAlgoRes = exchange.privatePostTradeOrderAlgo(params=privatePostTradeOrderAlgoParams)
-                privatePostTradeOrderAlgoRes = exchange.create_order(params=privatePostTradeOrderAlgoParams)
-                if 'code' in privatePostTradeOrderAlgoRes and privatePostTradeOrderAlgoRes['code'] == '0':
-                    lastAlgoOrdId = privatePostTradeOrderAlgoRes['data'][0]['algoId']
-                    break
-                else:
-                    continue
-            elif privateGetTradeOrderRes['data'][0]['state'] == "canceled":
-                lastOrdType = None
+# 所有请求按交易所权重共用令牌桶，撤单/平仓优先于开仓，开仓优先于轮询
+rateLimitConfig = config.get('rate_limit', {})
+if str(rateLimitConfig.get('enabled', True)).lower() == "true":
+    installScheduler(exchange, sharedScheduler('binance',
+                                               rate=float(rateLimitConfig.get('rate', 1000.0 / exchange.rateLimit)),
+                                               burst=float(rateLimitConfig.get('burst', 10))))
+
+# 启动时预热连接和市场信息，后台定时 ping 保持长连接并校准服务器时间差
+clientsConfig = config.get('clients', {})
+clientManager = sharedClientManager(pingInterval=float(clientsConfig.get('ping_interval', 30)),
+                                    poolSize=int(clientsConfig.get('pool_size', 32)),
+                                    warmMarkets=str(clientsConfig.get('warm_markets', True)).lower() == "true")
+
+
+# 本地持仓和挂单记录，定期与交易所对账
+positionBook = PositionBook(exchange, account=accountConfig['name'],
+                            ttl=float(config['trading'].get('position_ttl', 30)),
+                            reconcileInterval=float(config['trading'].get('reconcile_interval', 15)))
+
+# 耗时统计的标签
+def stageLabels(_symbol=None, *args, **kwargs):
+    return {'exchange': 'binance', 'account': accountConfig['name'], 'symbol': kwargs.get('_symbol', _symbol)}
+
+# 下单状态和未成交的止盈止损任务批量落盘，重启后直接恢复
+stateConfig = config.get('state', {})
+stateStore = StateStore(stateConfig.get('path', './binance_state.db'),
+                        flushInterval=float(stateConfig.get('flush_interval', 0.2)),
+                        sync=stateConfig.get('sync', 'normal'),
+                        name='binance').start()
+
+# 等待成交并挂止盈止损单的统一调度器
+fillWatcherConfig = config.get('fill_watcher', {})
+fillWatcher = FillWatcher(exchange,
+                          minInterval=float(fillWatcherConfig.get('min_interval', 0.5)),
+                          maxInterval=float(fillWatcherConfig.get('max_interval', 8)),
+                          timeout=float(fillWatcherConfig.get('timeout', 300)),
+                          workers=int(fillWatcherConfig.get('workers', 4)),
+                          onFinished=lambda job: stateStore.deleteJob(accountConfig['name'], job.oid))
+sltpRetries = int(fillWatcherConfig.get('retries', 3))
+
+# 每个交易对的上次下单状态，只在该交易对的执行队列中修改
+orderStates = OrderStateBook(account=accountConfig['name'], store=stateStore)
+
+# 同一账户同一交易对的信号依次执行，不同交易对并行；与同进程的其他交易所共用线程池
+executorConfig = config.get('executor', {})
+executor = sharedExecutor(workers=int(executorConfig.get('workers', 8)),
+                          maxDepth=int(executorConfig.get('queue_depth', 32)))
+
+# 止损、止盈触发价相对参考价的百分比，未开启的为 None
+def protectionPercents():
+    stopLossPct = config['trading'].get('stop_loss_trigger_price') if config['trading']['enable_stop_loss'] else None
+    takeProfitPct = config['trading'].get('stop_gain_trigger_price') if config['trading']['enable_stop_gain'] else None
+    return stopLossPct, takeProfitPct
+
+# 成交后补挂止盈止损单（reduce-only 触发单），由 fillWatcher 回调；_kinds 为还缺的 stopLoss/takeProfit
+@timed('sltp', lambda job, *a, **k: stageLabels(job.symbol))
+@prioritized(CLOSE)
+def placeSlTpOrder(job, order, _tdMode=None, _kinds=None):
+    avgPx = float(order.get('average') or order.get('price'))
+    stopLossPct, takeProfitPct = protectionPercents()
+    if _kinds is not None:
+        stopLossPct = stopLossPct if 'stopLoss' in _kinds else None
+        takeProfitPct = takeProfitPct if 'takeProfit' in _kinds else None
+    stopLoss, takeProfit = protectionPrices(job.side, avgPx, stopLossPct, takeProfitPct, marketStore.rules.get(job.symbol))
+    logging.info("订单{oid}设置止盈止损...".format(oid=job.oid))
+    for kind, req in protectiveOrders(job.symbol, job.side, job.amount, stopLoss, takeProfit):
+        for i in range(sltpRetries):
+            try:
+                res = exchange.create_order(req['symbol'], req['type'], req['side'], req['amount'], req['price'], req['params'])
+                orderStates.get(job.symbol).lastAlgoOrdId = res['id']
+                positionBook.onOpenOrder(job.symbol)
                 break
-        except Exception as e:
-            logging.error(e)
-        time.sleep(1)
-    logging.info("订单{oid}止盈止损单挂单结束".format(oid=oid))
+            except Exception as e:
+                logging.error(e)
+            time.sleep(1)
+    logging.info("订单{oid}止盈止损单挂单结束".format(oid=job.oid))
+
+
+# 给已有持仓挂止盈止损（_side 为持仓方向，buy 为多仓），按最新成交价计算，例如目标仓位模式减仓之后
+@prioritized(CLOSE)
+def protectPosition(_symbol, _side, _amount):
+    stopLossPct, takeProfitPct = protectionPercents()
+    if not (stopLossPct or takeProfitPct):
+        return []
+    try:
+        stopLoss, takeProfit = protectionPrices(_side, referencePrice(exchange, _symbol), stopLossPct, takeProfitPct,
+                                                marketStore.rules.get(_symbol))
+        placed, missing = placeProtection(exchange, adapter, _symbol, _side, _amount, stopLoss, takeProfit)
+    except Exception as e:
+        logging.error("protectPosition {symbol} err: {err}".format(symbol=_symbol, err=e))
+        return []
+    for p in placed:
+        positionBook.onOpenOrder(_symbol)
+        orderStates.get(_symbol).lastAlgoOrdId = p['id']
+    if missing:
+        logging.warning("protectPosition {symbol} 未挂上 {missing}".format(symbol=_symbol, missing=','.join(missing)))
+    return placed
+
+
+# 先落盘再交给 fillWatcher，重启后用 restoreSlTpOrders 接着等待
+def watchSlTpOrder(job, timeout=None, supersede=True):
+    if timeout is None:
+        stateStore.putJob(accountConfig['name'], job['oid'], job)
+    fillWatcher.watch(job['oid'], job['symbol'], job['side'], job['amount'],
+                      onFilled=functools.partial(placeSlTpOrder, _tdMode=job.get('tdMode'), _kinds=job.get('protect')),
+                      onCancelled=onEntryCancelled, timeout=timeout, supersede=supersede, created=job['created'])
+
+
+def restoreSlTpOrders():
+    jobs = stateStore.loadJobs(accountConfig['name'])
+    for job in jobs:
+        remaining = job['created'] + job['timeout'] - time.time()
+        watchSlTpOrder(job, timeout=max(remaining, 0), supersede=False)
+    if jobs:
+        logging.info("恢复{count}个等待成交的止盈止损任务".format(count=len(jobs)))
+    return len(jobs)
 
 
+# 订单未成交就被取消
+def onEntryCancelled(job, order):
+    orderStates.get(job.symbol).lastOrdType = None
+    logging.info("订单{oid}已取消，不再挂止盈止损单".format(oid=job.oid))
+
 
 # 设置杠杆
 def setLever(_symbol, _tdMode, _lever):
@@ -156,11 +246,18 @@ def setLever(_symbol, _tdMode, _lever):
 
 
 # 市价全平
+@timed('cancelLastOrder', stageLabels)
+@prioritized(CLOSE)
 def cancelLastOrder(_symbol, _lastOrdId):
     try:
+        # 本地记录没有挂单就不请求交易所
+        if positionBook.hasOpenOrders(_symbol) is False:
+            logging.info("cancelLastOrder res: no open orders")
+            return True
         #res = exchange.privatePostTradeCancelOrder(params={"instId": _symbol, "ordId": _lastOrdId})
         res = exchange.cancel_all_orders(symbol=_symbol,params={})
-        logging.info("cancelLastOrder res: " + json.dumps(res))
+        positionBook.onCancelAll(_symbol)
+        logging.info("cancelLastOrder res: " + (json.dumps(res) if logPayloads() else orderSummary(res)))
         return True
     except Exception as e:
         logging.error("cancelLastOrder err: " + str(e))
@@ -168,22 +265,24 @@ def cancelLastOrder(_symbol, _lastOrdId):
 
 
 # 平掉所有仓位
+@timed('closeAllPosition', stageLabels)
+@prioritized(CLOSE)
 def closeAllPosition(_symbol, _tdMode):
     try:
         #res = exchange.privatePostTradeClosePosition(params={"instId": _symbol, "mgnMode": _tdMode})
         #res = exchange.cancel_all_orders(symbol=_symbol,params={})
-        # get a list of all open positions
-        positions = exchange.fetch_positions(symbols=[_symbol])
-        logging.info("positions: " + str(positions))
+        # 持仓数量优先取本地记录，过期或有差异时才请求交易所
+        contracts = positionBook.position(_symbol)
+        logging.info("position: {contracts}".format(contracts=contracts))
         res = "closeAllPosition res: done"
-        if positions[0]['contracts'] > 0.0 :
-            if positions[0]['side'] == "long":
+        if contracts != 0.0 :
+            if contracts > 0:
                 _side = "sell"
             else :
                 _side = "buy"
             #res = exchange.create_market_order(symbol=_symbol, side=_side, amount=float(positions["contracts"]))
 
-            res = createOrder(_symbol=_symbol, _amount=positions[0]['contracts'], _side=_side)
+            res = createOrder(_symbol=_symbol, _amount=abs(contracts), _side=_side, _sltp=False)
         
         logging.info("closeAllPosition res: " + json.dumps(res))
 
@@ -193,55 +292,94 @@ def closeAllPosition(_symbol, _tdMode):
         return False
 
 # 开仓
-def createOrder(_symbol, _amount, _side, _price=None, _ordType=None, _tdMode=None, enable_stop_loss=False, stop_loss_trigger_price=0, stop_loss_order_price=0, enable_stop_gain=False, stop_gain_trigger_price=0, stop_gain_order_price=0):
+@timed('createOrder', stageLabels)
+def createOrder(_symbol, _amount, _side, _price=None, _ordType=None, _tdMode=None, enable_stop_loss=False, stop_loss_trigger_price=0, stop_loss_order_price=0, enable_stop_gain=False, stop_gain_trigger_price=0, stop_gain_order_price=0, _sltp=True, _reduceOnly=False, _sltpAmount=None):
     try:
         # 挂单
+        # 按交易对精度本地取整，不合规的订单不发给交易所
+        _amount, _price, sizeErr = orderSize(_symbol, _amount, _price, _ordType)
+        if sizeErr is not None:
+            logging.info("createOrder rejected locally: " + sizeErr)
+            return False, sizeErr
         logging.info("createOrder:symbol:{symbol},ordType:{ordType},side:{side},amount:{amount},price:{price}".format(symbol=_symbol, side=_side, amount=_amount,price=_price, ordType=_ordType))
-        if _ordType == 'limit':
-            res = exchange.create_limit_order(symbol=_symbol, side=_side, amount=_amount,price=_price)
-        else : #market
-            res = exchange.create_market_order(symbol=_symbol, side=_side, amount=_amount)
-
-        logging.info("createOrder res:{res}".format(res=res))
-        global lastOrdId,config
+        _orderParams = {'reduceOnly': True} if _reduceOnly else {}
+        _protect = _sltp and not _reduceOnly and (config['trading']['enable_stop_loss'] or config['trading']['enable_stop_gain'])
+        # 等待成交后再挂的止盈止损种类
+        _missing = ['stopLoss', 'takeProfit'] if _protect else []
+        with priority(CLOSE if _reduceOnly else OPEN):
+            # attached 模式下止盈止损按参考价（信号价格，没有则取最新成交价）计算，与开仓单同一批次提交；
+            # 开仓确认不代表止盈止损已生效，没被接受的由 fillWatcher 成交后补挂
+            _refPrice = None
+            if _protect and sltpMode == 'attached':
+                try:
+                    _refPrice = referencePrice(exchange, _symbol, _price)
+                except Exception as e:
+                    logging.error("createOrder referencePrice err: " + str(e))
+            if _refPrice is not None:
+                stopLoss, takeProfit = protectionPrices(_side, _refPrice, *protectionPercents(),
+                                                        rules=marketStore.rules.get(_symbol))
+                entry = {'symbol': _symbol, 'type': 'limit' if _ordType == 'limit' else 'market', 'side': _side,
+                         'amount': _amount, 'price': _price if _ordType == 'limit' else None, 'params': _orderParams}
+                res, placed, _missing = placeProtected(exchange, adapter, entry, stopLoss, takeProfit, amount=_sltpAmount)
+                for p in placed:
+                    positionBook.onOpenOrder(_symbol)
+                    orderStates.get(_symbol).lastAlgoOrdId = p['id']
+            elif _ordType == 'limit':
+                res = exchange.create_limit_order(symbol=_symbol, side=_side, amount=_amount,price=_price, params=_orderParams)
+            else : #market
+                res = exchange.create_market_order(symbol=_symbol, side=_side, amount=_amount, params=_orderParams)
+
+        logging.info("createOrder res:{res}".format(res=res if logPayloads() else orderSummary(res)))
+        positionBook.onOrder(_symbol, _side, _amount, res)
         lastOrdId = res['id']
-        # 如果止盈止损
-        if config['trading']['enable_stop_loss'] or config['trading']['enable_stop_gain']:
-            try:
-                _thread.start_new_thread(sltpThread, (lastOrdId, _side, _symbol, _amount, _tdMode, config))
-            except:
-                logging.error("Error: unable to run sltpThread")
+        orderStates.get(_symbol).lastOrdId = lastOrdId
+        # 没能随开仓单挂上的止盈止损，交给 fillWatcher 等待成交后补挂，新开仓会取代同一交易对尚未成交的旧任务
+        if _missing:
+            watchSlTpOrder({'oid': str(lastOrdId), 'symbol': _symbol, 'side': _side, 'amount': _sltpAmount or _amount,
+                            'tdMode': _tdMode, 'created': time.time(), 'timeout': fillWatcher.timeout,
+                            'protect': _missing})
         return True, "create order successfully"
     except Exception as e:
         logging.error("createOrder " + str(e))
+        positionBook.markDirty(_symbol)
         return False, str(e)
 
 
 # 获取公共数据，包含合约面值等信息
-def initInstruments():
-    c = 0
-    #logging.info(exchange.load_markets(params={"symbol":"BTCUSDT"}))
+# 先读本地缓存，过期后在后台刷新，启动时不需要访问交易所
+def fetchInstruments():
+    instruments = {}
     try:
         # 获取永续合约基础信息
-        swapInstrumentsRes = exchange.fetch_markets(params={"type":"spot"})
-        #logging.info("swapInstrumentsRes:{res}".format(res=swapInstrumentsRes))
-        if len(swapInstrumentsRes) > 0:
-            global swapInstruments
-            swapInstruments = swapInstrumentsRes
-            c = c + 1
+        instruments['spot'] = exchange.fetch_markets(params={"type":"spot"})
     except Exception as e:
         logging.error("fetch_markets SWAP " + str(e))
     try:
         # 获取交割合约基础信息
-        futureInstrumentsRes = exchange.fetch_markets(params={"type": "future"})
-        #logging.info("futureInstrumentsRes:{res}".format(res=futureInstrumentsRes))
-        if len(futureInstrumentsRes) > 0:
-            global futureInstruments
-            futureInstruments = futureInstrumentsRes
-            c = c + 1
+        instruments['future'] = exchange.fetch_markets(params={"type": "future"})
     except Exception as e:
         logging.error("fetch_markets FUTURES " + str(e))
-    return c >= 2
+    return instruments
+
+marketStore = sharedStore('binance', fetchInstruments,
+                          cachePath=config['trading'].get('market_cache', './binance_markets.cache.json'),
+                          ttl=float(config['trading'].get('market_cache_ttl', 3600)),
+                          compact=False, precisionMode=exchange.precisionMode, tickOverrides=min_price_point,
+                          defaultType=exchange.options.get('defaultType', 'future'))
+
+def initInstruments():
+    marketStore.start()
+    return True
+
+# 执行队列的键：交易对按市场信息归一，BTCUSDT 与 BTC/USDT:USDT 共用一个队列
+def queueKey(_symbol):
+    return 'binance', accountConfig['name'], marketStore.rules.canonical(_symbol)
+
+# 数量按最小下单单位向下取整，限价单价格按 tick size 取整；返回 (数量, 价格, 错误)
+# 市价单没有价格，不检查最小名义价值
+def orderSize(_symbol, _amount, _price=None, _ordType=None):
+    _amount, _limitPrice, err = marketStore.rules.normalize(_symbol, _amount, _price if _ordType == 'limit' else None)
+    return _amount, (_limitPrice if _ordType == 'limit' else _price), err
 
 # 将 amount 币数转换为合约张数
 # 币的数量与张数之间的转换公式
@@ -249,65 +387,100 @@ def initInstruments():
 # 1、币本位合约：币数=张数*面值*合约乘数/标记价格
 # 2、U本位合约：币数=张数*面值*合约乘数*标记价格
 # 交割合约和永续合约合约乘数都是1
+# 面值和最小下单单位取自启动时预先计算的精度表
 def amountConvertToSZ(_symbol, _amount, _price, _ordType):
-    _symbol = _symbol.upper()
-    _symbolSplit = _symbol.split("-")
-    isSwap = _symbol.endswith("SWAP")
-    # 获取合约面值
-    def getFaceValue(_symbol):
-        instruments = swapInstruments if isSwap else futureInstruments
-        for i in instruments:
-            if i['id'].upper() == _symbol:
-                logging.info(i)
-                return float(i['info']['price'])
-        return False
-    faceValue = getFaceValue(_symbol)
-    if faceValue is False:
+    rules = marketStore.rules.get(_symbol)
+    if rules is None:
         raise Exception("getFaceValue error.")
     # 币本位合约：张数 = 币数 / 面值 / 合约乘数 * 标记价格
     # U本位合约：张数 = 币数 / 面值 / 合约乘数
-    sz = float(_amount) / faceValue / 1
-    if _symbolSplit[1] == "USD":
-        # 如果是市价单，获取一下最新标记价格
-        if _ordType.upper() == "MARKET":
-            #_price = exchange.publicGetPublicMarkPrice(params={"instId": _symbol,"instType":("SWAP" if isSwap else "FUTURES")})['data'][0]['markPx']
-            _price = 1000
-        sz = sz * float(_price)
-    return int(sz)
+    if rules.inverse and (_price is None or str(_ordType).upper() == "MARKET"):
+        # 市价单用最新标记价格
+        ticker = exchange.fetch_ticker(_symbol)
+        _price = (ticker.get('info') or {}).get('markPrice') or ticker['last']
+    return rules.contracts(_amount, _price)
 
 
 # 初始化杠杆倍数
 setLever(symbol, tdMode, lever)
 
 app = Flask(__name__)
+# 在响应中附带各阶段耗时
+returnTimings = str(config['service'].get('return_timings', False)).lower() == "true"
+readiness = sharedReadiness()
+
+# 重复/重试的TradingView告警直接返回首次的响应
+dedupConfig = config.get('dedup', {})
+dedupEnabled = str(dedupConfig.get('enabled', True)).lower() == "true"
+dedupCache = DedupCache(maxSize=int(dedupConfig.get('max_size', 4096)),
+                        ttl=float(dedupConfig.get('ttl', 60)),
+                        waitTimeout=float(dedupConfig.get('wait_timeout', 30)),
+                        fingerprintTtl=float(dedupConfig.get('fingerprint_ttl', 10)),
+                        name='binance')
 
 @app.before_request
+def startTrace():
+    beginTrace()
+
+@app.before_request
+@timed('before_req', lambda: stageLabels())
 def before_req():
+    if request.path in ('/metrics', '/ready'):
+        return
+    # 快速启动时服务还在初始化
+    if readiness.isStarting('binance'):
+        abort(503)
     if request.json is None:
         abort(400)
     #if request.remote_addr not in ipWhiteList:
     #    abort(403)
     if "apiSec" not in request.json or request.json["apiSec"] != apiSec:
         abort(401)
+    if dedupEnabled:
+        return checkDuplicate(request.json)
+
+
+def checkDuplicate(payload):
+    key = dedupCache.fingerprint(request.path, payload=payload)
+    owner, entry = dedupCache.claim(key)
+    if not owner:
+        cached = dedupCache.wait(entry)
+        if cached is not None:
+            logging.info("duplicate alert {key}, return cached response".format(key=key))
+            body, status, contentType = cached
+            return app.response_class(body, status=status, content_type=contentType, headers={'X-Dedup': 'hit'})
+        # 首次请求失败，本次重新执行
+        owner, entry = dedupCache.claim(key)
+    if owner:
+        g.dedup = (key, entry)
 
 
 @app.route('/order', methods=['POST'])
 def order():
+    # createOrderRes 为 None 表示本次没有下单（平仓、撤单、已在目标仓位等），False 才是下单失败
     ret = {
         "cancelLastOrder": False,
         "closedPosition": False,
-        "createOrderRes": False,
+        "createOrderRes": None,
         "msg": ""
     }
     #logging.info("fetch_orders={orderlist}".format(orderlist=exchange.fetch_orders(symbol="ETH-PERP", limit=200)))
 
+    # 请求写入日志（apiSec 已屏蔽），bench/replay_webhooks.py 可据此回放
+    logging.info("order request:{request}".format(
+        request=requestText(request.get_data(as_text=True), request.get_json(silent=True))))
     # 获取参数 或 填充默认参数
     _params = request.json
     if "apiSec" not in _params or _params["apiSec"] != apiSec:
         ret['msg'] = "Permission Denied."
         return ret
+    # 多腿信号：一起校验后批量下单，返回每一腿的结果
+    if "legs" in _params:
+        return orderLegs(ret, _params)
     if "symbol" not in _params:
         _params["symbol"] = symbol
+    # 同一交易对的不同写法（BTCUSDT、BTC/USDT:USDT）统一成一个，共用执行队列、挂单记录和持仓
+    _params["symbol"] = marketStore.rules.canonical(_params["symbol"])
     if "amount" not in _params:
         _params["amount"] = amount
     if "tdMode" not in _params:
@@ -319,75 +492,247 @@ def order():
     if "lever" in _params and _params['lever'] != lever:
         setLever(_params['symbol'], _params['lever'], _params['lever'])
 
+    # 同一账户同一交易对的信号排队依次执行，不同交易对并行
+    try:
+        future = executor.submit(queueKey(_params['symbol']), runOrder, ret, _params)
+    except QueueFullError as e:
+        ret['msg'] = str(e)
+        return ret, 429
+    return future.result()
+
+# 多腿信号直接下单，不撤单也不先平仓；交易所支持时走批量下单接口
+# 数量/价格按各交易对精度取整，占住每一腿交易对的执行队列后再下单
+def orderLegs(ret, _params):
+    legs, err = parseLegs(_params['legs'], _params.get('symbol', symbol))
+    if err is None:
+        legs, err = sizeLegs(legs, marketStore.rules)
+    if err is not None:
+        ret['msg'] = err
+        return ret
+    try:
+        future = executor.submitAll([queueKey(leg['symbol']) for leg in legs], runLegs, ret, legs)
+    except QueueFullError as e:
+        ret['msg'] = str(e)
+        return ret, 429
+    return future.result()
+
+# 在所有腿的交易对执行队列中运行
+def runLegs(ret, legs):
+    results = submitLegs(exchange, adapter, legs)
+    recordLegs(results, positionBook, orderStates)
+    ret['legs'] = results
+    ret['createOrderRes'] = all(res['ok'] for res in results)
+    ret['msg'] = "{ok}/{count} legs placed".format(ok=sum(1 for res in results if res['ok']), count=len(results))
+    sendMessage("binance_trading.py: {ret}".format(ret=ret))
+    return ret
+
+# 在该交易对的执行队列中运行
+def runOrder(ret, _params):
+    state = orderStates.get(_params['symbol'])
     # 注意：开单的时候会先把原来的仓位平掉，然后再把你的多单挂上
-    global lastOrdType
-    global lastOrdPosition
+    # 目标仓位模式：按目标仓位和当前持仓的差额只下一笔单
+    if _params.get('mode', executionMode) == TARGET:
+        return orderTarget(ret, _params)
     #如果Position 相同但方向不同則改執行平倉
-    if _params['position'] is not None and lastOrdPosition is not None:
-        if lastOrdPosition ==  _params['position'] or _params['position'] == "flat":
-            if lastOrdType is not None and lastOrdType !=  _params['side']:
+    if _params['position'] is not None and state.lastOrdPosition is not None:
+        if state.lastOrdPosition ==  _params['position'] or _params['position'] == "flat":
+            if state.lastOrdType is not None and state.lastOrdType !=  _params['side']:
                 logging.info("Change make close  since position[{position}] and side[{lastOrdType}:{side}] ".format(
-                position=_params['position'], lastOrdType=lastOrdType, side=_params['side']))
+                position=_params['position'], lastOrdType=state.lastOrdType, side=_params['side']))
                 _params['side'] = "close"
 
 
     if _params['side'].lower() in ["buy", "sell"]:
         # 不允许本次开单和上次开单是一样的方向
-        if config['trading']['signal_reset'] == False and lastOrdType is not None:
-            if lastOrdType == "sell" and _params['side'] == "sell":
+        if config['trading']['signal_reset'] == False and state.lastOrdType is not None:
+            if state.lastOrdType == "sell" and _params['side'] == "sell":
                 ret['msg'] = "sell side duplacated"
                 return ret
-            if lastOrdType == "buy" and _params['side'] == "buy":
+            if state.lastOrdType == "buy" and _params['side'] == "buy":
                 ret['msg'] = "buy side duplacated"
                 return ret
         # 先取消未成交的挂单 然后平仓
-        ret["cancelLastOrder"] = cancelLastOrder(_params['symbol'], lastOrdId)
+        ret["cancelLastOrder"] = cancelLastOrder(_params['symbol'], state.lastOrdId)
         ret["closedPosition"] = closeAllPosition(_params['symbol'], _params['tdMode'])
         #return ret
         # 开仓
         #sz = amountConvertToSZ(_params['symbol'], _params['amount'], _params['price'], _params['ordType'])
-        if _params['amount'] < 0.001:
-            ret['msg'] = 'Amount is too small. Please increase amount.'
+        _amount, _price, sizeErr = orderSize(_params['symbol'], _params['amount'], _params['price'], _params['ordType'])
+        if sizeErr is not None:
+            ret['msg'] = sizeErr
         else:
-            ret["createOrderRes"], ret['msg'] = createOrder(_symbol=_params['symbol'], _amount=_params['amount'],
-                                                            _price=_params['price'], _side=_params['side'],
+            ret["createOrderRes"], ret['msg'] = createOrder(_symbol=_params['symbol'], _amount=_amount,
+                                                            _price=_price, _side=_params['side'],
                                                 _ordType=_params['ordType'], _tdMode=_params['tdMode'])
-            lastOrdType = _params['side']
+            state.lastOrdType = _params['side']
     # 平仓
     elif _params['side'].lower() in ["close"] :
-        lastOrdType = None
+        state.lastOrdType = None
         # 先取消未成交的挂单 然后平仓
-        ret["cancelLastOrder"] = cancelLastOrder(_params['symbol'], lastOrdId)
+        ret["cancelLastOrder"] = cancelLastOrder(_params['symbol'], state.lastOrdId)
         ret["closedPosition"] = closeAllPosition(_params['symbol'], _params['tdMode'])
 
     # 取消挂单
     elif _params['side'].lower() in ["cancel"]:
-        lastOrdType = None
-        ret["cancelLastOrder"] = cancelLastOrder(_params['symbol'], lastOrdId)
+        state.lastOrdType = None
+        ret["cancelLastOrder"] = cancelLastOrder(_params['symbol'], state.lastOrdId)
     else:
         pass
 
     if _params['position'] is not None:
-        lastOrdPosition = _params['position']
+        state.lastOrdPosition = _params['position']
     #logging.info("new fetch_orders={orderlist}".format(orderlist=exchange.fetch_orders(symbol="ETH-PERP", limit=200)))
     msg = "binance_trading.py: {ret}".format(ret=ret)
     sendMessage(msg)
     return ret
 
-def sendMessage(msg):
-    messageSender = None
+# 目标仓位模式：撤单（本地记录无挂单时跳过）后一笔订单从当前持仓调整到目标持仓
+def orderTarget(ret, _params):
+    state = orderStates.get(_params['symbol'])
+    target = targetPosition(_params)
+    if target is None:
+        ret['msg'] = "Unknown target position"
+        return ret
     try:
-        messageSender = MessageSender.MessageSender(configPath='./core/MessageSender.cfg')
-        messageSender.sendMessageToMq(msg)
+        current = positionBook.position(_params['symbol'])
     except Exception as e:
-        logging.error("sendMessage err:" + str(e))
-    finally:
-        if messageSender is not None:
-           messageSender.Stop()
+        logging.error("orderTarget position err: " + str(e))
+        ret['msg'] = str(e)
+        return ret
+    plan = planTargetOrder(current, target)
+    logging.info("orderTarget:symbol:{symbol},current:{current},target:{target},plan:{plan}".format(
+        symbol=_params['symbol'], current=current, target=target, plan=plan))
+    if plan is None:
+        # 无需下单，已挂的止盈止损保持不动
+        ret['msg'] = "position already at target"
+    else:
+        ret["cancelLastOrder"] = cancelLastOrder(_params['symbol'], state.lastOrdId)
+        _side, _amount, _reduceOnly = plan
+        ret["closedPosition"] = target == 0
+        ret["createOrderRes"], ret['msg'] = createOrder(_symbol=_params['symbol'], _amount=_amount,
+                                                        _price=_params.get('price'), _side=_side,
+                                                        _ordType=_params.get('ordType'), _tdMode=_params['tdMode'],
+                                                        _sltp=target != 0 and not _reduceOnly, _reduceOnly=_reduceOnly,
+                                                        _sltpAmount=abs(target))
+        # 减仓单不带止盈止损，上面的撤单已撤掉原来的，按剩余仓位重新挂
+        if _reduceOnly and target != 0 and ret["createOrderRes"]:
+            protectPosition(_params['symbol'], "buy" if target > 0 else "sell", abs(target))
+    state.lastOrdType = None if target == 0 else ("buy" if target > 0 else "sell")
+    if _params.get('position') is not None:
+        state.lastOrdPosition = _params['position']
+    msg = "binance_trading.py: {ret}".format(ret=ret)
+    sendMessage(msg)
+    return ret
+
+@app.after_request
+def finishTrace(response):
+    timings = endTrace()
+    if timings is not None:
+        registry.observe('trading_request_seconds', timings['total'] / 1000.0, exchange='binance', route=request.path)
+        if response.is_json and (returnTimings or request.args.get('timings')):
+            data = response.get_json()
+            if isinstance(data, dict):
+                data['timings'] = timings
+                response.set_data(json.dumps(data))
+    return response
+
+
+# 在附加耗时之前缓存响应（after_request 逆序执行）；下单失败的响应不缓存，重试时重新下单
+@app.after_request
+def storeDuplicate(response):
+    claim = g.pop('dedup', None)
+    if claim is not None:
+        if response.status_code < 400 and not (response.is_json and reportsFailure(response.get_json(silent=True))):
+            dedupCache.store(claim[0], claim[1], (response.get_data(), response.status_code, response.content_type))
+        else:
+            dedupCache.release(*claim)
+    return response
+
+
+@app.teardown_request
+def releaseDuplicate(exc):
+    claim = g.pop('dedup', None)
+    if claim is not None:
+        dedupCache.release(*claim)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_handler():
+    return registry.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+# 启动完成前返回 503，同进程的各服务共用
+@app.route('/ready', methods=['GET'])
+def ready_handler():
+    return readiness.render()
+
+
+@timed('sendMessage', lambda msg: stageLabels())
+def sendMessage(msg):
+    notifier.send(msg)
+
+# 加载市场信息、启动持仓对账并恢复未完成的止盈止损任务，单独运行和 trading_service.py 共用
+def startService():
+    # 初始化交易币对基础信息
+    if initInstruments() is False:
+        msg = "初始化货币基础信息失败，请重试"
+        raise Exception(msg)
+    clientManager.register(exchange, accountConfig['name'])
+    positionBook.start()
+    restoreSlTpOrders()
+    if str(config.get('reload', {}).get('enabled', True)).lower() == "true":
+        startConfigWatcher()
+
+
+# 只在启动时读取的配置段，热加载时有变化只提示需要重启
+RESTART_SECTIONS = ('account', 'rate_limit', 'clients', 'executor', 'dedup', 'state', 'logging', 'notify',
+                    'fill_watcher')
+reloadLock = threading.Lock()
+configWatcher = None
+
+# 热加载：重新读取配置文件，[trading] 和 apiSec/ip_white_list 立即生效，交易所客户端、持仓和下单状态保持不变
+def reloadConfig():
+    global config, apiSec, ipWhiteList, symbol, amount, tdMode, lever, min_price_point, executionMode, sltpMode
+    with reloadLock:
+        start = time.perf_counter()
+        conf = loadConfig()
+        if conf is None:
+            raise Exception("配置文件不存在")
+        # 先全部解析校验，出错时保持原配置
+        trading = conf['trading']
+        newLever = (trading['symbol'], trading['td_mode'], trading['lever'])
+        newPricePoints = json.loads(trading['min_price_point'])
+        for section in RESTART_SECTIONS:
+            if conf.get(section, {}) != config.get(section, {}):
+                logging.warning("[reloadConfig] [{section}] 已修改，重启后生效".format(section=section))
+        leverChanged = newLever != (symbol, tdMode, lever)
+        # 一次性切换
+        config = conf
+        apiSec = conf['service']['api_sec']
+        ipWhiteList = conf['service']['ip_white_list'].split(",")
+        symbol, amount, tdMode, lever = trading['symbol'], trading['amount'], trading['td_mode'], trading['lever']
+        min_price_point = newPricePoints
+        executionMode = trading.get('execution_mode', SEQUENTIAL)
+        sltpMode = trading.get('sltp_mode', 'after_fill')
+        positionBook.ttl = float(trading.get('position_ttl', 30))
+        positionBook.reconcileInterval = float(trading.get('reconcile_interval', 15))
+        marketStore.setTickOverrides(min_price_point)
+        if leverChanged:
+            setLever(symbol, tdMode, lever)
+        logging.info("[reloadConfig] binance 配置已更新，耗时{ms}ms".format(ms=round((time.perf_counter() - start) * 1000, 3)))
+
+
+def startConfigWatcher():
+    global configWatcher
+    if configWatcher is None:
+        configWatcher = ConfigWatcher(['./binance_config.json', './binance_config.ini'], reloadConfig,
+                                      interval=float(config.get('reload', {}).get('interval', 1)),
+                                      name='binance').start()
+        installSignal()
+    return configWatcher
+
 
 if __name__ == '__main__':
     try:
-        ip = json.load(urllib.request.urlopen('http://httpbin.org/ip'))['origin']
         logging.info("*区块普拉斯(Youtube/Bilibili)自动交易服务端\n")
         logging.info("①.此程序仅支持Binance交易所")
         logging.info(
@@ -397,15 +742,20 @@ if __name__ == '__main__':
         logging.info(
             "系统接口服务即将启动！服务监听地址{listenHost}:{listenPort}".format(
                 listenPort=listenPort, listenHost=listenHost))
-        logging.info(
-            "接口外网访问地址：http://{ip}:{listenPort}/order".format(
-                listenPort=listenPort, ip=ip))
+        # 外网地址查询在后台进行，有超时，不阻塞启动
+        if str(config['service'].get('public_ip', True)).lower() == "true":
+            announcePublicIp("接口外网访问地址：http://{ip}:" + str(listenPort) + "/order",
+                             timeout=float(config['service'].get('public_ip_timeout', 3)))
         logging.info("请不要关闭这个黑色窗口！否则交易服务将自动停止，接口无法使用！")
 
-        # 初始化交易币对基础信息
-        if initInstruments() is False:
-            msg = "初始化货币基础信息失败，请重试"
-            raise Exception(msg)
+        # 快速启动：先监听端口，初始化在后台完成后 /ready 返回 200
+        if str(config['service'].get('fast_start', False)).lower() == "true":
+            if str(config.get('reload', {}).get('enabled', True)).lower() == "true":
+                # SIGHUP 只能在主线程注册，配置监视在后台初始化线程中启动
+                installSignal()
+            startInBackground('binance', startService, budget=float(config['service'].get('start_budget', 0)))
+        else:
+            startService()
         # 启动服务
         app.run(debug=debugMode, port=listenPort, host=listenHost)
     except Exception as e:
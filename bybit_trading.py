@@ -1,64 +1,148 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import configparser
-from re import M, T
-import ccxt
 import logging
 from flask import Flask
-from flask import request, abort
+from flask import request, abort, g
 import json
-import urllib.request
 import os
-import requests
-import core.MessageSender as MessageSender
-
-if os.path.exists('./bybit_config.ini'):
+import time
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from notifier import sharedNotifier
+from exchange_adapters import adapterFor
+from order_legs import parseLegs, sizeLegs, submitLegs, recordLegs
+from protective_orders import protectionPrices, referencePrice, placeProtected, placeProtection
+from client_lifecycle import sharedClientManager
+from rate_limiter import CLOSE, OPEN, priority, prioritized, sharedScheduler, install as installScheduler
+from market_store import sharedStore
+from position_book import PositionBook
+from fill_watcher import FillWatcher
+from target_execution import SEQUENTIAL, TARGET, targetPosition, planTargetOrder
+from keyed_executor import sharedExecutor, QueueFullError
+from shard_router import currentShard, shardOf, shardPath, accountGroups
+from config_reload import ConfigWatcher, installSignal
+from startup import sharedReadiness, startInBackground, announcePublicIp
+from order_state import OrderStateBook
+from state_store import StateStore
+from dedup import DedupCache, reportsFailure
+from alert_templates import loadTemplates, templateSections
+from log_pipeline import setupLogging, logPayloads, orderSummary, requestText
+from metrics import registry, timed, beginTrace, endTrace, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+CONFIG_PATH = './bybit_config.ini'
+if os.path.exists(CONFIG_PATH):
     config = configparser.ConfigParser()
-    config.read("./bybit_config.ini", encoding="UTF-8")
+    config.read(CONFIG_PATH, encoding="UTF-8")
 else:
     logging.info("config.ini not found, program will exit")
     exit()
+# url_num - 1 -> agent; None for accounts another worker owns when run by shard_router.py
 tradingAgents = []
+# [group.<name>] members, checked here so a bad entry fails the start instead of every request
+accountGroupMembers = accountGroups(config)
+shardIndex, shardCount, shardBy = currentShard()
+# reloadConfig() swaps agents and settings in place while the service runs
+reloadLock = threading.Lock()
+configWatcher = None
+
+# swap/futures market lists, only called by the shared market store
+def fetchInstruments(exchange):
+    instruments = {}
+    try:
+        # 获取永续合约基础信息
+        instruments['spot'] = exchange.fetch_markets(params={"type":"spot"})
+    except Exception as e:
+        logging.error("fetch_markets SWAP " + str(e))
+    try:
+        # 获取交割合约基础信息
+        instruments['future'] = exchange.fetch_markets(params={"type": "future"})
+    except Exception as e:
+        logging.error("fetch_markets FUTURES " + str(e))
+    return instruments
+
+
+# build and check one agent, run concurrently for every account.sub.* section
+def buildAgent(accountConfig, conf=None):
+    tradingAgent = TradingAgent(config=conf or config, accountConfig=accountConfig)
+    #Initialize Instruments
+    if tradingAgent.initInstruments() is False:
+        msg = "Initialize Instruments failed"
+        raise Exception(msg)
+    tradingAgent.checkCredentials()
+    clientManager.register(tradingAgent.exchange, accountConfig.get('name'))
+    tradingAgent.positionBook.start()
+    return tradingAgent
+
+
+# metric labels of an agent method called as (self, _symbol, ...)
+def agentLabels(agent, _symbol=None, *args, **kwargs):
+    return {'exchange': agent.adapter.id, 'account': agent.accountConfig.get('name'), 'symbol': kwargs.get('_symbol', _symbol)}
+
 
 class TradingAgent(object):
-    def __init__(self, config, accountConfig):
+    def __init__(self, config, accountConfig, exchange=None):
         self.accountConfig = accountConfig
-        if accountConfig is not None:
-            self.exchange = ccxt.bybit(config={
-                'apiKey': accountConfig.get('apiKey'),
-                'secret': accountConfig.get('secret'),
-                'verbose': False,  # for debug output
-                'options': {
-                    'defaultType': 'future',
-                },
-            })
-        else:
+        if accountConfig is None:
             raise Exception("accountConfig not found, program will exit")
+        # any ccxt exchange, bybit unless the account section sets exchange = <ccxt id>
+        self.adapter = adapterFor(accountConfig.get('exchange') or 'bybit')
+        if exchange is not None:
+            self.exchange = exchange
+        else:
+            self.exchange = self.adapter.create(accountConfig)
+            # every agent of one exchange shares a weight-aware token bucket (same IP)
+            if config.getboolean('rate_limit', 'enabled', fallback=True):
+                # sharded workers split the IP's budget between them
+                installScheduler(self.exchange, sharedScheduler(self.adapter.id,
+                    rate=config.getfloat('rate_limit', 'rate', fallback=1000.0 / self.exchange.rateLimit) / shardCount,
+                    burst=config.getfloat('rate_limit', 'burst', fallback=10)))
+        # last order id / type / side / position per symbol
+        self.orderStates = OrderStateBook(account=accountConfig.get('name'), store=stateStore)
+        # local position/open-order view, reconciled against the exchange in the background
+        self.positionBook = PositionBook(self.exchange, account=accountConfig.get('name'))
+        # entries whose stop loss / take profit could not go with them; threads start on first use,
+        # jobs are kept in the state store until they finish (see watchFill / restoreFillJobs)
+        self.fillWatcher = FillWatcher(self.exchange,
+                                       minInterval=config.getfloat('fill_watcher', 'min_interval', fallback=0.5),
+                                       maxInterval=config.getfloat('fill_watcher', 'max_interval', fallback=8),
+                                       timeout=config.getfloat('fill_watcher', 'timeout', fallback=300), workers=1,
+                                       onFinished=lambda job: stateStore.deleteJob(accountConfig.get('name'), job.oid))
+        self.applySettings(config)
+
+    # [service]/[trading] values, also re-applied to the running agents by reloadConfig()
+    def applySettings(self, config):
         self.config = config
         self.apiSec = config.get('service', 'api_sec')
         self.listenHost = config.get('service', 'listen_host')
         self.listenPort = config.get('service', 'listen_port')
         self.debugMode = config.get('service', 'debug_mode')
-        self.ipWhiteList = config.get('service', 'ip_white_list').split(",")
-        self.lastOrdId = 0 #last order id
-        self.lastOrdType = None #limit/market/market-limit
-        self.lastOrdSide = None #buy/sell
-        self.lastOrdPosition = None #long/short/flat
+        self.executionMode = config.get('trading', 'execution_mode', fallback=SEQUENTIAL)
+        # stop loss / take profit percentages sent with every entry, None when disabled
+        self.stopLossPct = config.getfloat('trading', 'stop_loss_trigger_price', fallback=0) \
+            if config.getboolean('trading', 'enable_stop_loss', fallback=False) else None
+        self.takeProfitPct = config.getfloat('trading', 'stop_gain_trigger_price', fallback=0) \
+            if config.getboolean('trading', 'enable_stop_gain', fallback=False) else None
+        self.positionBook.ttl = config.getfloat('trading', 'position_ttl', fallback=30)
+        self.positionBook.reconcileInterval = config.getfloat('trading', 'reconcile_interval', fallback=15)
 
     # close all position
+    @timed('closeAllPosition', agentLabels)
+    @prioritized(CLOSE)
     def closeAllPosition(self, _symbol):
         logging.info("[closeAllPosition] symbol:{symbol}".format(symbol=_symbol))
         try:
-            # get a list of all open positions
-            positions = self.exchange.fetch_positions(symbols=[_symbol])
-            logging.info("[closeAllPosition] positions: " + str(positions))
+            # cached position unless it is stale or flagged, then the exchange is asked
+            contracts = self.positionBook.position(_symbol)
+            logging.info("[closeAllPosition] position: {contracts}".format(contracts=contracts))
             res = "res: done"
-            if positions[0]['contracts'] > 0.0 :
-                if positions[0]['side'] == "long":
+            if contracts != 0.0 :
+                if contracts > 0:
                     _side = "sell"
                 else :
                     _side = "buy"
-                res = self.createOrder(_symbol=_symbol, _amount=positions[0]['contracts'], _side=_side)
+                res = self.createOrder(_symbol=_symbol, _amount=abs(contracts), _side=_side, _sltp=False)
             
             logging.info("[closeAllPosition] res: " + json.dumps(res))
 
@@ -68,70 +152,180 @@ class TradingAgent(object):
             return False
 
     # create order
-    def createOrder(self, _symbol, _amount, _side, _price=None, _ordType='market'):
+    @timed('createOrder', agentLabels)
+    def createOrder(self, _symbol, _amount, _side, _price=None, _ordType='market', _reduceOnly=False, _sltp=True,
+                    _sltpAmount=None):
         try:
             logging.info("[createOrder] symbol:{symbol},side:{side},amount:{amount},price:{price},ordType:{ordType}"
                          .format(symbol=_symbol, side=_side, amount=_amount
                              ,price=_price, ordType=_ordType))
             
+            # round to the market's lot step / tick size, don't spend a round trip on a certain rejection
+            _amount, _price, sizeErr = self.orderSize(_symbol, _amount, _price, _ordType)
+            if sizeErr is not None:
+                logging.info("[createOrder] rejected locally: " + sizeErr)
+                return False, sizeErr
+
             res = None
-            if _ordType == 'limit': #limit
-                #check price is valid
-                if _price is None:
+            orderParams = {'reduceOnly': True} if _reduceOnly else {}
+            protect = _sltp and not _reduceOnly and bool(self.stopLossPct or self.takeProfitPct)
+            with priority(CLOSE if _reduceOnly else OPEN):
+                if _ordType == 'limit' and _price is None: #check price is valid
                     return False, "price is not valid"
-                res = self.exchange.create_limit_order(symbol=_symbol, side=_side, amount=_amount,price=_price)
-            elif _ordType == 'market' : #market
-                res = self.exchange.create_market_order(symbol=_symbol, side=_side, amount=_amount)
-            elif _ordType == 'market-limit' : #market-limit
-                return False, "market-limit not support yet"
+                # protection not sent with the entry, placed once it fills
+                missing = ['stopLoss', 'takeProfit'] if protect and _ordType in ('limit', 'market') else []
+                refPrice = None
+                if missing:
+                    try:
+                        refPrice = referencePrice(self.exchange, _symbol, _price)
+                    except Exception as e:
+                        logging.error("[createOrder] referencePrice err: " + str(e))
+                if refPrice is not None:
+                    # attached (bybit) protection rides on the entry, live as soon as the entry is acknowledged
+                    stopLoss, takeProfit = protectionPrices(_side, refPrice, self.stopLossPct, self.takeProfitPct,
+                                                            rules=self.markets.rules.get(_symbol))
+                    entry = {'symbol': _symbol, 'type': _ordType, 'side': _side, 'amount': _amount,
+                             'price': _price if _ordType == 'limit' else None, 'params': orderParams}
+                    res, placed, missing = placeProtected(self.exchange, self.adapter, entry, stopLoss, takeProfit,
+                                                          amount=_sltpAmount)
+                    for p in placed:
+                        self.positionBook.onOpenOrder(_symbol)
+                elif _ordType == 'limit': #limit
+                    res = self.exchange.create_limit_order(symbol=_symbol, side=_side, amount=_amount,price=_price, params=orderParams)
+                elif _ordType == 'market' : #market
+                    res = self.exchange.create_market_order(symbol=_symbol, side=_side, amount=_amount, params=orderParams)
+                elif _ordType == 'market-limit' : #market-limit
+                    return False, "market-limit not support yet"
             
-            logging.info("[createOrder] res:{res}".format(res=res))
-            global lastOrdId,config
+            logging.info("[createOrder] res:{res}".format(res=res if logPayloads() else orderSummary(res)))
+            if res:
+                self.positionBook.onOrder(_symbol, _side, _amount, res)
             if res:
                 lastOrdId = res['id']
+                self.orderStates.get(_symbol).lastOrdId = lastOrdId
+                if missing:
+                    logging.warning("[createOrder] {symbol} entry placed without {missing}, waiting for the fill".format(
+                        symbol=_symbol, missing=','.join(missing)))
+                    self.watchFill({'oid': str(lastOrdId), 'symbol': _symbol, 'side': _side,
+                                    'amount': _sltpAmount or _amount, 'created': time.time(),
+                                    'timeout': self.fillWatcher.timeout, 'protect': missing})
                 return True, "create order successfully,lastOrdId:{lastOrdId}".format(lastOrdId=lastOrdId)
             return False, "create order failed"
         except Exception as e:
             logging.error("[createOrder] err:" + str(e))
+            self.positionBook.markDirty(_symbol)
             return False, str(e)
     
+    # persist the job before handing it to the fill watcher, restoreFillJobs picks it up after a restart
+    def watchFill(self, job, timeout=None, supersede=True):
+        if timeout is None:
+            stateStore.putJob(self.accountConfig.get('name'), job['oid'], job)
+        self.fillWatcher.watch(job['oid'], job['symbol'], job['side'], job['amount'],
+                               onFilled=functools.partial(self.protectFill, _kinds=job.get('protect')),
+                               timeout=timeout, supersede=supersede, created=job['created'])
+
+    # entries still waiting for their fill when the process stopped, with what is left of their timeout
+    def restoreFillJobs(self):
+        jobs = stateStore.loadJobs(self.accountConfig.get('name'))
+        for job in jobs:
+            remaining = job['created'] + job['timeout'] - time.time()
+            self.watchFill(job, timeout=max(remaining, 0), supersede=False)
+        if jobs:
+            logging.info("[restoreFillJobs] accountName:{accountName}, {count} stop loss / take profit jobs restored"
+                         .format(accountName=self.accountConfig.get('name'), count=len(jobs)))
+        return len(jobs)
+
+    # FillWatcher callback: the protection that could not go with the entry, priced off the fill
+    @prioritized(CLOSE)
+    def protectFill(self, job, order, _kinds=None):
+        price = order.get('average') or order.get('price')
+        if not price:
+            return self.protectPosition(job.symbol, job.side, job.amount, _kinds=_kinds)
+        stopLossPct = self.stopLossPct if 'stopLoss' in (_kinds or ()) else None
+        takeProfitPct = self.takeProfitPct if 'takeProfit' in (_kinds or ()) else None
+        stopLoss, takeProfit = protectionPrices(job.side, float(price), stopLossPct, takeProfitPct,
+                                                rules=self.markets.rules.get(job.symbol))
+        placed, missing = placeProtection(self.exchange, self.adapter, job.symbol, job.side, job.amount,
+                                          stopLoss, takeProfit)
+        for p in placed:
+            self.positionBook.onOpenOrder(job.symbol)
+        if missing:
+            logging.error("[protectFill] {symbol} order {oid} filled without {missing}".format(
+                symbol=job.symbol, oid=job.oid, missing=','.join(missing)))
+        return placed
+
+    # stop loss / take profit for the open position (side: buy = long), priced off the last trade
+    @prioritized(CLOSE)
+    def protectPosition(self, _symbol, _side, _amount, _kinds=('stopLoss', 'takeProfit')):
+        stopLossPct = self.stopLossPct if 'stopLoss' in _kinds else None
+        takeProfitPct = self.takeProfitPct if 'takeProfit' in _kinds else None
+        if not (stopLossPct or takeProfitPct):
+            return []
+        try:
+            stopLoss, takeProfit = protectionPrices(_side, referencePrice(self.exchange, _symbol),
+                                                    stopLossPct, takeProfitPct,
+                                                    rules=self.markets.rules.get(_symbol))
+            placed, missing = placeProtection(self.exchange, self.adapter, _symbol, _side, _amount,
+                                              stopLoss, takeProfit)
+        except Exception as e:
+            logging.error("[protectPosition] {symbol} err: {err}".format(symbol=_symbol, err=e))
+            return []
+        for p in placed:
+            self.positionBook.onOpenOrder(_symbol)
+        if missing:
+            logging.warning("[protectPosition] {symbol} position left without {missing}".format(
+                symbol=_symbol, missing=','.join(missing)))
+        return placed
+
     # cancel last order
+    @timed('cancelLastOrder', agentLabels)
+    @prioritized(CLOSE)
     def cancelLastOrder(self, _symbol):
         logging.info("[cancelLastOrder] symbol:{symbol}".format(symbol=_symbol))
         try:
+            # nothing resting according to our book, skip the round trip
+            if self.positionBook.hasOpenOrders(_symbol) is False:
+                logging.info("[cancelLastOrder] res: no open orders")
+                return True
             res = self.exchange.cancel_all_orders(symbol=_symbol,params={})
-            logging.info("[cancelLastOrder] res: " + json.dumps(res))
+            self.positionBook.onCancelAll(_symbol)
+            logging.info("[cancelLastOrder] res: " + (json.dumps(res) if logPayloads() else orderSummary(res)))
             return True
         except Exception as e:
             logging.error("[cancelLastOrder] err: " + str(e))
             return False
 
-    # Get instruments
+    # Get instruments, fetched once per exchange and shared read-only by every agent
     def initInstruments(self):
-        c = 0
         logging.info("[initInstruments] accountName:{accountName}".format(accountName=self.accountConfig.get('name')))
-        #logging.info(exchange.load_markets(params={"symbol":"BTCUSDT"}))
-        try:
-            # 获取永续合约基础信息
-            swapInstrumentsRes = self.exchange.fetch_markets(params={"type":"spot"})
-            #logging.info("swapInstrumentsRes:{res}".format(res=swapInstrumentsRes))
-            if len(swapInstrumentsRes) > 0:
-                global swapInstruments
-                swapInstruments = swapInstrumentsRes
-                c = c + 1
-        except Exception as e:
-            logging.error("fetch_markets SWAP " + str(e))
-        try:
-            # 获取交割合约基础信息
-            futureInstrumentsRes = self.exchange.fetch_markets(params={"type": "future"})
-            #logging.info("futureInstrumentsRes:{res}".format(res=futureInstrumentsRes))
-            if len(futureInstrumentsRes) > 0:
-                global futureInstruments
-                futureInstruments = futureInstrumentsRes
-                c = c + 1
-        except Exception as e:
-            logging.error("fetch_markets FUTURES " + str(e))
-        return c >= 2
+        if self.adapter.id == 'bybit':
+            cachePath = self.config.get('trading', 'market_cache', fallback='./bybit_markets.cache.json')
+        else:
+            cachePath = './{id}_markets.cache.json'.format(id=self.adapter.id)
+        self.markets = sharedStore(self.adapter.id, lambda: fetchInstruments(self.exchange),
+                                   cachePath=cachePath,
+                                   ttl=self.config.getfloat('trading', 'market_cache_ttl', fallback=3600),
+                                   precisionMode=self.exchange.precisionMode,
+                                   defaultType=self.exchange.options.get('defaultType', 'future'))
+        self.markets.start()
+        return True
+
+    # (amount, price, error) rounded with the shared precision tables; market orders skip the notional check
+    def orderSize(self, _symbol, _amount, _price=None, _ordType='market'):
+        limit = _ordType == 'limit'
+        _amount, limitPrice, err = self.markets.rules.normalize(_symbol, _amount, _price if limit else None)
+        return _amount, (limitPrice if limit else _price), err
+
+    # executor key of a symbol; ids and unified symbols of one market share a queue
+    def queueKey(self, _symbol):
+        return self.adapter.id, self.accountConfig.get('name'), self.markets.rules.canonical(_symbol)
+
+    # check the api key locally, and against the exchange when verify_credentials is on
+    def checkCredentials(self):
+        self.exchange.check_required_credentials()
+        if self.config.getboolean('service', 'verify_credentials', fallback=False):
+            self.exchange.fetch_balance()
+        return True
 
     def runOrder(self, ret, _params):
         logging.info("[runOrder] ret:{ret} , _params:{_params}".format(ret=ret, _params=_params))
@@ -139,41 +333,81 @@ class TradingAgent(object):
         #self.lastOrdType = None #limit/market/market-limit
         #self.lastOrdSide = None #buy/sell
         #self.lastOrdPosition = None #long/short/flat
+        if _params.get('mode', self.executionMode) == TARGET:
+            return self.runTargetOrder(ret, _params)
+        state = self.orderStates.get(_params['symbol'])
         try:
             # cancel last order
             ret["cancelLastOrder"] = self.cancelLastOrder(_params['symbol'])
             logging.info("[runOrder] cancelLastOrder res:{res}".format(res=ret))
 
-            if config.getboolean('trading', 'single_reset'):
+            if self.config.getboolean('trading', 'single_reset'):
                 logging.info("[single_reset]")
                 # close all position if last position is different from current position
-                if self.lastOrdSide != _params['side'] or self.lastOrdPosition != _params['position']:
+                if state.lastOrdSide != _params['side'] or state.lastOrdPosition != _params['position']:
                     ret["closedPosition"] = self.closeAllPosition(_params['symbol'])
                     logging.info("[runOrder] single_reset closedPosition res:{res}".format(res=ret))
 
             # close all position if position is flat
             if _params['position'] == 'flat' and ret["closedPosition"] is None:
                 ret["closedPosition"] = self.closeAllPosition(_params['symbol'])
-                self.lastOrdType = _params['ordType']
-                self.lastOrdSide = _params['side']
-                self.lastOrdPosition = _params['position']
+                state.lastOrdType = _params['ordType']
+                state.lastOrdSide = _params['side']
+                state.lastOrdPosition = _params['position']
                 logging.info("[runOrder] closedPosition res:{res}".format(res=ret))
-            elif _params['amount'] < 0.001:
-                ret['msg'] = 'Amount is too small. Please increase amount.'
             else:
-                # create new order
-                ret["createOrderRes"], ret['msg'] = self.createOrder(_symbol=_params['symbol'], _amount=_params['amount'],
-                                                                _price=_params['price'], _side=_params['side'],
-                                                    _ordType=_params['ordType'])
-                self.lastOrdType = _params['ordType']
-                self.lastOrdSide = _params['side']
-                self.lastOrdPosition = _params['position']
-                logging.info("[runOrder] createOrderRes res:{res}".format(res=ret))
+                _amount, _price, sizeErr = self.orderSize(_params['symbol'], _params['amount'], _params.get('price'),
+                                                          _params.get('ordType', 'market'))
+                if sizeErr is not None:
+                    ret['msg'] = sizeErr
+                else:
+                    # create new order
+                    ret["createOrderRes"], ret['msg'] = self.createOrder(_symbol=_params['symbol'], _amount=_amount,
+                                                                         _price=_price, _side=_params['side'],
+                                                                         _ordType=_params['ordType'])
+                    state.lastOrdType = _params['ordType']
+                    state.lastOrdSide = _params['side']
+                    state.lastOrdPosition = _params['position']
+                    logging.info("[runOrder] createOrderRes res:{res}".format(res=ret))
         except Exception as e:
             logging.error("[runOrder] err: {err}".format(err=e))
         return ret
 
-    def orderCommon(self, request):
+    # target mode: the alert is the position we want, one order covers cancel/close/open
+    def runTargetOrder(self, ret, _params):
+        try:
+            state = self.orderStates.get(_params['symbol'])
+            target = targetPosition(_params)
+            if target is None:
+                ret['msg'] = "Unknown target position"
+                return ret
+            current = self.positionBook.position(_params['symbol'])
+            plan = planTargetOrder(current, target)
+            logging.info("[runTargetOrder] symbol:{symbol},current:{current},target:{target},plan:{plan}".format(
+                symbol=_params['symbol'], current=current, target=target, plan=plan))
+            if plan is None:
+                # nothing to trade, the resting stop loss / take profit stay in place
+                ret['msg'] = "position already at target"
+            else:
+                ret["cancelLastOrder"] = self.cancelLastOrder(_params['symbol'])
+                _side, _amount, _reduceOnly = plan
+                ret["closedPosition"] = target == 0
+                ret["createOrderRes"], ret['msg'] = self.createOrder(_symbol=_params['symbol'], _amount=_amount,
+                                                                     _price=_params.get('price'), _side=_side,
+                                                                     _ordType=_params.get('ordType', 'market'),
+                                                                     _reduceOnly=_reduceOnly, _sltp=target != 0,
+                                                                     _sltpAmount=abs(target))
+                # a shrink carries no protection of its own, the cancel above removed the old one
+                if _reduceOnly and target != 0 and ret["createOrderRes"]:
+                    self.protectPosition(_params['symbol'], 'buy' if target > 0 else 'sell', abs(target))
+            state.lastOrdType = _params.get('ordType')
+            state.lastOrdSide = _params.get('side')
+            state.lastOrdPosition = _params.get('position')
+        except Exception as e:
+            logging.error("[runTargetOrder] err: {err}".format(err=e))
+        return ret
+
+    def orderCommon(self, _params):
         logging.info("[order] accountName:{accountName}".format(accountName=self.accountConfig.get('name')))
         ret = {
             "accountName":self.accountConfig.get('name'),
@@ -184,10 +418,11 @@ class TradingAgent(object):
         }
         #logging.info("fetch_orders={orderlist}".format(orderlist=exchange.fetch_orders(symbol="ETH-PERP", limit=200)))
         # Get parameters or fill default parameters
-        _params = request.json
         if "apiSec" not in _params or _params["apiSec"] != self.apiSec:
             ret['msg'] = "Permission Denied."
             return ret
+        if "legs" in _params:
+            return self.orderLegs(ret, _params)
         if "symbol" not in _params:
             ret['msg'] = "Please specify symbol parameter."
             return ret
@@ -201,164 +436,508 @@ class TradingAgent(object):
 
         return self.runOrder(ret, _params)
     
-    def orderLeftTurn(self, request):
-        '''
-        左側拐點｜多方平倉｜45m｜$1606.11
-        左側拐點｜多方進場｜45m｜$1587.74
-        左側拐點｜多方停損｜45m｜$1517.74
-        '''
-        payload = request.get_data().decode('utf-8').split('｜')
-
-        if len(payload) != 0 and '左側拐點' not in payload:
-            logging.info("[orderLeftTurn] not a left turn case ,payload:{payload}".format(payload=payload))
-            return
-        logging.info("[orderLeftTurn] accountName:{accountName}, payload:{payload}".
-                     format(accountName=self.accountConfig.get('name'), payload=payload))
+    # a bundle of plain orders validated together and placed in as few requests as the exchange allows;
+    # runs holding the queue of every leg's symbol (see submitSignal)
+    def orderLegs(self, ret, _params):
+        legs, err = parseLegs(_params['legs'], _params.get('symbol', self.accountConfig.get('default_symbol')))
+        if err is None:
+            legs, err = sizeLegs(legs, self.markets.rules)
+        if err is not None:
+            ret['msg'] = err
+            return ret
+        results = submitLegs(self.exchange, self.adapter, legs)
+        recordLegs(results, self.positionBook, self.orderStates)
+        ret['legs'] = results
+        ret['createOrderRes'] = all(res['ok'] for res in results)
+        ret['msg'] = "{ok}/{count} legs placed".format(ok=sum(1 for res in results if res['ok']), count=len(results))
+        return ret
+
+    # run a text alert matched by one of the [template.*] formats
+    def orderAlert(self, alert):
+        logging.info("[orderAlert] accountName:{accountName}, template:{template}, fields:{fields}".
+                     format(accountName=self.accountConfig.get('name'), template=alert.template, fields=alert.fields))
 
         ret = {
-            "case" : "leftTurn",
+            "case" : alert.template,
             "accountName":self.accountConfig.get('name'),
             "cancelLastOrder":None,
             "closedPosition": None,
             "createOrderRes": None,
             "msg": ""
         }
-        _params = {}
-        _params["ordType"] = "market"
-        _params["symbol"] = self.accountConfig.get('default_symbol')
-        _params["amount"] = float(self.accountConfig.get('default_amount'))
-        _params["price"] = float(payload[3].split('$')[1])
-        _params["side"] = "buy"
-
-        if "多方進場" in payload:    
-            _params["position"] = "long"
-        elif "多方停損" in payload:
-            _params["position"] = "flat"
-        elif "多方平倉" in payload:
-            _params["position"] = "flat"
-        #logging.info("[orderLeftTurn] _params:{_params}".format(_params=_params))
-
+        _params = alert.orderParams(self.accountConfig.get('default_symbol'), self.accountConfig.get('default_amount'))
+        # the same market submitSignal queued the alert on
+        _params['symbol'] = self.markets.rules.canonical(_params['symbol'])
         return self.runOrder(ret, _params)
 
 
-        
+# warm connections and markets at startup, keep them alive and the clock offset current
+clientManager = sharedClientManager(pingInterval=config.getfloat('clients', 'ping_interval', fallback=30),
+                                    poolSize=config.getint('clients', 'pool_size', fallback=32),
+                                    warmMarkets=config.getboolean('clients', 'warm_markets', fallback=True))
+
+# text alert formats and request checks, parsed once at startup
+alertTemplates = loadTemplates(templateSections(config))
+ipWhiteList = frozenset(ip.strip() for ip in config.get('service', 'ip_white_list').split(","))
+specificKeys = tuple(key for key in config.get('service', 'specific_keys', fallback='').split(",") if key)
+apiSec = config.get('service', 'api_sec')
+
+# one long-lived sender fed through a bounded queue, the order path never waits on the MQ
+notifier = sharedNotifier(configPath='./core/MessageSender.cfg',
+                          queueSize=config.getint('notify', 'queue_size', fallback=1000),
+                          batchSize=config.getint('notify', 'batch_size', fallback=50),
+                          flushInterval=config.getfloat('notify', 'flush_interval', fallback=0.5),
+                          overflowPolicy=config.get('notify', 'overflow_policy', fallback='drop_oldest'))
 
+@timed('sendMessage', lambda msg: {'exchange': 'bybit'})
 def sendMessage(msg):
-    messageSender = None
-    try:
-        messageSender = MessageSender.MessageSender(configPath='./core/MessageSender.cfg')
-        messageSender.sendMessageToMq(msg)
-    except Exception as e:
-        logging.error("sendMessage err:" + str(e))
-    finally:
-        if messageSender is not None:
-           messageSender.Stop()
+    notifier.send(msg)
+
 
+# last-signal state of every agent, batched to disk and reloaded on restart
+stateStore = StateStore(shardPath(config.get('state', 'path', fallback='./bybit_state.db'), shardIndex, shardCount),
+                        flushInterval=config.getfloat('state', 'flush_interval', fallback=0.2),
+                        sync=config.get('state', 'sync', fallback='normal'),
+                        name='bybit').start()
 
 app = Flask(__name__)
 
+# one serialized queue per (exchange, account, symbol) on the process-wide bounded worker pool
+executor = sharedExecutor(workers=config.getint('executor', 'workers', fallback=32),
+                          maxDepth=config.getint('executor', 'queue_depth', fallback=32))
+
+
+
+# attach the per-stage breakdown to every response
+returnTimings = config.getboolean('service', 'return_timings', fallback=False)
+readiness = sharedReadiness()
+
+# answer retried / duplicated TradingView alerts with the first response
+dedupEnabled = config.getboolean('dedup', 'enabled', fallback=True)
+dedupCache = DedupCache(maxSize=config.getint('dedup', 'max_size', fallback=4096),
+                        ttl=config.getfloat('dedup', 'ttl', fallback=60),
+                        waitTimeout=config.getfloat('dedup', 'wait_timeout', fallback=30),
+                        fingerprintTtl=config.getfloat('dedup', 'fingerprint_ttl', fallback=10),
+                        name='bybit')
+
+
+@app.before_request
+def startTrace():
+    beginTrace()
 
 
 @app.before_request
+@timed('before_req', lambda: {'exchange': 'bybit'})
 def before_req():
-    logging.info("request_header:{request_header}".format(request_header = request.headers))
+    if logPayloads():
+        logging.info("request_header:{request_header}".format(request_header = request.headers))
     payload = None
     payload_json = None
 
-    if request.remote_addr not in config.get("service", "ip_white_list").split(","):
+    if request.remote_addr not in ipWhiteList:
         abort(403)
-    
-    try:
-        payload_json = request.get_json()
-    except Exception as e:
-        logging.info("not a json request")
-        payload = request.get_data().decode('utf-8')
+    if request.path in ('/metrics', '/ready'):
+        return
+    # fast start: the agents are still being built
+    if readiness.isStarting('bybit'):
+        abort(503)
+
+    # decode the body once, the handlers read g.text / g.payloadJson / g.alert
+    g.text = request.get_data().decode('utf-8')
+    g.payloadJson = payload_json = request.get_json(silent=True)
+    g.alert = None
+    if not isinstance(payload_json, dict):
+        g.payloadJson = payload_json = None
+        payload = g.text
 
     logging.info("request_data:{request_data}".format(request_data = payload))
 
     if payload_json is not None:
         logging.info("payload is json")
-        if payload_json["apiSec"] != config.get("service", "api_sec"):
+        if payload_json.get("apiSec") != apiSec:
             logging.warn("no apiSec in request")
             abort(401)
     elif payload is not None and len(payload) != 0:
         logging.info("payload is text/plain")
-        specific_keys = config.get("service", "specific_keys").split(",")
-        for key in specific_keys:
-            if key in payload:
-                logging.info("get specific key:{key} in payload".format(key=key))
-                return
-        logging.warn("not specific key:{specific_keys} in payload".format(specific_keys=specific_keys))
-        abort(404)
+        g.alert = alertTemplates.match(payload)
+        if g.alert is not None:
+            logging.info("matched alert template:{template}".format(template=g.alert.template))
+        elif not any(key in payload for key in specificKeys):
+            logging.warn("not specific key:{specific_keys} in payload".format(specific_keys=specificKeys))
+            abort(404)
     else:
         logging.warn("not a valid request")
         abort(400)
-
-
-
-@app.route('/order/bybit/sub<int:url_num>', methods=['POST'])
-def order_handler(url_num: int) -> dict:
+    if dedupEnabled:
+        return checkDuplicate(payload_json, payload)
+
+
+def checkDuplicate(payload_json, payload):
+    key = dedupCache.fingerprint(request.path, payload=payload_json, text=payload)
+    owner, entry = dedupCache.claim(key)
+    if not owner:
+        cached = dedupCache.wait(entry)
+        if cached is not None:
+            logging.info("duplicate alert {key}, return cached response".format(key=key))
+            body, status, contentType = cached
+            return app.response_class(body, status=status, content_type=contentType, headers={'X-Dedup': 'hit'})
+        # the first copy failed, run this one
+        owner, entry = dedupCache.claim(key)
+    if owner:
+        g.dedup = (key, entry)
+
+
+
+@app.after_request
+def finishTrace(response):
+    timings = endTrace()
+    if timings is not None:
+        registry.observe('trading_request_seconds', timings['total'] / 1000.0, exchange='bybit', route=request.path)
+        if response.is_json and (returnTimings or request.args.get('timings')):
+            data = response.get_json()
+            if isinstance(data, dict):
+                data['timings'] = timings
+                response.set_data(json.dumps(data))
+    return response
+
+
+# registered after finishTrace so it runs first and caches the response without timings; a body
+# reporting a failed order is not cached, the retry places it again
+@app.after_request
+def storeDuplicate(response):
+    claim = g.pop('dedup', None)
+    if claim is not None:
+        if response.status_code < 400 and not (response.is_json and reportsFailure(response.get_json(silent=True))):
+            dedupCache.store(claim[0], claim[1], (response.get_data(), response.status_code, response.content_type))
+        else:
+            dedupCache.release(*claim)
+    return response
+
+
+@app.teardown_request
+def releaseDuplicate(exc):
+    claim = g.pop('dedup', None)
+    if claim is not None:
+        dedupCache.release(*claim)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_handler():
+    return registry.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+
+# 503 while a fast start is still building agents, shared with the other services of the process
+@app.route('/ready', methods=['GET'])
+def ready_handler():
+    return readiness.render()
+
+
+# dispatch one signal to one agent, safe to call outside the request context
+def runAgent(agent, payloadJson, alert):
+    if alert is not None:
+        return agent.orderAlert(alert)
+    return agent.orderCommon(dict(payloadJson) if payloadJson is not None else {})
+
+
+# queue the signal behind earlier signals of the same (account, symbol); legs hold every leg's symbol
+def submitSignal(agent, fn, payloadJson, alert):
+    if alert is None and payloadJson is not None and 'legs' in payloadJson:
+        legs, err = parseLegs(payloadJson['legs'],
+                              payloadJson.get('symbol', agent.accountConfig.get('default_symbol')))
+        if err is None:
+            keys = [agent.queueKey(leg['symbol']) for leg in legs]
+            return executor.submitAll(keys, fn, agent, payloadJson, alert)
+    symbol = None
+    if alert is not None:
+        symbol = alert.symbol()
+    elif payloadJson is not None:
+        symbol = payloadJson.get('symbol')
+    if symbol is None:
+        symbol = agent.accountConfig.get('default_symbol')
+    # aliases of one market (BTCUSDT, BTC/USDT:USDT) share the queue, the last order and the position
+    symbol = agent.markets.rules.canonical(symbol)
+    if alert is None and payloadJson is not None and 'symbol' in payloadJson:
+        payloadJson = dict(payloadJson, symbol=symbol)
+    return executor.submit(agent.queueKey(symbol), fn, agent, payloadJson, alert)
+
+
+# /order/<exchange id>/sub<N>: N counts every [account.sub.*] section, the path names the account's exchange
+@app.route('/order/<exchange_id>/sub<int:url_num>', methods=['POST'])
+def order_handler(exchange_id: str, url_num: int) -> dict:
     logging.info("order_handler url_num:{url_num}".format(url_num=url_num))
     sub_num = url_num - 1
     ret = {}# or any other processing specific to the routes
-    agent = tradingAgents[sub_num]
-    if agent is None:
+    # one snapshot, a reload may swap the list in between
+    agents = list(tradingAgents)
+    agent = agents[sub_num] if 0 <= sub_num < len(agents) else None
+    if agent is None or agent.adapter.id != exchange_id:
         ret['msg'] = "Unknown trading agent "
-    msg = "tradingAgents[{sub_num}]:{url_num}, accountName:{accountName}, request:{request}"
-    msg = msg.format(sub_num=sub_num,url_num=url_num,
+        return ret, 404
+    text = requestText(g.text, g.payloadJson)
+    msg = "tradingAgents[{sub_num}]:{url_num}, exchange:{exchange_id}, accountName:{accountName}, request:{request}"
+    msg = msg.format(sub_num=sub_num,url_num=url_num, exchange_id=exchange_id,
                      accountName=agent.accountConfig.get('name'),
-                     request=request.get_data().decode('utf-8'))
+                     request=text)
     logging.info(msg)
     sendMessage(msg)
-    if '左側拐點' in request.get_data().decode('utf-8'):
-        ret = agent.orderLeftTurn(request)
-    else:
-        ret = agent.orderCommon(request)
+    try:
+        future = submitSignal(agent, runAgent, g.payloadJson, g.alert)
+    except QueueFullError as e:
+        ret['msg'] = str(e)
+        return ret, 429
+    ret = future.result()
     return ret
 
+
+# url numbers of the agents in a named group, e.g. [group.majors] accounts = 1,3,4
+def groupMembers(name):
+    return accountGroupMembers.get(name)
+
+
+# round a fan-out payload once per exchange instead of once per agent; agents share their exchange's tables
+def sizeFanOut(agents, payloadJson):
+    sized = {}
+    if payloadJson is None or 'legs' in payloadJson or 'symbol' not in payloadJson or 'amount' not in payloadJson:
+        return sized
+    for agent in agents:
+        if agent.adapter.id in sized:
+            continue
+        try:
+            _amount, _price, sizeErr = agent.orderSize(payloadJson['symbol'], payloadJson['amount'],
+                                                       payloadJson.get('price'), payloadJson.get('ordType', 'market'))
+        except (TypeError, ValueError):
+            continue
+        # a rejected size is left for runOrder, a close signal still has to run
+        if sizeErr is None:
+            sized[agent.adapter.id] = dict(payloadJson, amount=_amount, price=_price)
+    return sized
+
+
+# run the same signal on several agents at once, each in its own (account, symbol) queue
+# agents: the list snapshot the url numbers refer to, taken here when the caller has none
+def fanOut(urlNums, payloadJson, alert, agents=None):
+    def timedRun(agent, payloadJson, alert):
+        start = time.perf_counter()
+        try:
+            res = runAgent(agent, payloadJson, alert)
+        except Exception as e:
+            logging.error("[fanOut] {name} err: {err}".format(name=agent.accountConfig.get('name'), err=e))
+            res = {"accountName": agent.accountConfig.get('name'), "msg": str(e)}
+        if res is None:
+            res = {"accountName": agent.accountConfig.get('name'), "msg": "signal ignored"}
+        res['elapsedMs'] = round((time.perf_counter() - start) * 1000, 3)
+        return res
+
+    start = time.perf_counter()
+    futures = {}
+    results = {}
+    if agents is None:
+        agents = list(tradingAgents)
+    sized = sizeFanOut([agents[n - 1] for n in urlNums if 1 <= n <= len(agents) and agents[n - 1] is not None],
+                       payloadJson)
+    for url_num in urlNums:
+        if url_num < 1 or url_num > len(agents):
+            results["sub{num}".format(num=url_num)] = {"msg": "Unknown trading agent"}
+            continue
+        if agents[url_num - 1] is None:
+            # owned by another shard, the router merges its results
+            continue
+        try:
+            agent = agents[url_num - 1]
+            futures["sub{num}".format(num=url_num)] = submitSignal(agent, timedRun, sized.get(agent.adapter.id, payloadJson),
+                                                                   alert)
+        except QueueFullError as e:
+            results["sub{num}".format(num=url_num)] = {"msg": str(e)}
+    for key, future in futures.items():
+        results[key] = future.result()
+    return {
+        "accounts": len(futures),
+        "elapsedMs": round((time.perf_counter() - start) * 1000, 3),
+        "results": results
+    }
+
+
+@app.route('/order/bybit/all', methods=['POST'])
+def broadcast_handler() -> dict:
+    text = requestText(g.text, g.payloadJson)
+    agents = list(tradingAgents)
+    msg = "broadcast to {count} agents, request:{request}".format(count=len(agents), request=text)
+    logging.info(msg)
+    sendMessage(msg)
+    return fanOut(range(1, len(agents) + 1), g.payloadJson, g.alert, agents)
+
+
+@app.route('/order/bybit/group/<name>', methods=['POST'])
+def group_handler(name: str) -> dict:
+    members = groupMembers(name)
+    if members is None:
+        abort(404)
+    text = requestText(g.text, g.payloadJson)
+    msg = "broadcast to group {name}:{members}, request:{request}".format(name=name, members=members, request=text)
+    logging.info(msg)
+    sendMessage(msg)
+    return fanOut(members, g.payloadJson, g.alert)
+
+# one account per [account.sub.N] section, in config order
+def accountConfigs(conf=None):
+    conf = conf or config
+    accounts = []
+    for section in conf.sections():
+        if section.startswith("account.sub."):
+            accounts.append({
+                'name': conf.get(section, 'name')
+                , 'apiKey': conf.get(section, 'api_key')
+                , 'secret': conf.get(section, 'secret')
+                , 'password': conf.get(section, 'password', fallback=None)
+                , 'exchange': conf.get(section, 'exchange', fallback='bybit')
+                , 'hostname': conf.get(section, 'hostname', fallback=None)
+                , 'default_symbol': conf.get(section, 'default_symbol')
+                , 'default_amount': conf.get(section, 'default_amount')
+            })
+    return accounts
+
+
+# construct and check every agent at once, order follows the config file; also used by trading_service.py
+# and by shard_router.py workers, which only build the accounts of their shard
+def startAgents():
+    accounts = accountConfigs()
+    owned = [i for i, account in enumerate(accounts)
+             if shardOf(i + 1, account['name'], shardCount, shardBy) == shardIndex]
+    agents = [None] * len(accounts)
+    if len(owned) > 0:
+        with ThreadPoolExecutor(max_workers=min(len(owned), 32), thread_name_prefix='init') as pool:
+            for i, agent in zip(owned, pool.map(buildAgent, [accounts[i] for i in owned])):
+                agents[i] = agent
+    tradingAgents.extend(agents)
+    if len(owned) <= 0:
+        raise Exception("No trading agents")
+    sizeExecutor(agents)
+    # only at startup: an agent rebuilt by a reload leaves the jobs to the one it replaces
+    for agent in agents:
+        if agent is not None:
+            agent.restoreFillJobs()
+    if config.getboolean('reload', 'enabled', fallback=True):
+        startConfigWatcher()
+
+
+# at least one worker per account, so a signal fanned out to every account runs in one wave
+def sizeExecutor(agents):
+    sharedExecutor(workers=sum(1 for agent in agents if agent is not None), maxDepth=executor.maxDepth)
+
+
+# sections only read at startup, a reload leaves them as they are
+RESTART_SECTIONS = ('rate_limit', 'clients', 'executor', 'dedup', 'state', 'logging', 'notify', 'shards')
+
+
+def reloadConfig():
+    '''
+    Re-read bybit_config.ini and reconcile tradingAgents with it. Agents
+    whose [account.sub.N] values are unchanged are kept as they are
+    (client, markets, position book, order state) and only get the new
+    [trading] settings; new or changed accounts are built next to the
+    running ones and swapped in with one list assignment. If any build
+    fails nothing is swapped.
+    '''
+    global config, alertTemplates, ipWhiteList, specificKeys, apiSec, accountGroupMembers
+    with reloadLock:
+        start = time.perf_counter()
+        conf = configparser.ConfigParser()
+        if not conf.read(CONFIG_PATH, encoding="UTF-8"):
+            raise Exception("{path} not found".format(path=CONFIG_PATH))
+        accounts = accountConfigs(conf)
+        if not accounts:
+            raise Exception("no account.sub.* section")
+        groups = accountGroups(conf)
+        # by name, so inserting a section (which shifts the url numbers) keeps the agents behind it
+        running = dict((agent.accountConfig.get('name'), agent) for agent in tradingAgents if agent is not None)
+        agents = [None] * len(accounts)
+        pending = []
+        for i, account in enumerate(accounts):
+            if shardOf(i + 1, account['name'], shardCount, shardBy) != shardIndex:
+                continue
+            agent = running.get(account['name'])
+            if agent is not None and agent.accountConfig == account:
+                agents[i] = agent
+            else:
+                pending.append(i)
+        built, errors = [], []
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(len(pending), 32), thread_name_prefix='reload') as pool:
+                futures = [(i, pool.submit(buildAgent, accounts[i], conf)) for i in pending]
+            for i, future in futures:
+                try:
+                    built.append((i, future.result()))
+                except Exception as e:
+                    errors.append("{name}: {err}".format(name=accounts[i]['name'], err=e))
+        if errors:
+            for _, agent in built:
+                agent.positionBook.stop()
+            raise Exception("build failed, nothing swapped: " + "; ".join(errors))
+        for i, agent in built:
+            previous = running.get(agent.accountConfig.get('name'))
+            if previous is not None:
+                # same account with new keys or defaults, its signal state carries over
+                agent.orderStates = previous.orderStates
+            agents[i] = agent
+        kept = set(id(agent) for agent in agents if agent is not None)
+        for agent in agents:
+            if agent is not None:
+                agent.applySettings(conf)
+        for section in RESTART_SECTIONS:
+            before = dict(config.items(section)) if config.has_section(section) else {}
+            after = dict(conf.items(section)) if conf.has_section(section) else {}
+            if before != after:
+                logging.warning("[reloadConfig] [{section}] changed, takes effect after a restart".format(section=section))
+        templates = loadTemplates(templateSections(conf))
+        # the swap: handlers see either the old or the new list, never a mix
+        config = conf
+        alertTemplates = templates
+        ipWhiteList = frozenset(ip.strip() for ip in conf.get('service', 'ip_white_list').split(","))
+        specificKeys = tuple(key for key in conf.get('service', 'specific_keys', fallback='').split(",") if key)
+        apiSec = conf.get('service', 'api_sec')
+        accountGroupMembers = groups
+        tradingAgents[:] = agents
+        sizeExecutor(agents)
+        removed = [agent for agent in running.values() if id(agent) not in kept]
+        for agent in removed:
+            # signals already queued on it still finish with its client
+            agent.positionBook.stop()
+        logging.info("[reloadConfig] {kept} kept, {built} built, {removed} removed in {ms}ms".format(
+            kept=len(kept) - len(built), built=len(built), removed=len(removed),
+            ms=round((time.perf_counter() - start) * 1000, 3)))
+
+
+def startConfigWatcher():
+    global configWatcher
+    if configWatcher is None:
+        configWatcher = ConfigWatcher([CONFIG_PATH], reloadConfig,
+                                      interval=config.getfloat('reload', 'interval', fallback=1),
+                                      name='bybit').start()
+        installSignal()
+    return configWatcher
+
+
 if __name__ == '__main__':
-    LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
-    DATE_FORMAT = "%Y/%m/%d/ %H:%M:%S %p"
-    logging.basicConfig(filename='bybit_trade.log', level=logging.INFO, format=LOG_FORMAT, datefmt=DATE_FORMAT)
-    logging.getLogger().addHandler(logging.StreamHandler())
+    setupLogging('bybit_trade.log', dict(config.items('logging')) if config.has_section('logging') else {})
     try:
-        ip = json.load(urllib.request.urlopen('http://httpbin.org/ip'))['origin']
         logging.info("[bybit] trading agent started\n")
         logging.info(
             "Listening on http://{listenHost}:{listenPort}".format(
                 listenPort=config.get("service", "listen_port"), listenHost=config.get("service", "listen_host")))
-        logging.info(
-            "Access URL:http://{ip}:{listenPort}/order/bybit/subX".format(
-                listenPort=config.get("service", "listen_port"), ip=ip))
+        # logged whenever the lookup answers, never holds up the start
+        if config.getboolean('service', 'public_ip', fallback=True):
+            announcePublicIp("Access URL:http://{ip}:" + config.get("service", "listen_port") + "/order/bybit/subX",
+                             timeout=config.getfloat('service', 'public_ip_timeout', fallback=3))
         logging.info("Don't close this window, if you want to use this service")
 
-
-        # Loop through the sections in the config file
-        for section in config.sections():
-            # Check if the section name starts with "account.sub."
-            if section.startswith("account.sub."):
-                # Retrieve the user and name from the section
-                name = config.get(section, 'name')
-                apiKey = config.get(section, 'api_key')
-                secret = config.get(section, 'secret')
-                # Create a dictionary to store the account details
-                accountConfig = {
-                    'name': name
-                    , 'apiKey': apiKey
-                    , 'secret': secret
-                    , 'default_symbol': config.get(section, 'default_symbol')
-                    , 'default_amount': config.get(section, 'default_amount')
-                }
-                tradingAgent = TradingAgent(config=config, accountConfig=accountConfig)
-                #Initialize Instruments
-                if tradingAgent.initInstruments() is False:
-                    msg = "Initialize Instruments failed"
-                    raise Exception(msg)
-                tradingAgents.append(tradingAgent)
-
-        if len(tradingAgents) <= 0:
-            raise Exception("No trading agents")
-       
+        # fast start: listen right away, /ready turns 200 once the agents are built
+        if config.getboolean('service', 'fast_start', fallback=False):
+            if config.getboolean('reload', 'enabled', fallback=True):
+                # only the main thread can take SIGHUP, the config watcher starts on the startup thread
+                installSignal()
+            startInBackground('bybit', startAgents, budget=config.getfloat('service', 'start_budget', fallback=0))
+        else:
+            startAgents()
 
         # service started
         app.run(debug=config.getboolean('service','debug_mode')
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+import weakref
+
+from metrics import registry
+from rate_limiter import POLL, priority
+
+registry.describe('trading_client_ping_seconds', 'Round trip of the keep-alive / time sync call per exchange client.')
+registry.describe('trading_client_time_offset_ms', 'Local clock minus exchange server time.')
+
+_shared = {}
+_sharedLock = threading.Lock()
+
+
+# one manager per process, every agent of every exchange registers with it
+def sharedClientManager(**kwargs):
+    with _sharedLock:
+        manager = _shared.get('manager')
+        if manager is None:
+            manager = _shared['manager'] = ClientManager(**kwargs)
+        elif int(kwargs.get('poolSize', 0)) > manager.poolSize:
+            # services hosted together: the largest connection pool any of them configures
+            logging.info("[sharedClientManager] pool size {size} -> {new}".format(size=manager.poolSize,
+                                                                                 new=int(kwargs['poolSize'])))
+            manager.poolSize = int(kwargs['poolSize'])
+        return manager
+
+
+class ManagedClient(object):
+    def __init__(self, exchange, account):
+        self.exchange = weakref.ref(exchange)
+        self.account = account
+        self.offset = None    # ms, local minus server
+        self.lastPing = 0
+        self.warm = False
+
+
+class ClientManager(object):
+    '''
+    Keeps ccxt clients ready for the first order: a larger keep-alive
+    connection pool on each client session, markets loaded once per
+    exchange at startup (and shared with the other clients of that
+    exchange), and one background thread that pings every client with
+    fetch_time. The ping keeps the connection open and measures the server
+    clock; the offset goes into options['timeDifference'], which ccxt
+    subtracts when signing, so drifted clocks do not cost a rejected order.
+    '''
+
+    def __init__(self, pingInterval=30, poolSize=32, warmMarkets=True):
+        self.pingInterval = float(pingInterval)
+        self.poolSize = int(poolSize)
+        self.warmMarkets = warmMarkets
+        self.clients = []
+        self.markets = {}  # exchange id -> (markets, currencies) of the first client that loaded them
+        self.lock = threading.Lock()
+        self.marketLocks = {}
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # configure the session, warm the client in the background and keep it warm
+    def register(self, exchange, account=''):
+        client = ManagedClient(exchange, account)
+        self._pool(exchange)
+        with self.lock:
+            self.clients.append(client)
+            if self.thread is None and self.pingInterval > 0:
+                self.thread = threading.Thread(target=self._run, name='ClientManager', daemon=True)
+                self.thread.start()
+        threading.Thread(target=self.warm, args=(client,), name='ClientWarmup', daemon=True).start()
+        return client
+
+    def _pool(self, exchange):
+        session = getattr(exchange, 'session', None)
+        if session is None or self.poolSize <= 0:
+            return
+        from requests.adapters import HTTPAdapter
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.poolSize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+    # open the connection, measure the clock and load markets once per exchange id
+    def warm(self, client):
+        exchange = client.exchange()
+        if exchange is None:
+            return
+        with priority(POLL):
+            self.ping(client)
+        if self.warmMarkets and hasattr(exchange, 'load_markets'):
+            with self.lock:
+                marketLock = self.marketLocks.setdefault(exchange.id, threading.Lock())
+            try:
+                with marketLock, priority(POLL):
+                    loaded = self.markets.get(exchange.id)
+                    if loaded is not None:
+                        exchange.set_markets(*loaded)
+                    else:
+                        exchange.load_markets()
+                        self.markets[exchange.id] = (exchange.markets, exchange.currencies)
+            except Exception as e:
+                logging.error("[ClientManager] {id} {account} load_markets err: {err}".format(
+                    id=exchange.id, account=client.account, err=e))
+        client.warm = True
+
+    def ping(self, client):
+        exchange = client.exchange()
+        if exchange is None or not hasattr(exchange, 'fetch_time'):
+            return None
+        labels = {'exchange': exchange.id, 'account': client.account}
+        try:
+            before = exchange.milliseconds()
+            start = time.perf_counter()
+            server = exchange.fetch_time()
+            registry.observe('trading_client_ping_seconds', time.perf_counter() - start, **labels)
+            after = exchange.milliseconds()
+        except Exception as e:
+            logging.warning("[ClientManager] {id} {account} ping err: {err}".format(
+                id=exchange.id, account=client.account, err=e))
+            return None
+        finally:
+            client.lastPing = time.time()
+        # a slow round trip (e.g. queued behind the rate limiter) gives a poor estimate, keep the last one
+        if server and after - before < 1000:
+            # server time is taken half way through the round trip
+            client.offset = int((before + after) / 2 - server)
+            exchange.options['timeDifference'] = client.offset
+            registry.setGauge('trading_client_time_offset_ms', client.offset, **labels)
+        return client.offset
+
+    def _run(self):
+        while not self.stopped.wait(self.pingInterval / 4.0):
+            now = time.time()
+            with self.lock:
+                self.clients = [c for c in self.clients if c.exchange() is not None]
+                due = [c for c in self.clients if now - c.lastPing >= self.pingInterval]
+            for client in due:
+                with priority(POLL):
+                    self.ping(client)
+
+    def stop(self):
+        self.stopped.set()
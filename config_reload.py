@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import os
+import signal
+import threading
+import time
+
+_watchers = []
+_watchersLock = threading.Lock()
+_signalInstalled = False
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def _onSignal(signum, frame):
+    with _watchersLock:
+        watchers = list(_watchers)
+    for watcher in watchers:
+        watcher.trigger()
+
+
+# SIGHUP reloads every watcher of the process; only the main thread may install it
+def installSignal():
+    global _signalInstalled
+    if _signalInstalled or not hasattr(signal, 'SIGHUP'):
+        return _signalInstalled
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signal.SIGHUP, _onSignal)
+    _signalInstalled = True
+    return True
+
+
+class ConfigWatcher(object):
+    '''
+    Calls reload() when one of the config files changes on disk or the
+    process gets SIGHUP. Files are polled by mtime and size; a change is
+    only acted on once the file has stayed the same for settle seconds, so
+    an editor's half-written file is not loaded. reload() runs on the
+    watcher thread and reports its own errors; an exception is logged and
+    the running config stays in place.
+    '''
+
+    def __init__(self, paths, reload, interval=1.0, settle=0.2, name='config'):
+        self.paths = list(paths)
+        self.reload = reload
+        self.interval = float(interval)
+        self.settle = float(settle)
+        self.name = name
+        self.stats = dict((path, _stat(path)) for path in self.paths)
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.reloads = 0
+
+    def start(self):
+        if self.thread is not None:
+            return self
+        with _watchersLock:
+            _watchers.append(self)
+        self.thread = threading.Thread(target=self._run, name='ConfigWatcher-' + self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    # reload on the watcher thread, e.g. from a signal handler
+    def trigger(self):
+        self.wakeup.set()
+
+    def changed(self):
+        return [path for path in self.paths if _stat(path) != self.stats.get(path)]
+
+    def _run(self):
+        while not self.stopped.is_set():
+            signalled = self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                return
+            changed = self.changed()
+            if not signalled and not changed:
+                continue
+            # wait for the writer to finish
+            while changed:
+                before = dict((path, _stat(path)) for path in self.paths)
+                time.sleep(self.settle)
+                if before == dict((path, _stat(path)) for path in self.paths):
+                    break
+            self.stats = dict((path, _stat(path)) for path in self.paths)
+            logging.info("[ConfigWatcher] {name} reload ({reason})".format(
+                name=self.name, reason=','.join(changed) if changed else 'signal'))
+            try:
+                self.reload()
+                self.reloads += 1
+            except Exception as e:
+                logging.error("[ConfigWatcher] {name} reload err, keeping the running config: {err}".format(
+                    name=self.name, err=e))
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        with _watchersLock:
+            if self in _watchers:
+                _watchers.remove(self)
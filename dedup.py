@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import registry
+
+registry.describe('trading_dedup_total', 'Webhooks checked by the dedup cache, by result.')
+
+# payload fields that carry an explicit alert id, e.g. {"alertId": "{{timenow}}-btc"}
+ID_FIELDS = ('alertId', 'alert_id')
+# payload fields with the alert's fire time, e.g. {"time": "{{timenow}}"}
+TIME_FIELDS = ('timenow', 'time', 'timestamp')
+# payload fields left out of the fingerprint
+IGNORED_FIELDS = ('apiSec',)
+
+
+# a body reporting an order the exchange did not take is not cached, so a retry places it again;
+# legs and fan-outs are only retried when nothing got through, a retry re-sends all of them;
+# createOrderRes None means no order was attempted (close, cancel, already at target) and is cached
+def reportsFailure(data):
+    if not isinstance(data, dict):
+        return False
+    if isinstance(data.get('results'), dict):
+        results = list(data['results'].values())
+        return bool(results) and all(reportsFailure(res) for res in results)
+    if isinstance(data.get('legs'), list):
+        return bool(data['legs']) and not any(leg.get('ok') for leg in data['legs'])
+    return data.get('createOrderRes') is False
+
+
+class DedupEntry(object):
+    def __init__(self, expires, ttl):
+        self.expires = expires
+        self.ttl = ttl
+        self.value = None
+        self.done = threading.Event()
+
+
+class DedupCache(object):
+    '''
+    Bounded LRU + TTL cache of webhook responses keyed by the alert id, else
+    the fire time plus payload fingerprint, else the fingerprint alone. The
+    first copy of an alert claims the key and runs; copies arriving while
+    it runs wait for its response, copies arriving later inside the TTL get
+    the stored response without touching the exchange. A key from the bare
+    fingerprint lives fingerprintTtl only: without an id or time two real
+    signals can look the same.
+    '''
+
+    def __init__(self, maxSize=4096, ttl=60, waitTimeout=30, idFields=ID_FIELDS, name='dedup', fingerprintTtl=None,
+                 timeFields=TIME_FIELDS):
+        self.maxSize = max(1, int(maxSize))
+        self.ttl = float(ttl)
+        self.fingerprintTtl = self.ttl if fingerprintTtl is None else float(fingerprintTtl)
+        self.waitTimeout = float(waitTimeout)
+        self.idFields = tuple(idFields)
+        self.timeFields = tuple(timeFields)
+        self.name = name
+        self.entries = OrderedDict()  # key -> DedupEntry, oldest first
+        self.lock = threading.Lock()
+
+    def fingerprint(self, path, payload=None, text=None):
+        stamp = None
+        if isinstance(payload, dict):
+            for field in self.idFields:
+                if payload.get(field) not in (None, ''):
+                    return "{path}#id:{id}".format(path=path, id=payload[field])
+            stamp = next((payload[f] for f in self.timeFields if payload.get(f) not in (None, '')), None)
+            body = json.dumps({k: v for k, v in payload.items() if k not in IGNORED_FIELDS},
+                              sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        else:
+            body = ' '.join((text or '').split())
+        digest = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        if stamp is not None:
+            return "{path}#ts:{stamp}:{digest}".format(path=path, stamp=stamp, digest=digest)
+        return "{path}#{digest}".format(path=path, digest=digest)
+
+    def ttlFor(self, key):
+        return self.ttl if '#id:' in key or '#ts:' in key else self.fingerprintTtl
+
+    # returns (owner, entry): the owner runs the request and must call store() or release()
+    def claim(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.done.is_set() and entry.expires <= now:
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return False, entry
+            ttl = self.ttlFor(key)
+            entry = self.entries[key] = DedupEntry(now + ttl, ttl)
+            self._evict(now)
+        return True, entry
+
+    # cached response of a duplicate, None if the original failed or did not finish in time
+    def wait(self, entry):
+        if not entry.done.wait(self.waitTimeout):
+            registry.inc('trading_dedup_total', cache=self.name, result='timeout')
+            return None
+        registry.inc('trading_dedup_total', cache=self.name, result='hit' if entry.value is not None else 'retry')
+        return entry.value
+
+    def store(self, key, entry, value):
+        registry.inc('trading_dedup_total', cache=self.name, result='miss')
+        with self.lock:
+            entry.value = value
+            entry.expires = time.monotonic() + entry.ttl
+        entry.done.set()
+
+    # drop a claim whose request failed so a retry runs again
+    def release(self, key, entry):
+        registry.inc('trading_dedup_total', cache=self.name, result='released')
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+        entry.done.set()
+
+    def size(self):
+        with self.lock:
+            return len(self.entries)
+
+    def _evict(self, now):
+        # entries are roughly in expiry order, so expired ones sit at the front
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if not (entry.done.is_set() and entry.expires <= now):
+                break
+            del self.entries[key]
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
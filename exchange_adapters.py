@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+class ExchangeAdapter(object):
+    '''
+    What differs between exchanges for an agent: how the ccxt client is
+    built and which options it needs. Any ccxt exchange id works with the
+    defaults; known exchanges override them below. ccxt is only imported
+    with the first client, so a service can listen before it has loaded.
+    '''
+
+    options = {'defaultType': 'future'}
+    # most orders per createOrders request, 0 when the batch endpoint is not used
+    maxBatch = 0
+    # stop loss / take profit can ride on the entry order itself
+    attachesProtection = False
+
+    def __init__(self, id):
+        self.id = id
+
+    def create(self, accountConfig):
+        import ccxt
+        if not hasattr(ccxt, self.id):
+            raise ValueError("unknown ccxt exchange: {id}".format(id=self.id))
+        exchange = getattr(ccxt, self.id)(config={
+            'apiKey': accountConfig.get('apiKey'),
+            'secret': accountConfig.get('secret'),
+            'password': accountConfig.get('password'),
+            'verbose': False,  # for debug output
+            'options': dict(self.options),
+        })
+        if accountConfig.get('enable_proxies') is True:
+            exchange.proxies = accountConfig.get('proxies')
+        if accountConfig.get('hostname'):
+            exchange.hostname = accountConfig['hostname']
+        return exchange
+
+    def orderParams(self, reduceOnly=False):
+        return {'reduceOnly': True} if reduceOnly else {}
+
+    # entry order params carrying its stop loss / take profit triggers
+    def protectionParams(self, stopLoss=None, takeProfit=None):
+        params = {}
+        if stopLoss:
+            params['stopLoss'] = {'triggerPrice': stopLoss}
+        if takeProfit:
+            params['takeProfit'] = {'triggerPrice': takeProfit}
+        return params
+
+
+class BinanceAdapter(ExchangeAdapter):
+    # USDT-M futures; protection is reduce-only STOP_MARKET / TAKE_PROFIT_MARKET. A batch is processed
+    # concurrently, so sent with the entry those are often rejected while flat and go out after the fill
+    options = {'defaultType': 'future'}
+    maxBatch = 5
+
+
+class BybitAdapter(ExchangeAdapter):
+    options = {'defaultType': 'future'}
+    maxBatch = 10
+    attachesProtection = True
+
+
+ADAPTERS = {
+    'binance': BinanceAdapter,
+    'bybit': BybitAdapter,
+}
+
+
+def adapterFor(id):
+    return ADAPTERS.get(id, ExchangeAdapter)(id)
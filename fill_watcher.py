@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import POLL, priority
+
+# ccxt unified order states
+FILLED_STATES = ('closed',)
+DEAD_STATES = ('canceled', 'cancelled', 'expired', 'rejected')
+
+
+class FillJob(object):
+    def __init__(self, oid, symbol, side, amount, onFilled, onCancelled, deadline):
+        self.oid = str(oid)
+        self.symbol = symbol
+        self.side = side
+        self.amount = amount
+        self.onFilled = onFilled
+        self.onCancelled = onCancelled
+        self.created = time.time()
+        self.deadline = deadline
+        self.state = 'pending'  # pending/filled/cancelled/expired/superseded
+
+
+class FillWatcher(object):
+    '''
+    One scheduler thread for every order waiting on a fill. Pending jobs are
+    grouped by symbol so each poll costs one fetch_open_orders (plus one
+    fetch_orders when something left the book) no matter how many orders are
+    tracked. Idle symbols back off exponentially; callbacks for filled orders
+    run on a small bounded pool. onFinished(job) runs once a job is done for
+    good, after its callback, e.g. to drop it from a persistent store.
+    '''
+
+    def __init__(self, exchange, minInterval=0.5, maxInterval=8.0, backoffFactor=2.0, timeout=300, workers=4,
+                 onFinished=None):
+        self.exchange = exchange
+        self.minInterval = float(minInterval)
+        self.maxInterval = float(maxInterval)
+        self.backoffFactor = float(backoffFactor)
+        self.timeout = float(timeout)
+        self.onFinished = onFinished
+        self.pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='fill-watcher')
+        self.jobs = {}       # symbol -> {oid: FillJob}
+        self.intervals = {}  # symbol -> current poll interval
+        self.nextPoll = {}   # symbol -> monotonic time of the next poll
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    # track an order until it fills, then run onFilled(job, order) on the pool
+    def watch(self, oid, symbol, side, amount, onFilled, onCancelled=None, timeout=None, supersede=True, created=None):
+        job = FillJob(oid, symbol, side, amount, onFilled, onCancelled,
+                      time.time() + (self.timeout if timeout is None else float(timeout)))
+        if created is not None:
+            # restored job, keep the original order time for the history lookup
+            job.created = float(created)
+        with self.cond:
+            if supersede:
+                self._supersede(symbol)
+            self.jobs.setdefault(symbol, {})[job.oid] = job
+            self.intervals[symbol] = self.minInterval
+            self.nextPoll[symbol] = time.monotonic() + self.minInterval
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='FillWatcher', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return job
+
+    # drop pending jobs of a symbol, e.g. when a newer entry replaces them
+    def cancelSymbol(self, symbol):
+        with self.cond:
+            self._supersede(symbol)
+
+    def _supersede(self, symbol):
+        for job in self.jobs.pop(symbol, {}).values():
+            job.state = 'superseded'
+            logging.info("[FillWatcher] order {oid} superseded".format(oid=job.oid))
+            self._finished(job)
+        self.nextPoll.pop(symbol, None)
+        self.intervals.pop(symbol, None)
+
+    def pending(self):
+        with self.cond:
+            return sum(len(jobs) for jobs in self.jobs.values())
+
+    def stop(self, wait=True):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.pool.shutdown(wait=wait)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    now = time.monotonic()
+                    due = [s for s, t in self.nextPoll.items() if t <= now]
+                    if due:
+                        break
+                    wait = min(self.nextPoll.values()) - now if self.nextPoll else None
+                    self.cond.wait(wait)
+                if self.stopped:
+                    return
+                batches = [(s, list(self.jobs.get(s, {}).values())) for s in due]
+            for symbol, jobs in batches:
+                changed = False
+                try:
+                    with priority(POLL):
+                        changed = self._poll(symbol, jobs)
+                except Exception as e:
+                    logging.error("[FillWatcher] poll {symbol} err: {err}".format(symbol=symbol, err=e))
+                self._reschedule(symbol, changed)
+
+    def _reschedule(self, symbol, changed):
+        with self.cond:
+            if not self.jobs.get(symbol):
+                self.jobs.pop(symbol, None)
+                self.nextPoll.pop(symbol, None)
+                self.intervals.pop(symbol, None)
+                return
+            interval = self.minInterval if changed else \
+                min(self.intervals.get(symbol, self.minInterval) * self.backoffFactor, self.maxInterval)
+            self.intervals[symbol] = interval
+            self.nextPoll[symbol] = time.monotonic() + interval
+
+    # one status round for every pending job of a symbol, returns True if any job finished
+    def _poll(self, symbol, jobs):
+        changed = False
+        now = time.time()
+        live = []
+        for job in jobs:
+            if job.state != 'pending':
+                continue
+            if now > job.deadline:
+                if self._finish(job, 'expired'):
+                    self._finished(job)
+                logging.warning("[FillWatcher] order {oid} not filled before deadline".format(oid=job.oid))
+                changed = True
+            else:
+                live.append(job)
+        if not live:
+            return changed
+
+        openIds = set(str(o['id']) for o in self.exchange.fetch_open_orders(symbol=symbol))
+        gone = [job for job in live if job.oid not in openIds]
+        if not gone:
+            return changed
+
+        since = int(min(job.created for job in gone) * 1000) - 60000
+        orders = dict((str(o['id']), o) for o in self.exchange.fetch_orders(symbol=symbol, since=since))
+        for job in gone:
+            order = orders.get(job.oid)
+            if order is None:
+                # not visible in history yet, check again next round
+                continue
+            status = order.get('status')
+            if status in FILLED_STATES:
+                if self._finish(job, 'filled'):
+                    self.pool.submit(self._callback, job.onFilled, job, order)
+                changed = True
+            elif status in DEAD_STATES:
+                if self._finish(job, 'cancelled'):
+                    if job.onCancelled is not None:
+                        self.pool.submit(self._callback, job.onCancelled, job, order)
+                    else:
+                        self._finished(job)
+                changed = True
+        return changed
+
+    def _finish(self, job, state):
+        with self.cond:
+            jobs = self.jobs.get(job.symbol, {})
+            if jobs.get(job.oid) is not job or job.state != 'pending':
+                return False
+            job.state = state
+            del jobs[job.oid]
+            return True
+
+    def _callback(self, fn, job, order):
+        try:
+            fn(job, order)
+        except Exception as e:
+            logging.error("[FillWatcher] callback for order {oid} err: {err}".format(oid=job.oid, err=e))
+        self._finished(job)
+
+    def _finished(self, job):
+        if self.onFinished is None:
+            return
+        try:
+            self.onFinished(job)
+        except Exception as e:
+            logging.error("[FillWatcher] onFinished for order {oid} err: {err}".format(oid=job.oid, err=e))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+from decimal import Decimal
+
+# ccxt precision modes, ccxt.DECIMAL_PLACES / ccxt.TICK_SIZE
+DECIMAL_PLACES = 2
+TICK_SIZE = 4
+
+
+# lower is better: which market an id or symbol means for a client of this defaultType. ccxt
+# fetch_markets returns spot and contract markets sharing ids (binance BTCUSDT), and the
+# exchange resolves the id by the client's defaultType
+def marketRank(market, defaultType='future'):
+    if defaultType == 'spot':
+        return 0 if market.get('spot') else 1
+    if market.get('spot') and not market.get('contract'):
+        return 2
+    inverse = bool(market.get('inverse'))
+    wantInverse = defaultType in ('delivery', 'inverse')
+    return 0 if inverse == wantInverse else 1
+
+
+def _decimals(step):
+    return max(0, -Decimal(repr(step)).normalize().as_tuple().exponent)
+
+
+def _step(value, precisionMode):
+    if value is None:
+        return None
+    value = float(value)
+    if precisionMode == DECIMAL_PLACES:
+        return 10.0 ** -value
+    return value if value > 0 else None
+
+
+class SymbolRules(object):
+    '''Order constraints of one market, reduced to the numbers the rounding needs.'''
+    __slots__ = ('symbol', 'tick', 'tickDecimals', 'step', 'stepDecimals', 'minAmount', 'maxAmount',
+                 'minNotional', 'contractSize', 'inverse')
+
+    def __init__(self, market, precisionMode=TICK_SIZE, tick=None):
+        precision = market.get('precision') or {}
+        limits = market.get('limits') or {}
+        self.symbol = market['symbol']
+        self.tick = float(tick) if tick else _step(precision.get('price'), precisionMode)
+        self.tickDecimals = _decimals(self.tick) if self.tick else None
+        self.step = _step(precision.get('amount'), precisionMode)
+        self.stepDecimals = _decimals(self.step) if self.step else None
+        amountLimits = limits.get('amount') or {}
+        self.minAmount = float(amountLimits['min']) if amountLimits.get('min') else 0.0
+        self.maxAmount = float(amountLimits['max']) if amountLimits.get('max') else None
+        cost = limits.get('cost') or {}
+        self.minNotional = float(cost['min']) if cost.get('min') else 0.0
+        self.contractSize = float(market.get('contractSize') or 1)
+        self.inverse = bool(market.get('inverse'))
+
+    # amounts are floored to the lot step so we never send more than asked
+    def amount(self, amount):
+        amount = float(amount)
+        if not self.step:
+            return amount
+        return round(math.floor(amount / self.step + 1e-9) * self.step, self.stepDecimals)
+
+    def price(self, price):
+        if price is None or not self.tick:
+            return price
+        return round(round(float(price) / self.tick) * self.tick, self.tickDecimals)
+
+    # None when the order can be sent, otherwise why the exchange would reject it
+    def check(self, amount, price=None):
+        if amount <= 0 or amount < self.minAmount:
+            return "amount {amount} below minimum {min} for {symbol}".format(
+                amount=amount, min=self.minAmount or self.step, symbol=self.symbol)
+        if self.maxAmount is not None and amount > self.maxAmount:
+            return "amount {amount} above maximum {max} for {symbol}".format(
+                amount=amount, max=self.maxAmount, symbol=self.symbol)
+        if price and self.minNotional and not self.inverse:
+            notional = amount * self.contractSize * float(price)
+            if notional < self.minNotional:
+                return "notional {notional} below minimum {min} for {symbol}".format(
+                    notional=round(notional, 8), min=self.minNotional, symbol=self.symbol)
+        return None
+
+    # coins (linear) or quote value (inverse) to a number of contracts
+    def contracts(self, amount, price=None):
+        if self.inverse:
+            if not price:
+                raise ValueError("{symbol} needs a price to size an inverse contract".format(symbol=self.symbol))
+            return self.amount(float(amount) * float(price) / self.contractSize)
+        return self.amount(float(amount) / self.contractSize)
+
+
+class InstrumentRules(object):
+    '''
+    Per-symbol tick size, lot step, limits and contract value, built once
+    from the market metadata whenever the market store installs a snapshot.
+    Lookups go by upper-cased id or symbol, so rounding an order is a dict
+    hit plus a few float operations instead of a rejected round trip. When
+    an id or symbol names several markets, the one the client trades by its
+    defaultType wins (see marketRank), whatever order they were listed in.
+    '''
+
+    def __init__(self, markets, precisionMode=TICK_SIZE, tickOverrides=None, defaultType='future'):
+        overrides = dict((str(k).upper(), v) for k, v in (tickOverrides or {}).items())
+        self.rules = {}
+        ranks = {}
+        for items in markets.values():
+            for m in items:
+                if 'symbol' not in m:
+                    continue
+                rank = marketRank(m, defaultType)
+                keys = [key for key in (str(m['symbol']).upper(), str(m['id']).upper())
+                        if rank < ranks.get(key, rank + 1)]
+                if not keys:
+                    continue
+                rules = SymbolRules(m, precisionMode, tick=overrides.get(str(m['id']).upper(),
+                                                                         overrides.get(str(m['symbol']).upper())))
+                for key in keys:
+                    self.rules[key] = rules
+                    ranks[key] = rank
+
+    def get(self, symbol):
+        return self.rules.get(str(symbol).upper())
+
+    # the unified symbol a market id or symbol names, e.g. BTCUSDT -> BTC/USDT:USDT; unknown ones as given
+    def canonical(self, symbol):
+        rules = self.get(symbol)
+        return rules.symbol if rules is not None else symbol
+
+    def normalize(self, symbol, amount, price=None):
+        '''
+        Round one order to the symbol's lot step and tick size. Returns
+        (amount, price, None), or (amount, price, reason) when the rounded
+        order would still be rejected. Unknown symbols pass through.
+        '''
+        rules = self.get(symbol)
+        if rules is None:
+            amount = float(amount)
+            return amount, price, None if amount > 0 else "amount must be positive"
+        amount = rules.amount(amount)
+        price = rules.price(price)
+        return amount, price, rules.check(amount, price)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import registry
+
+registry.describe('trading_queue_wait_seconds', 'Time a signal waited in its (account, symbol) queue.')
+registry.describe('trading_queue_depth', 'Signals queued or running per (account, symbol).')
+
+
+class QueueFullError(Exception):
+    pass
+
+
+_shared = {}
+_sharedLock = threading.Lock()
+
+
+# one executor per process, keys carry the exchange so services hosted together share the pool;
+# it takes the largest workers / queue depth any of them configures
+def sharedExecutor(workers=16, maxDepth=32):
+    with _sharedLock:
+        executor = _shared.get('executor')
+        if executor is None:
+            executor = _shared['executor'] = KeyedExecutor(workers=workers, maxDepth=maxDepth, name='orders')
+        elif int(workers) > executor.workers or int(maxDepth) > executor.maxDepth:
+            logging.info("[sharedExecutor] workers {w} -> {nw}, queue depth {d} -> {nd}".format(
+                w=executor.workers, nw=max(executor.workers, int(workers)),
+                d=executor.maxDepth, nd=max(executor.maxDepth, int(maxDepth))))
+            executor.resize(max(executor.workers, int(workers)), max(executor.maxDepth, int(maxDepth)))
+        return executor
+
+
+class KeyedExecutor(object):
+    '''
+    Actor-style executor: one FIFO queue per key, e.g. (account, symbol).
+    Tasks of one key run strictly one after another in submission order,
+    different keys run in parallel on a shared bounded thread pool.
+    '''
+
+    def __init__(self, workers=16, maxDepth=32, name='executor'):
+        self.name = name
+        self.maxDepth = max(1, int(maxDepth))
+        self.workers = max(1, int(workers))
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self.queues = {}     # key -> deque of (future, fn, args, kwargs, submitted, pending keys, keys, context)
+        self.running = set()  # keys with a drain scheduled on the pool
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        return self.submitAll([key], fn, *args, **kwargs)
+
+    def submitAll(self, keys, fn, *args, **kwargs):
+        '''
+        Run fn once, after the earlier tasks of every key, while holding all
+        of them: later tasks of those keys wait for it. Tasks are queued on
+        all keys under one lock, so two tasks sharing keys are in the same
+        order on each of them and cannot wait on each other. A key that
+        reaches the task before the others is parked without a thread.
+        fn runs in a copy of the submitter's context, so the request trace
+        (metrics.stage) records the stages run on the pool.
+        '''
+        keys = list(dict.fromkeys(keys))
+        future = Future()
+        joint = set(keys) if len(keys) > 1 else None
+        with self.lock:
+            depths = {}
+            for key in keys:
+                depth = len(self.queues.get(key, ())) + (1 if key in self.running else 0)
+                if depth >= self.maxDepth:
+                    raise QueueFullError("queue {key} is full ({depth})".format(key=self.label(key), depth=depth))
+                depths[key] = depth
+            task = (future, fn, args, kwargs, time.perf_counter(), joint, keys, contextvars.copy_context())
+            for key in keys:
+                queue = self.queues.get(key)
+                if queue is None:
+                    queue = self.queues[key] = deque()
+                queue.append(task)
+                registry.setGauge('trading_queue_depth', depths[key] + 1, queue=self.label(key))
+                if key not in self.running:
+                    self.running.add(key)
+                    self.pool.submit(self._drain, key)
+        return future
+
+    # swap in a pool of the new size; drains already handed to the old pool finish there
+    def resize(self, workers, maxDepth=None):
+        with self.lock:
+            if maxDepth is not None:
+                self.maxDepth = max(1, int(maxDepth))
+            workers = max(1, int(workers))
+            if workers == self.workers:
+                return
+            old, self.workers = self.pool, workers
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.name)
+        old.shutdown(wait=False)
+
+    def depth(self, key):
+        with self.lock:
+            return len(self.queues.get(key, ())) + (1 if key in self.running else 0)
+
+    def label(self, key):
+        return ':'.join(str(k) for k in key) if isinstance(key, tuple) else str(key)
+
+    # run one task of a key, then hand the key back to the pool so busy keys do not starve the rest
+    def _drain(self, key):
+        with self.lock:
+            queue = self.queues.get(key)
+            if not queue:
+                self.running.discard(key)
+                self.queues.pop(key, None)
+                registry.setGauge('trading_queue_depth', 0, queue=self.label(key))
+                return
+            future, fn, args, kwargs, submitted, joint, keys, context = queue.popleft()
+            if joint is not None:
+                joint.discard(key)
+                if joint:
+                    # the key stays held until the task reaches the head of its other queues
+                    return
+        registry.observe('trading_queue_wait_seconds', time.perf_counter() - submitted, queue=self.label(key))
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(context.run(fn, *args, **kwargs))
+            except BaseException as e:
+                logging.error("[KeyedExecutor] {key} err: {err}".format(key=self.label(key), err=e))
+                future.set_exception(e)
+        with self.lock:
+            for key in keys:
+                queue = self.queues.get(key)
+                if queue:
+                    registry.setGauge('trading_queue_depth', len(queue), queue=self.label(key))
+                    self.pool.submit(self._drain, key)
+                else:
+                    self.running.discard(key)
+                    self.queues.pop(key, None)
+                    registry.setGauge('trading_queue_depth', 0, queue=self.label(key))
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y/%m/%d/ %H:%M:%S %p"
+
+# full exchange responses / request headers in the log, see logPayloads()
+dumpPayloads = False
+
+# request fields never written to the log or the MQ, see requestText()
+SECRET_FIELDS = ('apiSec',)
+
+# what setupLogging installed last, replaced on the next call
+installed = {'handlers': [], 'listener': None}
+
+
+class JsonFormatter(logging.Formatter):
+    '''One JSON object per line.'''
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, DATE_FORMAT),
+            'level': record.levelname,
+            'component': record.module,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ComponentFilter(logging.Filter):
+    '''
+    Per-component levels, e.g. {'fill_watcher': WARNING, 'werkzeug': ERROR}.
+    A component is the source module of the call (the services log through
+    the root logger) or the logger name for libraries.
+    '''
+
+    def __init__(self, levels, default=logging.INFO):
+        super().__init__()
+        self.levels = levels
+        self.default = default
+
+    def filter(self, record):
+        level = self.levels.get(record.module)
+        if level is None:
+            level = self.levels.get(record.name, self.default)
+        return record.levelno >= level
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Only resolves the message on the calling thread; formatting and I/O
+    happen on the listener. A full queue drops the record instead of
+    blocking the request.
+    '''
+
+    def __init__(self, logQueue):
+        super().__init__(logQueue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parseLevels(text):
+    levels = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            component, level = item.split('=', 1)
+            levels[component.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def fileHandler(filename, settings):
+    rotate = settings.get('rotate', 'none').lower()
+    backups = int(settings.get('backup_count', 7))
+    if rotate == 'size':
+        return logging.handlers.RotatingFileHandler(filename, maxBytes=int(settings.get('max_bytes', 50 * 1024 * 1024)),
+                                                    backupCount=backups, encoding='UTF-8')
+    if rotate == 'time':
+        return logging.handlers.TimedRotatingFileHandler(filename, when=settings.get('when', 'midnight'),
+                                                         backupCount=backups, encoding='UTF-8')
+    return logging.FileHandler(filename, encoding='UTF-8')
+
+
+def setupLogging(filename, settings=None):
+    '''
+    Configure the root logger from a [logging] section (dict of strings).
+    mode = queue (default) puts a bounded queue between the caller and the
+    file/console handlers; mode = sync writes on the calling thread like
+    before. Returns the QueueListener, or None in sync mode.
+    '''
+    global dumpPayloads
+    settings = settings or {}
+    level = logging.getLevelName(settings.get('level', 'INFO').upper())
+    levels = parseLevels(settings.get('levels'))
+    dumpPayloads = str(settings.get('dump_payloads', False)).lower() == "true"
+
+    formatter = JsonFormatter() if settings.get('format', 'text').lower() == 'json' \
+        else logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+    outputs = [fileHandler(filename, settings)]
+    if str(settings.get('console', True)).lower() == "true":
+        outputs.append(logging.StreamHandler())
+    for handler in outputs:
+        handler.setFormatter(formatter)
+
+    stopLogging()
+    root = logging.getLogger()
+    root.setLevel(min([level] + list(levels.values())))
+
+    componentFilter = ComponentFilter(levels, level)
+    if settings.get('mode', 'queue').lower() == 'sync':
+        for handler in outputs:
+            handler.addFilter(componentFilter)
+        installed['handlers'] = outputs
+        for handler in outputs:
+            root.addHandler(handler)
+        return None
+
+    # filter before enqueueing so suppressed records cost nothing on the listener
+    handler = NonBlockingQueueHandler(queue.Queue(int(settings.get('queue_size', 10000))))
+    handler.addFilter(componentFilter)
+    listener = logging.handlers.QueueListener(handler.queue, *outputs, respect_handler_level=True)
+    listener.start()
+    installed['handlers'] = [handler]
+    installed['listener'] = listener
+    root.addHandler(handler)
+    return listener
+
+
+# flush the queue and detach what setupLogging installed
+def stopLogging():
+    root = logging.getLogger()
+    for handler in installed['handlers']:
+        root.removeHandler(handler)
+    installed['handlers'] = []
+    if installed['listener'] is not None:
+        installed['listener'].stop()
+        installed['listener'] = None
+
+
+atexit.register(stopLogging)
+
+
+# whether to log full exchange responses / request headers (dump_payloads)
+def logPayloads():
+    return dumpPayloads
+
+
+# short form of a ccxt order, or of a list of orders, for the default log
+def orderSummary(res):
+    if isinstance(res, list):
+        return "{count} orders".format(count=len(res))
+    if not isinstance(res, dict):
+        return res
+    return "id={id},status={status},filled={filled}".format(id=res.get('id'), status=res.get('status'),
+                                                           filled=res.get('filled'))
+
+
+# webhook body for the log, secrets masked; the field stays so a replay can fill in its own
+def requestText(text, payload=None):
+    if not isinstance(payload, dict) or not any(field in payload for field in SECRET_FIELDS):
+        return text
+    return json.dumps(dict((k, '***' if k in SECRET_FIELDS else v) for k, v in payload.items()), ensure_ascii=False)
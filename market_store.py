@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+
+from instrument_rules import InstrumentRules, TICK_SIZE, marketRank
+
+
+# the only market fields the agents read, everything else is dropped in compact stores
+COMPACT_FIELDS = ('id', 'symbol', 'base', 'quote', 'settle', 'type', 'spot', 'swap', 'future',
+                  'linear', 'inverse', 'contract', 'contractSize', 'active', 'precision', 'limits')
+COMPACT_INFO_FIELDS = ('price',)
+
+_sharedStores = {}
+_sharedLock = threading.Lock()
+
+
+def compactMarket(m):
+    c = dict((k, m[k]) for k in COMPACT_FIELDS if k in m)
+    info = m.get('info') or {}
+    c['info'] = dict((k, info[k]) for k in COMPACT_INFO_FIELDS if k in info)
+    return c
+
+
+# one store per exchange, shared read-only by every agent of that exchange
+def sharedStore(name, fetcher, cachePath, ttl=3600, compact=True, precisionMode=TICK_SIZE, tickOverrides=None,
+                defaultType='future'):
+    with _sharedLock:
+        store = _sharedStores.get(name)
+        if store is None:
+            store = MarketStore(fetcher, cachePath, ttl=ttl, name=name, compact=compact,
+                                precisionMode=precisionMode, tickOverrides=tickOverrides, defaultType=defaultType)
+            _sharedStores[name] = store
+        return store
+
+
+class MarketStore(object):
+    '''
+    Instrument metadata keyed by market type and by upper-cased id/symbol.
+    A snapshot is persisted to cachePath so a restart can serve lookups
+    straight from disk; once the snapshot is older than ttl it is refreshed
+    in the background through fetcher(), which returns {marketType: [market, ...]}.
+    Every snapshot also rebuilds the precision/lot-size tables in rules.
+    '''
+
+    def __init__(self, fetcher, cachePath, ttl=3600, name='markets', compact=False, precisionMode=TICK_SIZE,
+                 tickOverrides=None, defaultType='future'):
+        self.fetcher = fetcher
+        self.precisionMode = precisionMode
+        # the clients' options['defaultType'], decides which market a shared id means
+        self.defaultType = defaultType
+        self.tickOverrides = tickOverrides or {}
+        self.rules = InstrumentRules({})
+        self.compact = compact
+        self.cachePath = cachePath
+        self.ttl = float(ttl)
+        self.name = name
+        self.markets = {}  # marketType -> [market]
+        self.index = {}    # marketType -> {ID/SYMBOL: market}
+        self.updated = 0
+        self.lock = threading.Lock()
+        self.refreshing = None
+        self.timer = None
+        self.started = False
+
+    # load the disk snapshot and keep it fresh in the background, never blocks on the network
+    def start(self):
+        with self.lock:
+            if self.started:
+                return self.ready()
+            self.started = True
+        self.load()
+        if self.isStale():
+            self.refreshAsync()
+        if self.timer is None and self.ttl > 0:
+            self.timer = threading.Thread(target=self._watch, name='MarketStore-' + self.name, daemon=True)
+            self.timer.start()
+        return self.ready()
+
+    def ready(self):
+        return len(self.markets) > 0
+
+    def isStale(self):
+        return not self.ready() or time.time() - self.updated > self.ttl
+
+    def get(self, marketType, key):
+        return self.index.get(marketType, {}).get(str(key).upper())
+
+    def list(self, marketType):
+        return self.markets.get(marketType, [])
+
+    def load(self):
+        if not os.path.exists(self.cachePath):
+            return False
+        try:
+            with open(self.cachePath, encoding="UTF-8") as f:
+                snapshot = json.load(f)
+            self._install(snapshot['markets'], snapshot['updated'])
+            logging.info("[MarketStore] {name} loaded from {path}".format(name=self.name, path=self.cachePath))
+            return True
+        except Exception as e:
+            logging.error("[MarketStore] {name} load cache err: {err}".format(name=self.name, err=e))
+            return False
+
+    # fetch every market type, keep the previous data of a type that failed
+    def refresh(self):
+        fetched = self.fetcher()
+        with self.lock:
+            markets = dict(self.markets)
+        markets.update((k, v) for k, v in fetched.items() if v)
+        if not markets:
+            return False
+        updated = time.time()
+        self._install(markets, updated)
+        self._persist(self.markets, updated)
+        logging.info("[MarketStore] {name} refreshed".format(name=self.name))
+        return True
+
+    def refreshAsync(self):
+        with self.lock:
+            if self.refreshing is not None and self.refreshing.is_alive():
+                return self.refreshing
+            self.refreshing = threading.Thread(target=self._safeRefresh, name='MarketStore-refresh', daemon=True)
+            self.refreshing.start()
+            return self.refreshing
+
+    def _safeRefresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.error("[MarketStore] {name} refresh err: {err}".format(name=self.name, err=e))
+
+    def _watch(self):
+        while True:
+            time.sleep(min(self.ttl, 60))
+            if self.isStale():
+                self.refreshAsync()
+
+    def _install(self, markets, updated):
+        if self.compact:
+            markets = dict((t, [compactMarket(m) for m in items]) for t, items in markets.items())
+        index = {}
+        for marketType, items in markets.items():
+            byKey = {}
+            # the market the client trades wins a shared id or symbol, then ids win over symbols
+            for m in sorted(items, key=lambda m: -marketRank(m, self.defaultType)):
+                byKey[str(m['symbol']).upper()] = m
+                byKey[str(m['id']).upper()] = m
+            index[marketType] = byKey
+        rules = InstrumentRules(markets, self.precisionMode, self.tickOverrides, self.defaultType)
+        with self.lock:
+            self.markets = markets
+            self.index = index
+            self.rules = rules
+            self.updated = updated
+
+    # new tick size overrides (e.g. from a config reload), the rules are rebuilt from the current snapshot
+    def setTickOverrides(self, tickOverrides):
+        with self.lock:
+            markets = self.markets
+        rules = InstrumentRules(markets, self.precisionMode, tickOverrides or {}, self.defaultType)
+        with self.lock:
+            self.tickOverrides = tickOverrides or {}
+            self.rules = rules
+
+    def _persist(self, markets, updated):
+        tmpPath = "{path}.{pid}.tmp".format(path=self.cachePath, pid=os.getpid())
+        try:
+            with open(tmpPath, 'w', encoding="UTF-8") as f:
+                json.dump({'updated': updated, 'markets': markets}, f, default=str)
+            os.replace(tmpPath, self.cachePath)
+        except Exception as e:
+            logging.error("[MarketStore] {name} write cache err: {err}".format(name=self.name, err=e))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# (stages, start) of the webhook being served; a context variable so tasks queued with the
+# request's context (see KeyedExecutor) record into the same trace
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+def _labelKey(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _renderLabels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{k}="{v}"'.format(k=k, v=str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class Summary(object):
+    # count/sum over the process lifetime, quantiles over the most recent samples
+    def __init__(self, window=1024):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return [(q, 0.0) for q in QUANTILES]
+        return [(q, ordered[min(len(ordered) - 1, int(q * len(ordered)))]) for q in QUANTILES]
+
+
+class MetricsRegistry(object):
+    '''
+    In-process summaries, counters and gauges rendered in the Prometheus
+    text format. Values are keyed by metric name and a sorted label tuple.
+    '''
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.lock = threading.Lock()
+        self.summaries = {}
+        self.counters = {}
+        self.gauges = {}
+        self.help = {}
+
+    def observe(self, name, value, **labels):
+        key = _labelKey(labels)
+        with self.lock:
+            series = self.summaries.setdefault(name, {})
+            summary = series.get(key)
+            if summary is None:
+                summary = series[key] = Summary(self.window)
+            summary.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = _labelKey(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def setGauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_labelKey(labels)] = value
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def quantiles(self, name, **labels):
+        with self.lock:
+            summary = self.summaries.get(name, {}).get(_labelKey(labels))
+            return dict(summary.quantiles()) if summary is not None else {}
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.summaries.items()):
+                self._header(lines, name, 'summary')
+                for key, summary in sorted(series.items()):
+                    for q, v in summary.quantiles():
+                        lines.append('{name}{labels} {v:.6f}'.format(name=name, labels=_renderLabels(key, [('quantile', q)]), v=v))
+                    lines.append('{name}_sum{labels} {v:.6f}'.format(name=name, labels=_renderLabels(key), v=summary.sum))
+                    lines.append('{name}_count{labels} {v}'.format(name=name, labels=_renderLabels(key), v=summary.count))
+            for name, series in sorted(self.counters.items()):
+                self._header(lines, name, 'counter')
+                for key, v in sorted(series.items()):
+                    lines.append('{name}{labels} {v}'.format(name=name, labels=_renderLabels(key), v=v))
+            for name, series in sorted(self.gauges.items()):
+                self._header(lines, name, 'gauge')
+                for key, v in sorted(series.items()):
+                    lines.append('{name}{labels} {v}'.format(name=name, labels=_renderLabels(key), v=v))
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append('# HELP {name} {text}'.format(name=name, text=self.help[name]))
+        lines.append('# TYPE {name} {kind}'.format(name=name, kind=kind))
+
+
+registry = MetricsRegistry()
+registry.describe('trading_stage_seconds', 'Latency of each webhook processing stage.')
+registry.describe('trading_request_seconds', 'Webhook latency from arrival to response.')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# per-request breakdown, collected by the request and the tasks it queues
+def beginTrace():
+    _trace.set(([], time.perf_counter()))
+
+
+def endTrace():
+    current = _trace.get()
+    _trace.set(None)
+    if current is None:
+        return None
+    trace, started = current
+    result = {}
+    for stageName, seconds in trace:
+        # nested or repeated stages add up, e.g. createOrder inside closeAllPosition
+        result[stageName] = result.get(stageName, 0) + seconds * 1000
+    result = dict((k, round(v, 3)) for k, v in result.items())
+    result['total'] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+class stage(object):
+    '''
+    with stage('createOrder', exchange='binance', symbol=symbol): ...
+    records the elapsed time in trading_stage_seconds and in the current trace
+    '''
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        registry.observe('trading_stage_seconds', elapsed, stage=self.name, **self.labels)
+        current = _trace.get()
+        if current is not None:
+            current[0].append((self.name, elapsed))
+        return False
+
+
+# decorator form of stage, labels(*args, **kwargs) returns the labels of one call
+def timed(name, labels=None):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name, **(labels(*args, **kwargs) if labels is not None else {})):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import atexit
+import logging
+import queue
+import threading
+
+# overflow policy when the queue is full
+DROP_NEWEST = 'drop_newest'  # discard the incoming message
+DROP_OLDEST = 'drop_oldest'  # discard the oldest queued message to make room
+BLOCK = 'block'              # wait up to putTimeout for room, then discard
+
+_STOP = object()
+
+
+def defaultSenderFactory(configPath):
+    # imported lazily so the trading services start even if the MQ module is missing
+    import core.MessageSender as MessageSender
+    return MessageSender.MessageSender(configPath=configPath)
+
+
+_shared = {}
+_sharedLock = threading.Lock()
+
+
+# one notifier per process, so services hosted together share a single MQ sender
+def sharedNotifier(**kwargs):
+    with _sharedLock:
+        notifier = _shared.get('notifier')
+        if notifier is None:
+            notifier = _shared['notifier'] = MessageNotifier(**kwargs)
+        return notifier
+
+
+class MessageNotifier(object):
+    '''
+    Process-wide notification pipeline: callers enqueue messages on a bounded
+    queue and one background worker drains them in batches through a single
+    long-lived MessageSender, so the order path never waits on the MQ. A
+    batch goes out in one sendMessagesToMq(list) call when the sender has
+    one, otherwise message by message.
+    '''
+
+    def __init__(self, configPath='./core/MessageSender.cfg', queueSize=1000, batchSize=50,
+                 flushInterval=0.5, overflowPolicy=DROP_OLDEST, putTimeout=0.05, senderFactory=None):
+        if overflowPolicy not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+            raise ValueError("unknown overflow policy: {policy}".format(policy=overflowPolicy))
+        self.configPath = configPath
+        self.batchSize = max(1, int(batchSize))
+        self.flushInterval = float(flushInterval)
+        self.overflowPolicy = overflowPolicy
+        self.putTimeout = float(putTimeout)
+        self.senderFactory = senderFactory or defaultSenderFactory
+        self.queue = queue.Queue(maxsize=max(1, int(queueSize)))
+        self.sender = None
+        self.worker = None
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.stats = {'enqueued': 0, 'sent': 0, 'dropped': 0, 'failed': 0}
+
+    def start(self):
+        with self.lock:
+            if self.worker is not None or self.stopped:
+                return
+            self.worker = threading.Thread(target=self._run, name='MessageNotifier', daemon=True)
+            self.worker.start()
+            atexit.register(self.stop)
+
+    # enqueue a message, never blocks longer than putTimeout
+    def send(self, msg):
+        if self.stopped:
+            return False
+        if self.worker is None:
+            self.start()
+        try:
+            if self.overflowPolicy == BLOCK:
+                self.queue.put(msg, timeout=self.putTimeout)
+            else:
+                self.queue.put_nowait(msg)
+        except queue.Full:
+            if self.overflowPolicy != DROP_OLDEST:
+                return self._drop(msg)
+            try:
+                self.queue.get_nowait()
+                self._count('dropped')
+                self.queue.put_nowait(msg)
+            except (queue.Empty, queue.Full):
+                return self._drop(msg)
+        self._count('enqueued')
+        return True
+
+    # stats are updated by the callers and the worker, under the queue's own lock
+    def _count(self, name, n=1):
+        with self.queue.mutex:
+            self.stats[name] += n
+
+    def _drop(self, msg):
+        self._count('dropped')
+        logging.warning("[MessageNotifier] queue full, message dropped: {msg}".format(msg=msg))
+        return False
+
+    # stop the worker and flush whatever is still queued
+    def stop(self, timeout=5.0):
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            worker = self.worker
+        if worker is not None:
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            worker.join(timeout)
+        self._flush(self._drain(self.queue.qsize()))
+        self._closeSender()
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.flushInterval)
+            except queue.Empty:
+                continue
+            if first is _STOP:
+                break
+            batch = [first] + self._drain(self.batchSize - 1)
+            stop = _STOP in batch
+            self._flush([m for m in batch if m is not _STOP])
+            if stop:
+                break
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        batch = [msg for msg in batch if msg is not _STOP]
+        if not batch:
+            return
+        try:
+            if self.sender is None:
+                self.sender = self.senderFactory(self.configPath)
+            sendBatch = getattr(self.sender, 'sendMessagesToMq', None)
+        except Exception as e:
+            return self._failed(len(batch), e)
+        if sendBatch is not None:
+            try:
+                sendBatch(batch)
+                self._count('sent', len(batch))
+            except Exception as e:
+                self._failed(len(batch), e)
+            return
+        for msg in batch:
+            try:
+                if self.sender is None:
+                    self.sender = self.senderFactory(self.configPath)
+                self.sender.sendMessageToMq(msg)
+                self._count('sent')
+            except Exception as e:
+                self._failed(1, e)
+
+    def _failed(self, count, err):
+        self._count('failed', count)
+        logging.error("sendMessage err:" + str(err))
+        # reconnect on the next message
+        self._closeSender()
+
+    def _closeSender(self):
+        sender, self.sender = self.sender, None
+        if sender is not None:
+            try:
+                sender.Stop()
+            except Exception as e:
+                logging.error("[MessageNotifier] stop sender err:" + str(e))
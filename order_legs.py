@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import CLOSE, OPEN, priority
+
+MAX_LEGS = 20
+ORDER_TYPES = ('market', 'limit')
+
+# concurrent single orders for exchanges without a batch endpoint
+_legPool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='legs')
+
+
+def parseLegs(legs, defaultSymbol=None):
+    '''
+    Validate a webhook "legs" list as a whole. Each leg is
+    {symbol, side, amount, type|ordType, price, reduceOnly}; symbol falls
+    back to defaultSymbol. Returns (legs, None) or (None, error message).
+    '''
+    if not isinstance(legs, list) or len(legs) == 0:
+        return None, "legs must be a non-empty list"
+    if len(legs) > MAX_LEGS:
+        return None, "too many legs: {count} > {max}".format(count=len(legs), max=MAX_LEGS)
+    parsed = []
+    for i, leg in enumerate(legs):
+        if not isinstance(leg, dict):
+            return None, "leg {i}: not an object".format(i=i)
+        symbol = leg.get('symbol', defaultSymbol)
+        side = str(leg.get('side', '')).lower()
+        ordType = str(leg.get('type', leg.get('ordType', 'market'))).lower()
+        price = leg.get('price')
+        try:
+            amount = float(leg.get('amount'))
+            price = float(price) if price is not None else None
+        except (TypeError, ValueError):
+            return None, "leg {i}: amount/price must be numbers".format(i=i)
+        if not symbol:
+            return None, "leg {i}: missing symbol".format(i=i)
+        if side not in ('buy', 'sell'):
+            return None, "leg {i}: side must be buy or sell".format(i=i)
+        if amount <= 0:
+            return None, "leg {i}: amount must be positive".format(i=i)
+        if ordType not in ORDER_TYPES:
+            return None, "leg {i}: type must be market or limit".format(i=i)
+        if ordType == 'limit' and price is None:
+            return None, "leg {i}: limit leg needs a price".format(i=i)
+        parsed.append({'symbol': symbol, 'side': side, 'amount': amount, 'type': ordType,
+                       'price': price if ordType == 'limit' else None,
+                       'reduceOnly': bool(leg.get('reduceOnly', False))})
+    return parsed, None
+
+
+# round every leg to its symbol's lot step and tick size and name it by its canonical symbol,
+# (legs, None) or (None, error) for the first bad leg
+def sizeLegs(legs, rules):
+    sized = []
+    for i, leg in enumerate(legs):
+        amount, price, err = rules.normalize(leg['symbol'], leg['amount'], leg['price'])
+        if err is not None:
+            return None, "leg {i}: {err}".format(i=i, err=err)
+        sized.append(dict(leg, symbol=rules.canonical(leg['symbol']), amount=amount, price=price))
+    return sized, None
+
+
+def legResult(leg, order=None, error=None):
+    res = {'symbol': leg['symbol'], 'side': leg['side'], 'amount': leg['amount'], 'type': leg['type']}
+    if error is not None:
+        res.update({'ok': False, 'msg': str(error)})
+    else:
+        res.update({'ok': True, 'id': order.get('id'), 'status': order.get('status'), 'filled': order.get('filled')})
+    return res
+
+
+def _orderRequest(leg, adapter):
+    return {'symbol': leg['symbol'], 'type': leg['type'], 'side': leg['side'], 'amount': leg['amount'],
+            'price': leg['price'], 'params': adapter.orderParams(leg['reduceOnly'])}
+
+
+def _single(exchange, adapter, leg):
+    with priority(CLOSE if leg['reduceOnly'] else OPEN):
+        request = _orderRequest(leg, adapter)
+        try:
+            order = exchange.create_order(request['symbol'], request['type'], request['side'], request['amount'],
+                                          request['price'], request['params'])
+            return legResult(leg, order)
+        except Exception as e:
+            logging.error("[legs] {symbol} {side} err: {err}".format(symbol=leg['symbol'], side=leg['side'], err=e))
+            return legResult(leg, error=e)
+
+
+def _batch(exchange, adapter, legs):
+    with priority(CLOSE if all(leg['reduceOnly'] for leg in legs) else OPEN):
+        try:
+            orders = exchange.create_orders([_orderRequest(leg, adapter) for leg in legs])
+        except Exception as e:
+            logging.error("[legs] batch of {count} err: {err}".format(count=len(legs), err=e))
+            return [legResult(leg, error=e) for leg in legs]
+    results = []
+    for i, leg in enumerate(legs):
+        order = orders[i] if i < len(orders) else None
+        # ccxt reports a rejected entry of a batch as an order without id
+        if not order or not order.get('id') or order.get('status') == 'rejected':
+            info = (order or {}).get('info') or 'no order returned'
+            results.append(legResult(leg, error=info))
+        else:
+            results.append(legResult(leg, order))
+    return results
+
+
+def submitLegs(exchange, adapter, legs):
+    '''
+    Place every leg, one batch request per adapter.maxBatch legs when the
+    exchange supports createOrders, otherwise one concurrent request per
+    leg. Results come back in leg order.
+    '''
+    if adapter.maxBatch > 1 and len(legs) > 1 and (getattr(exchange, 'has', None) or {}).get('createOrders'):
+        chunks = [legs[i:i + adapter.maxBatch] for i in range(0, len(legs), adapter.maxBatch)]
+        if len(chunks) == 1:
+            return _batch(exchange, adapter, chunks[0])
+        results = []
+        for chunkResults in _legPool.map(lambda chunk: _batch(exchange, adapter, chunk), chunks):
+            results.extend(chunkResults)
+        return results
+    if len(legs) == 1:
+        return [_single(exchange, adapter, legs[0])]
+    return list(_legPool.map(lambda leg: _single(exchange, adapter, leg), legs))
+
+
+# feed leg results into the local position book and last-order state
+def recordLegs(results, positionBook, orderStates):
+    for res in results:
+        if res['ok']:
+            positionBook.onOrder(res['symbol'], res['side'], res['amount'], res)
+            orderStates.get(res['symbol']).lastOrdId = res['id']
+        else:
+            positionBook.markDirty(res['symbol'])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+
+FIELDS = ('lastOrdId', 'lastOrdType', 'lastOrdSide', 'lastOrdPosition', 'lastAlgoOrdId')
+
+
+class OrderState(object):
+    def __init__(self, symbol=None, book=None, data=None):
+        self.lastOrdId = 0
+        self.lastOrdType = None      # binance: last opened side / bybit: limit/market/market-limit
+        self.lastOrdSide = None      # buy/sell
+        self.lastOrdPosition = None  # long/short/flat
+        self.lastAlgoOrdId = 0
+        for field in FIELDS:
+            if data and field in data:
+                setattr(self, field, data[field])
+        # set last so the defaults above are not written back to the store
+        self.symbol = symbol
+        self.book = book
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        book = self.__dict__.get('book')
+        if book is not None and name in FIELDS:
+            book.changed(self)
+
+    def asDict(self):
+        return dict((field, getattr(self, field)) for field in FIELDS)
+
+
+class OrderStateBook(object):
+    '''
+    Last-signal state per symbol of one account. Signals of one symbol run
+    serially in their KeyedExecutor queue, so entries are not locked; the
+    book lock only guards creation. With a StateStore every change is
+    queued for disk and the book starts from the stored state.
+    '''
+
+    def __init__(self, account='', store=None):
+        self.account = account
+        self.store = store
+        self.states = {}
+        self.lock = threading.Lock()
+        if store is not None:
+            for symbol, data in store.loadStates(account).items():
+                self.states[symbol] = OrderState(symbol, self, data)
+
+    def get(self, symbol):
+        state = self.states.get(symbol)
+        if state is None:
+            with self.lock:
+                state = self.states.get(symbol)
+                if state is None:
+                    state = self.states[symbol] = OrderState(symbol, self)
+        return state
+
+    def changed(self, state):
+        if self.store is not None:
+            self.store.putState(self.account, state.symbol, state.asDict())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+import weakref
+
+from rate_limiter import POLL, priority
+
+_books = weakref.WeakSet()
+_reconcilerLock = threading.Lock()
+_reconciler = None
+
+
+class PositionEntry(object):
+    def __init__(self):
+        self.contracts = 0.0  # signed, long > 0 > short
+        self.openOrders = 0
+        self.synced = 0       # last time the exchange confirmed this entry
+        self.dirty = True     # our view may be wrong, the next read goes to the exchange
+        self.version = 0      # bumped by our own order updates, an exchange read older than it is dropped
+
+
+class PositionBook(object):
+    '''
+    Per-(account, symbol) view of the position and resting orders, kept
+    current from our own order results and reconciled against the exchange
+    by one shared background thread. Reads only hit the exchange when the
+    entry is stale, flagged dirty, or resting orders could fill behind our back.
+    '''
+
+    def __init__(self, exchange, account='', ttl=30, reconcileInterval=15):
+        self.exchange = exchange
+        self.account = account
+        self.ttl = float(ttl)
+        self.reconcileInterval = float(reconcileInterval)
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.lastReconcile = time.time()
+
+    def _entry(self, symbol):
+        entry = self.entries.get(symbol)
+        if entry is None:
+            entry = self.entries[symbol] = PositionEntry()
+        return entry
+
+    def isFresh(self, symbol):
+        entry = self.entries.get(symbol)
+        return entry is not None and not entry.dirty and time.time() - entry.synced < self.ttl
+
+    # signed position size, from the cache when it can be trusted
+    def position(self, symbol):
+        with self.lock:
+            entry = self.entries.get(symbol)
+            if self.isFresh(symbol) and entry.openOrders == 0:
+                return entry.contracts
+        return self.fetchPosition(symbol)
+
+    # True/False when the cache knows, None when the caller has to ask the exchange
+    def hasOpenOrders(self, symbol):
+        with self.lock:
+            if not self.isFresh(symbol):
+                return None
+            return self.entries[symbol].openOrders > 0
+
+    def fetchPosition(self, symbol):
+        with self.lock:
+            version = self._entry(symbol).version
+        positions = self.exchange.fetch_positions(symbols=[symbol])
+        logging.debug("[PositionBook] {account} positions: {positions}".format(account=self.account, positions=positions))
+        contracts = signedContracts(positions)
+        with self.lock:
+            entry = self._entry(symbol)
+            if entry.version != version:
+                # one of our orders landed while the request was out, the answer may predate it
+                entry.dirty = True
+                return contracts
+            entry.contracts = contracts
+            if entry.openOrders == 0:
+                entry.dirty = False
+                entry.synced = time.time()
+        return contracts
+
+    # update from the result of one of our own orders
+    def onOrder(self, symbol, side, amount, order):
+        with self.lock:
+            entry = self._entry(symbol)
+            entry.version += 1
+            status = order.get('status') if order else None
+            filled = order.get('filled') if order else None
+            if status == 'open' and not filled:
+                if order.get('type') == 'market':
+                    # acknowledged but not reported filled yet
+                    entry.dirty = True
+                else:
+                    entry.openOrders += 1
+            elif status == 'closed' or filled:
+                sign = 1 if side.lower() == 'buy' else -1
+                entry.contracts += sign * float(filled if filled is not None else amount)
+                if status != 'closed':
+                    entry.openOrders += 1
+            else:
+                # exchange did not tell us what happened, ask next time
+                entry.dirty = True
+
+    def onOpenOrder(self, symbol):
+        with self.lock:
+            entry = self._entry(symbol)
+            entry.version += 1
+            entry.openOrders += 1
+
+    def onCancelAll(self, symbol):
+        with self.lock:
+            entry = self._entry(symbol)
+            entry.version += 1
+            entry.openOrders = 0
+
+    def markDirty(self, symbol):
+        with self.lock:
+            self._entry(symbol).dirty = True
+
+    # compare every tracked symbol with the exchange and overwrite our view, unless one of our
+    # orders changed the entry while the exchange was being asked
+    def reconcile(self):
+        self.lastReconcile = time.time()
+        with self.lock:
+            symbols = list(self.entries.keys())
+        for symbol in symbols:
+            with self.lock:
+                version = self._entry(symbol).version
+            try:
+                contracts = signedContracts(self.exchange.fetch_positions(symbols=[symbol]))
+                openOrders = len(self.exchange.fetch_open_orders(symbol=symbol))
+            except Exception as e:
+                logging.error("[PositionBook] {account} reconcile {symbol} err: {err}".format(
+                    account=self.account, symbol=symbol, err=e))
+                self.markDirty(symbol)
+                continue
+            with self.lock:
+                entry = self._entry(symbol)
+                if entry.version != version:
+                    # the snapshot may predate that order; the next read asks again
+                    entry.dirty = True
+                    continue
+                if not entry.dirty and (entry.contracts != contracts or entry.openOrders != openOrders):
+                    logging.warning("[PositionBook] {account} {symbol} drift: cached {c}/{o}, exchange {ec}/{eo}".format(
+                        account=self.account, symbol=symbol, c=entry.contracts, o=entry.openOrders,
+                        ec=contracts, eo=openOrders))
+                entry.contracts = contracts
+                entry.openOrders = openOrders
+                entry.dirty = False
+                entry.synced = time.time()
+
+    # register with the shared reconcile thread
+    def start(self):
+        global _reconciler
+        _books.add(self)
+        with _reconcilerLock:
+            if _reconciler is None:
+                _reconciler = threading.Thread(target=_reconcileLoop, name='PositionBook', daemon=True)
+                _reconciler.start()
+
+    # no more reconciles, e.g. for an agent dropped by a config reload
+    def stop(self):
+        _books.discard(self)
+
+
+def signedContracts(positions):
+    contracts = 0.0
+    for p in positions or []:
+        size = float(p.get('contracts') or 0)
+        contracts += -size if p.get('side') == 'short' else size
+    return contracts
+
+
+def _reconcileLoop():
+    while True:
+        time.sleep(1)
+        for book in list(_books):
+            if book.reconcileInterval > 0 and time.time() - book.lastReconcile >= book.reconcileInterval:
+                with priority(POLL):
+                    book.reconcile()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+
+
+def opposite(side):
+    return 'sell' if side.lower() == 'buy' else 'buy'
+
+
+# stop loss / take profit trigger prices from percentages of the reference price, None when disabled
+def protectionPrices(side, refPrice, stopLossPct=None, takeProfitPct=None, rules=None):
+    direction = 1 if side.lower() == 'buy' else -1
+    refPrice = float(refPrice)
+    stopLoss = refPrice * (1 - direction * float(stopLossPct) * 0.01) if stopLossPct else None
+    takeProfit = refPrice * (1 + direction * float(takeProfitPct) * 0.01) if takeProfitPct else None
+    if rules is not None:
+        stopLoss = rules.price(stopLoss)
+        takeProfit = rules.price(takeProfit)
+    return stopLoss, takeProfit
+
+
+# the price the percentages apply to: the limit price, else the last trade price
+def referencePrice(exchange, symbol, price=None):
+    if price:
+        return float(price)
+    return float(exchange.fetch_ticker(symbol)['last'])
+
+
+# reduce-only trigger orders closing amount, as (kind, create_orders request)
+def protectiveOrders(symbol, side, amount, stopLoss=None, takeProfit=None):
+    orders = []
+    for kind, price in (('stopLoss', stopLoss), ('takeProfit', takeProfit)):
+        if price:
+            orders.append((kind, {'symbol': symbol, 'type': 'market', 'side': opposite(side), 'amount': amount,
+                                  'price': None, 'params': {kind + 'Price': price, 'reduceOnly': True}}))
+    return orders
+
+
+# stop loss / take profit for a position that is already open (side is the position's side), e.g.
+# after a target-mode shrink; returns (placed orders, missing kinds)
+def placeProtection(exchange, adapter, symbol, side, amount, stopLoss=None, takeProfit=None):
+    protective = protectiveOrders(symbol, side, amount, stopLoss, takeProfit)
+    placed, missing = [], []
+    if not protective:
+        return placed, missing
+    if 1 < len(protective) <= adapter.maxBatch and (getattr(exchange, 'has', None) or {}).get('createOrders'):
+        results = exchange.create_orders([request for _, request in protective])
+    else:
+        results = []
+        for kind, request in protective:
+            try:
+                results.append(exchange.create_order(request['symbol'], request['type'], request['side'],
+                                                     request['amount'], request['price'], request['params']))
+            except Exception as e:
+                logging.error("[protection] {symbol} {kind} err: {err}".format(symbol=symbol, kind=kind, err=e))
+                results.append(None)
+    for i, (kind, _) in enumerate(protective):
+        res = results[i] if i < len(results) else None
+        if res and res.get('id') and res.get('status') != 'rejected':
+            placed.append(res)
+        else:
+            missing.append(kind)
+    return placed, missing
+
+
+def placeProtected(exchange, adapter, entry, stopLoss=None, takeProfit=None, amount=None):
+    '''
+    Send an entry (create_orders format) together with its protection:
+    attached to the entry request when the adapter supports it, otherwise
+    as reduce-only trigger orders in the same batch request. Returns
+    (entry order, placed protective orders, missing kinds); missing lists
+    the protection ('stopLoss'/'takeProfit') the exchange did not take,
+    which the caller has to place once the entry fills. Only attached
+    protection is sure to be live once the entry is acknowledged: a batch
+    may be processed concurrently (binance), and reduce-only orders sent
+    next to an entry on a flat account are then rejected. Raises when the
+    entry itself was rejected. amount is the size to protect, the entry
+    amount by default.
+    '''
+    protective = protectiveOrders(entry['symbol'], entry['side'], amount or entry['amount'], stopLoss, takeProfit)
+    if adapter.attachesProtection:
+        params = dict(entry['params'], **adapter.protectionParams(stopLoss, takeProfit))
+        order = exchange.create_order(entry['symbol'], entry['type'], entry['side'], entry['amount'], entry['price'],
+                                      params)
+        return order, [], []
+    if len(protective) + 1 > adapter.maxBatch or not (getattr(exchange, 'has', None) or {}).get('createOrders'):
+        order = exchange.create_order(entry['symbol'], entry['type'], entry['side'], entry['amount'], entry['price'],
+                                      entry['params'])
+        return order, [], [kind for kind, _ in protective]
+    orders = exchange.create_orders([entry] + [request for _, request in protective])
+    order = orders[0] if orders else None
+    if not order or not order.get('id'):
+        raise Exception((order or {}).get('info') or 'entry order rejected')
+    placed, missing = [], []
+    for i, (kind, _) in enumerate(protective):
+        res = orders[i + 1] if i + 1 < len(orders) else None
+        if res and res.get('id') and res.get('status') != 'rejected':
+            placed.append(res)
+        else:
+            missing.append(kind)
+    if missing:
+        logging.warning("[protection] {symbol}: {missing} not accepted with the entry".format(
+            symbol=entry['symbol'], missing=','.join(missing)))
+    return order, placed, missing
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextlib
+import functools
+import heapq
+import itertools
+import threading
+import time
+
+from metrics import registry
+
+registry.describe('trading_ratelimit_wait_seconds', 'Time an exchange call waited for rate-limit tokens.')
+registry.describe('trading_ratelimit_throttled_total', 'Exchange calls that had to wait for tokens.')
+registry.describe('trading_ratelimit_queue_depth', 'Exchange calls waiting for tokens, by priority.')
+
+# priority classes, lower runs first
+CLOSE = 0  # cancel / close / reduce-only / protective orders
+OPEN = 1   # new exposure
+POLL = 2   # fill polling, reconcile, keep-alive pings
+NAMES = {CLOSE: 'close', OPEN: 'open', POLL: 'poll'}
+
+_local = threading.local()
+_shared = {}
+_sharedLock = threading.Lock()
+
+
+def currentPriority():
+    return getattr(_local, 'priority', OPEN)
+
+
+# calls made inside run at level, or at the outer level if that is more urgent
+@contextlib.contextmanager
+def priority(level):
+    outer = getattr(_local, 'priority', None)
+    _local.priority = level if outer is None else min(outer, level)
+    try:
+        yield
+    finally:
+        if outer is None:
+            del _local.priority
+        else:
+            _local.priority = outer
+
+
+def prioritized(level):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with priority(level):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# one scheduler per exchange id, shared by every client of that exchange in the process (one IP)
+def sharedScheduler(name, rate, burst=10):
+    with _sharedLock:
+        scheduler = _shared.get(name)
+        if scheduler is None:
+            scheduler = _shared[name] = RateScheduler(rate, burst, name=name)
+        return scheduler
+
+
+# route a ccxt client's throttle(cost) through the scheduler; cost is ccxt's endpoint weight
+def install(exchange, scheduler):
+    exchange.throttle = lambda cost=None: scheduler.acquire(1 if cost is None else cost)
+    return exchange
+
+
+class RateScheduler(object):
+    '''
+    Token bucket refilled at rate weight units per second, holding at most
+    burst units; every call is charged its full weight, so the balance can
+    go negative. Callers wait in priority order (then arrival order), so a
+    backlog of polls never delays a close; a waiter only takes tokens when
+    it is at the head of the queue.
+    '''
+
+    def __init__(self, rate, burst=10, name='exchange'):
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1))
+        self.name = name
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waiters = []  # heap of (priority, seq)
+        self.seq = itertools.count()
+        self.depth = dict((level, 0) for level in NAMES)
+        self.cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, weight=1, level=None):
+        level = currentPriority() if level is None else level
+        weight = float(weight)
+        # a call heavier than the bucket goes once the bucket is full and is charged in full,
+        # the balance goes negative and later callers wait off the debt
+        need = min(weight, self.burst)
+        start = time.monotonic()
+        with self.cond:
+            self._refill(start)
+            if not self.waiters and self.tokens >= need:
+                self.tokens -= weight
+                return 0.0
+            ticket = (level, next(self.seq))
+            heapq.heappush(self.waiters, ticket)
+            self._setDepth(level, 1)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.waiters[0] == ticket and self.tokens >= need:
+                        self.tokens -= weight
+                        break
+                    wait = (need - self.tokens) / self.rate if self.waiters[0] == ticket else None
+                    self.cond.wait(wait)
+            finally:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self._setDepth(level, -1)
+                self.cond.notify_all()
+        waited = time.monotonic() - start
+        registry.inc('trading_ratelimit_throttled_total', exchange=self.name, priority=NAMES.get(level, level))
+        registry.observe('trading_ratelimit_wait_seconds', waited, exchange=self.name, priority=NAMES.get(level, level))
+        return waited
+
+    def _setDepth(self, level, delta):
+        self.depth[level] = self.depth.get(level, 0) + delta
+        registry.setGauge('trading_ratelimit_queue_depth', self.depth[level], exchange=self.name,
+                          priority=NAMES.get(level, level))
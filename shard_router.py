@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Bybit agents split across worker processes. Each worker runs
+bybit_trading.py with the [account.sub.N] sections it owns (by url number
+or by a hash of the account name) and serves them on a unix socket; this
+router owns the public listener and forwards:
+
+    /order/<exchange>/sub<N>    to the worker owning sub<N>
+    /order/bybit/all            to every worker, results merged
+    /order/bybit/group/<name>   to the workers owning a member, results merged
+    /metrics                    every worker's metrics with a shard label
+    /health                     worker states
+    /ready                      200 once every worker is up
+
+Workers are health checked and restarted when they exit or stop answering.
+
+    python shard_router.py [--shards 4] [--by url_num|hash] [--host 0.0.0.0] [--port 8080]
+'''
+import argparse
+import configparser
+import http.client
+import json
+import logging
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIG_PATH = './bybit_config.ini'
+# "<index>/<count>/<by>" in the environment of a worker process
+SHARD_ENV = 'CTS_SHARD'
+SUB_PATH = re.compile(r'^/order/[^/]+/sub(\d+)$')
+GROUP_PATH = re.compile(r'^/order/bybit/group/([^/]+)$')
+
+
+# (index, count, by) of this process, (0, 1, 'url_num') when not sharded
+def currentShard():
+    value = os.environ.get(SHARD_ENV)
+    if not value:
+        return 0, 1, 'url_num'
+    index, count, by = (value.split('/') + ['url_num'])[:3]
+    return int(index), int(count), by
+
+
+def shardOf(urlNum, name, count, by='url_num'):
+    if count <= 1:
+        return 0
+    if by == 'hash':
+        return zlib.crc32(str(name).encode('utf-8')) % count
+    return (urlNum - 1) % count
+
+
+# per-shard file next to the shared one, e.g. ./bybit_state.db -> ./bybit_state.shard2.db
+def shardPath(path, index, count):
+    if count <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return "{root}.shard{index}{ext}".format(root=root, index=index, ext=ext)
+
+
+# [group.<name>] accounts = 1,3,4 -> {name: [1, 3, 4]}; raises ValueError naming the bad entry
+def accountGroups(config):
+    groups = {}
+    for section in config.sections():
+        if section.startswith("group."):
+            members = []
+            for num in config.get(section, 'accounts', fallback='').split(","):
+                num = num.strip()
+                if not num:
+                    continue
+                if not num.isdigit() or int(num) < 1:
+                    raise ValueError("[{section}] accounts: {num!r} is not an account number".format(
+                        section=section, num=num))
+                members.append(int(num))
+            groups[section[len("group."):]] = members
+    return groups
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socketPath, timeout):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+
+class Worker(object):
+    def __init__(self, index, socketPath):
+        self.index = index
+        self.socketPath = socketPath
+        self.proc = None
+        self.ready = False
+        self.failures = 0
+        self.restarts = 0
+        self.started = 0
+        self.nextStart = 0
+
+    def state(self):
+        return {'shard': self.index, 'pid': self.proc.pid if self.proc else None, 'ready': self.ready,
+                'restarts': self.restarts, 'failures': self.failures}
+
+
+class ShardRouter(object):
+    '''
+    WSGI front for the worker processes. Ownership is computed from the
+    config once, so routing a signal is a dict lookup and one request over
+    a local socket.
+    '''
+
+    def __init__(self, config, shards, by='url_num', socketDir=None, timeout=30, healthInterval=2,
+                 healthFailures=3, startTimeout=120):
+        self.shards = int(shards)
+        self.by = by
+        self.timeout = float(timeout)
+        self.healthInterval = float(healthInterval)
+        self.healthFailures = int(healthFailures)
+        self.startTimeout = float(startTimeout)
+        socketDir = socketDir or tempfile.mkdtemp(prefix='cts-shards-')
+        self.workers = [Worker(i, os.path.join(socketDir, 'bybit-shard{i}.sock'.format(i=i)))
+                        for i in range(self.shards)]
+        self.configure(config)
+        self.pool = ThreadPoolExecutor(max_workers=max(4, self.shards * 2), thread_name_prefix='router')
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    # url number -> worker and group members; re-run on a config change, the workers reload themselves
+    def configure(self, config):
+        owners = {}
+        urlNum = 0
+        for section in config.sections():
+            if section.startswith("account.sub."):
+                urlNum += 1
+                owners[urlNum] = shardOf(urlNum, config.get(section, 'name'), self.shards, self.by)
+        self.owners, self.groups = owners, accountGroups(config)
+
+    def start(self):
+        for worker in self.workers:
+            self.spawn(worker)
+        threading.Thread(target=self._watch, name='ShardHealth', daemon=True).start()
+        return self
+
+    def spawn(self, worker):
+        if os.path.exists(worker.socketPath):
+            os.unlink(worker.socketPath)
+        env = dict(os.environ)
+        env[SHARD_ENV] = "{index}/{count}/{by}".format(index=worker.index, count=self.shards, by=self.by)
+        worker.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', str(worker.index),
+                                        '--socket', worker.socketPath], env=env)
+        worker.ready = False
+        worker.failures = 0
+        worker.started = time.time()
+        logging.info("[ShardRouter] shard {index} started, pid {pid}".format(index=worker.index, pid=worker.proc.pid))
+
+    def restart(self, worker, reason):
+        worker.restarts += 1
+        logging.error("[ShardRouter] shard {index} restart ({reason})".format(index=worker.index, reason=reason))
+        if worker.proc is not None and worker.proc.poll() is None:
+            worker.proc.kill()
+            worker.proc.wait()
+        # back off when a worker keeps dying, e.g. on a bad config
+        worker.nextStart = time.time() + min(30, 2 ** min(worker.restarts - 1, 5))
+        worker.proc = None
+        worker.ready = False
+
+    def _watch(self):
+        while not self.stopped.wait(self.healthInterval):
+            for worker in self.workers:
+                self.check(worker)
+
+    def check(self, worker):
+        if worker.proc is None:
+            if time.time() >= worker.nextStart:
+                self.spawn(worker)
+            return
+        if worker.proc.poll() is not None:
+            self.restart(worker, "exit code {code}".format(code=worker.proc.returncode))
+            return
+        try:
+            status, _, _ = self.request(worker, 'GET', '/health', timeout=max(1.0, self.healthInterval))
+            ok = status == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+        if ok:
+            if not worker.ready:
+                logging.info("[ShardRouter] shard {index} ready".format(index=worker.index))
+            worker.ready = True
+            worker.failures = 0
+        elif not worker.ready:
+            # still starting its agents
+            if time.time() - worker.started > self.startTimeout:
+                self.restart(worker, "not ready after {t}s".format(t=self.startTimeout))
+        else:
+            worker.failures += 1
+            if worker.failures >= self.healthFailures:
+                self.restart(worker, "{n} failed health checks".format(n=worker.failures))
+
+    def request(self, worker, method, path, body=None, headers=None, timeout=None):
+        conn = UnixConnection(worker.socketPath, timeout or self.timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            res = conn.getresponse()
+            return res.status, res.getheaders(), res.read()
+        finally:
+            conn.close()
+
+    def forward(self, index, environ, body):
+        worker = self.workers[index]
+        if not worker.ready:
+            return 503, [('Content-Type', 'application/json')], json.dumps(
+                {"msg": "shard {index} unavailable".format(index=index)}).encode('utf-8')
+        headers = {'X-Forwarded-For': environ.get('REMOTE_ADDR', '')}
+        if environ.get('CONTENT_TYPE'):
+            headers['Content-Type'] = environ['CONTENT_TYPE']
+        path = environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+        try:
+            status, resHeaders, data = self.request(worker, environ['REQUEST_METHOD'], path, body, headers)
+        except (OSError, http.client.HTTPException) as e:
+            logging.error("[ShardRouter] shard {index} forward err: {err}".format(index=index, err=e))
+            return 502, [('Content-Type', 'application/json')], json.dumps(
+                {"msg": "shard {index} error: {err}".format(index=index, err=e)}).encode('utf-8')
+        keep = [(k, v) for k, v in resHeaders if k.lower() in ('content-type', 'x-dedup')]
+        return status, keep, data
+
+    # one signal to several workers, merged like a single-process fanOut response
+    def fanOut(self, indexes, environ, body):
+        start = time.perf_counter()
+        responses = list(self.pool.map(lambda i: (i, self.forward(i, environ, body)), sorted(indexes)))
+        failed = [r for _, r in responses if r[0] != 200]
+        if failed and len(failed) == len(responses) and failed[0][0] < 500:
+            # e.g. 401 from every worker, pass it on as is
+            return failed[0]
+        merged = {"accounts": 0, "elapsedMs": 0, "results": {}}
+        for index, (status, _, data) in responses:
+            if status == 200:
+                res = json.loads(data)
+                merged["accounts"] += res.get("accounts", 0)
+                merged["results"].update(res.get("results", {}))
+            else:
+                for urlNum, owner in self.owners.items():
+                    if owner == index:
+                        merged["results"]["sub{num}".format(num=urlNum)] = {"msg": "shard {index} unavailable".format(
+                            index=index)}
+        merged["results"] = dict(sorted(merged["results"].items(), key=lambda kv: int(kv[0][3:])
+                                        if kv[0][3:].isdigit() else 0))
+        merged["elapsedMs"] = round((time.perf_counter() - start) * 1000, 3)
+        return 200, [('Content-Type', 'application/json')], json.dumps(merged).encode('utf-8')
+
+    # 200 once every worker answers its health check, like a single process's /ready once its agents are up
+    def ready(self):
+        starting = [w.index for w in self.workers if not w.ready]
+        body = {'ready': not starting, 'starting': ['shard{index}'.format(index=i) for i in starting],
+                'shards': len(self.workers)}
+        return 200 if body['ready'] else 503, [('Content-Type', 'application/json')], json.dumps(body).encode('utf-8')
+
+    def metrics(self, environ):
+        seen = set()
+        lines = []
+        for index, (status, _, data) in enumerate(self.pool.map(lambda i: self.forward(i, environ, None),
+                                                                range(self.shards))):
+            if status != 200:
+                continue
+            for line in data.decode('utf-8').splitlines():
+                if line.startswith('#'):
+                    if line not in seen:
+                        seen.add(line)
+                        lines.append(line)
+                elif line:
+                    name, _, rest = line.partition(' ')
+                    if '{' in name:
+                        name = name.replace('{', '{{shard="{index}",'.format(index=index), 1)
+                    else:
+                        name = '{name}{{shard="{index}"}}'.format(name=name, index=index)
+                    lines.append(name + ' ' + rest)
+        return 200, [('Content-Type', 'text/plain; version=0.0.4')], ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length > 0 else None
+        m = SUB_PATH.match(path)
+        if m:
+            index = self.owners.get(int(m.group(1)))
+            if index is None:
+                result = 404, [('Content-Type', 'application/json')], b'{"msg": "Unknown trading agent"}'
+            else:
+                result = self.forward(index, environ, body)
+        elif path == '/order/bybit/all':
+            result = self.fanOut(set(self.owners.values()), environ, body)
+        elif GROUP_PATH.match(path):
+            members = self.groups.get(GROUP_PATH.match(path).group(1))
+            if members is None:
+                result = 404, [('Content-Type', 'text/plain')], b'not found'
+            else:
+                result = self.fanOut(set(self.owners[n] for n in members if n in self.owners), environ, body)
+        elif path == '/metrics':
+            result = self.metrics(environ)
+        elif path == '/health':
+            states = [w.state() for w in self.workers]
+            status = 200 if all(s['ready'] for s in states) else 503
+            result = status, [('Content-Type', 'application/json')], json.dumps({'shards': states}).encode('utf-8')
+        elif path == '/ready':
+            result = self.ready()
+        else:
+            result = 404, [('Content-Type', 'text/plain')], b'not found'
+        status, headers, data = result
+        start_response('{status} {reason}'.format(status=status, reason=http.client.responses.get(status, '')),
+                       headers + [('Content-Length', str(len(data)))])
+        return [data]
+
+    def stop(self):
+        self.stopped.set()
+        for worker in self.workers:
+            if worker.proc is not None and worker.proc.poll() is None:
+                worker.proc.terminate()
+        for worker in self.workers:
+            if worker.proc is not None:
+                try:
+                    worker.proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    worker.proc.kill()
+
+
+class WorkerApp(object):
+    '''The bybit app of one worker: /health answered here, client address taken from the router.'''
+
+    def __init__(self, module, index):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        self.module = module
+        self.index = index
+        self.app = ProxyFix(module.app, x_for=1)
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == '/health':
+            agents = [a.accountConfig.get('name') for a in self.module.tradingAgents if a is not None]
+            data = json.dumps({'shard': self.index, 'agents': agents}).encode('utf-8')
+            start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(data)))])
+            return [data]
+        return self.app(environ, start_response)
+
+
+# the environment (SHARD_ENV) tells bybit_trading which accounts to build
+def runWorker(socketPath):
+    index, count, _ = currentShard()
+    import bybit_trading
+    from log_pipeline import setupLogging
+    from werkzeug.serving import run_simple
+    config = bybit_trading.config
+    setupLogging(shardPath('bybit_trade.log', index, count),
+                 dict(config.items('logging')) if config.has_section('logging') else {})
+    bybit_trading.startAgents()
+    logging.info("[shard {index}] {n} agents on {path}".format(
+        index=index, n=sum(1 for a in bybit_trading.tradingAgents if a is not None), path=socketPath))
+    if os.path.exists(socketPath):
+        os.unlink(socketPath)
+    run_simple('unix://' + socketPath, 0, WorkerApp(bybit_trading, index), threaded=True)
+
+
+def readConfig():
+    config = configparser.ConfigParser()
+    if not config.read(CONFIG_PATH, encoding="UTF-8"):
+        return None
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, help='worker processes, default [shards] count or the CPU count')
+    parser.add_argument('--by', choices=['url_num', 'hash'], help='account to worker mapping, default [shards] by')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--socket', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        runWorker(args.socket)
+        return
+
+    config = readConfig()
+    if config is None:
+        raise SystemExit("bybit_config.ini not found")
+    from log_pipeline import setupLogging
+    setupLogging('shard_router.log', dict(config.items('logging')) if config.has_section('logging') else {})
+    shards = args.shards or config.getint('shards', 'count', fallback=0) or os.cpu_count() or 1
+    router = ShardRouter(config, shards,
+                         by=args.by or config.get('shards', 'by', fallback='url_num'),
+                         socketDir=config.get('shards', 'socket_dir', fallback=None),
+                         timeout=config.getfloat('shards', 'timeout', fallback=30),
+                         healthInterval=config.getfloat('shards', 'health_interval', fallback=2),
+                         healthFailures=config.getint('shards', 'health_failures', fallback=3),
+                         startTimeout=config.getfloat('shards', 'start_timeout', fallback=120)).start()
+    if config.getboolean('reload', 'enabled', fallback=True):
+        from config_reload import ConfigWatcher, installSignal
+
+        def reload():
+            conf = readConfig()
+            if conf is None:
+                raise Exception("bybit_config.ini not found")
+            router.configure(conf)
+        ConfigWatcher([CONFIG_PATH], reload, interval=config.getfloat('reload', 'interval', fallback=1),
+                      name='router').start()
+        installSignal()
+    host = args.host or config.get('service', 'listen_host', fallback='0.0.0.0')
+    port = args.port or config.getint('service', 'listen_port', fallback=8080)
+    logging.info("shard router for {n} workers listening on {host}:{port}".format(n=shards, host=host, port=port))
+    from werkzeug.serving import run_simple
+    try:
+        run_simple(host, port, router, threaded=True)
+    finally:
+        router.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import registry
+
+registry.describe('trading_startup_seconds', 'Time from import to a service being ready, per service.')
+
+# exit status of a process whose background start failed, so a supervisor restarts it
+START_FAILED_EXIT = 3
+
+_shared = {}
+_sharedLock = threading.Lock()
+
+
+# one tracker per process, /ready of every service renders it
+def sharedReadiness():
+    with _sharedLock:
+        readiness = _shared.get('readiness')
+        if readiness is None:
+            readiness = _shared['readiness'] = Readiness()
+        return readiness
+
+
+class Readiness(object):
+    '''
+    Startup state of the services of this process. A service that starts
+    in the background (fast start) is pending until its start function
+    returns; orders for it are refused with 503 meanwhile and /ready only
+    answers 200 once nothing is pending or failed. A start that exceeds
+    its budget is logged, a failed one ends the process (see
+    startInBackground).
+    '''
+
+    def __init__(self):
+        self.created = time.time()
+        self.pending = {}  # name -> budget seconds
+        self.done = {}     # name -> seconds to ready
+        self.failed = {}   # name -> error
+        self.lock = threading.Lock()
+
+    def begin(self, name, budget=None):
+        with self.lock:
+            self.pending[name] = budget
+            self.failed.pop(name, None)
+
+    def finish(self, name, err=None):
+        elapsed = time.time() - self.created
+        with self.lock:
+            budget = self.pending.pop(name, None)
+            if err is not None:
+                self.failed[name] = str(err)
+            else:
+                self.done[name] = elapsed
+        if err is not None:
+            logging.error("[startup] {name} failed after {s:.3f}s: {err}".format(name=name, s=elapsed, err=err))
+            return
+        registry.setGauge('trading_startup_seconds', round(elapsed, 6), service=name)
+        if budget and elapsed > budget:
+            logging.warning("[startup] {name} ready after {s:.3f}s, over its {budget}s budget".format(
+                name=name, s=elapsed, budget=budget))
+        else:
+            logging.info("[startup] {name} ready after {s:.3f}s".format(name=name, s=elapsed))
+
+    def isStarting(self, name):
+        return name in self.pending or name in self.failed
+
+    def isReady(self):
+        return not self.pending and not self.failed
+
+    # (body, status) for the /ready endpoints
+    def render(self):
+        with self.lock:
+            body = {'ready': not self.pending and not self.failed, 'starting': sorted(self.pending),
+                    'failed': dict(self.failed), 'seconds': dict((k, round(v, 3)) for k, v in self.done.items())}
+        return body, 200 if body['ready'] else 503
+
+
+# run a service's start function on a thread so the listener can come up first; a start that
+# raises ends the process (START_FAILED_EXIT) unless exitOnFailure is off, as it would have without
+# the fast start, instead of leaving it up answering 503 for good
+def startInBackground(name, start, budget=None, exitOnFailure=True):
+    readiness = sharedReadiness()
+    readiness.begin(name, budget)
+
+    def run():
+        try:
+            start()
+        except Exception as e:
+            readiness.finish(name, e)
+            if exitOnFailure:
+                logging.critical("[startup] {name} could not start, exiting".format(name=name))
+                logging.shutdown()
+                os._exit(START_FAILED_EXIT)
+            return
+        readiness.finish(name)
+    thread = threading.Thread(target=run, name='Startup-' + name, daemon=True)
+    thread.start()
+    return thread
+
+
+# public address for the startup log, None when there is no route out or it takes longer than timeout
+def publicIp(url='http://httpbin.org/ip', timeout=3.0):
+    import urllib.request
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as res:
+            return json.load(res)['origin']
+    except Exception as e:
+        logging.warning("[startup] public ip lookup failed: {err}".format(err=e))
+        return None
+
+
+# log the public access url once it is known, without holding up the start
+def announcePublicIp(fmt, timeout=3.0):
+    def run():
+        ip = publicIp(timeout=timeout)
+        if ip is not None:
+            logging.info(fmt.format(ip=ip))
+    thread = threading.Thread(target=run, name='PublicIp', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from metrics import registry
+
+registry.describe('trading_state_flush_seconds', 'Time to write one batch of state changes to disk.')
+
+# sqlite synchronous levels: off = leave it to the OS, normal = fsync at WAL checkpoints, full = fsync every batch
+SYNC_MODES = ('off', 'normal', 'full')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS order_state (
+    account TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (account, symbol)
+);
+CREATE TABLE IF NOT EXISTS sltp_job (
+    account TEXT NOT NULL,
+    oid TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (account, oid)
+);
+'''
+
+
+class StateStore(object):
+    '''
+    Crash-safe local store for per-(account, symbol) signal state and pending
+    SL/TP jobs, kept in SQLite in WAL mode. Callers only update an in-memory
+    pending map, so the order path never waits on disk; a writer thread
+    coalesces changes per key and commits them in one transaction every
+    flushInterval seconds. Everything is read back with one query per table
+    on startup.
+    '''
+
+    def __init__(self, path, flushInterval=0.2, sync='normal', name='state'):
+        self.path = path
+        self.flushInterval = float(flushInterval)
+        self.sync = sync if sync in SYNC_MODES else 'normal'
+        self.name = name
+        self.pending = {}  # (table, account, key) -> data dict, None deletes the row
+        self.cond = threading.Condition()
+        self.dbLock = threading.Lock()
+        self.db = None
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        with self.dbLock:
+            if self.db is not None:
+                return self
+            self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous={sync}'.format(sync=self.sync.upper()))
+            self.db.executescript(SCHEMA)
+        self.thread = threading.Thread(target=self._run, name='StateStore-' + self.name, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        return self
+
+    # {symbol: data} of one account
+    def loadStates(self, account):
+        return dict((symbol, data) for symbol, data in self._load('order_state', 'symbol', account))
+
+    # [data] of one account's pending SL/TP jobs
+    def loadJobs(self, account):
+        return [data for oid, data in self._load('sltp_job', 'oid', account)]
+
+    def _load(self, table, keyColumn, account):
+        self.start()
+        with self.dbLock:
+            rows = self.db.execute('SELECT {key}, data FROM {table} WHERE account = ?'.format(key=keyColumn, table=table),
+                                   (account,)).fetchall()
+        result = []
+        for key, data in rows:
+            try:
+                result.append((key, json.loads(data)))
+            except ValueError as e:
+                logging.error("[StateStore] bad {table} row {key}: {err}".format(table=table, key=key, err=e))
+        return result
+
+    def putState(self, account, symbol, data):
+        self._put(('order_state', account, symbol), dict(data))
+
+    def putJob(self, account, oid, data):
+        self._put(('sltp_job', account, str(oid)), dict(data))
+
+    def deleteJob(self, account, oid):
+        self._put(('sltp_job', account, str(oid)), None)
+
+    def _put(self, key, data):
+        with self.cond:
+            self.pending[key] = data
+            self.cond.notify()
+
+    # write everything pending now, e.g. on shutdown
+    def flush(self):
+        if self.db is None:
+            return
+        with self.cond:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        start = time.perf_counter()
+        now = time.time()
+        try:
+            with self.dbLock:
+                self.db.execute('BEGIN')
+                try:
+                    for (table, account, key), data in batch.items():
+                        keyColumn = 'symbol' if table == 'order_state' else 'oid'
+                        if data is None:
+                            self.db.execute('DELETE FROM {table} WHERE account = ? AND {key} = ?'.format(
+                                table=table, key=keyColumn), (account, key))
+                        else:
+                            self.db.execute('INSERT OR REPLACE INTO {table} (account, {key}, data, updated) VALUES (?, ?, ?, ?)'.format(
+                                table=table, key=keyColumn), (account, key, json.dumps(data, default=str), now))
+                    self.db.execute('COMMIT')
+                except Exception:
+                    self.db.execute('ROLLBACK')
+                    raise
+        except Exception as e:
+            logging.error("[StateStore] flush err: {err}".format(err=e))
+            # keep the batch unless newer changes replaced it
+            with self.cond:
+                for key, data in batch.items():
+                    self.pending.setdefault(key, data)
+        registry.observe('trading_state_flush_seconds', time.perf_counter() - start, store=self.name)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+            # let a burst of changes collect into one transaction
+            time.sleep(self.flushInterval)
+            self.flush()
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.flush()
+        with self.dbLock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
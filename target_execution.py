@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# execution modes
+SEQUENTIAL = 'sequential'  # cancel, close, then open, one step after another
+TARGET = 'target'          # read the alert as a target position and send the delta as one order
+
+
+# signed target size of an alert, None when the alert does not describe one
+def targetPosition(params):
+    amount = abs(float(params.get('amount') or 0))
+    position = (params.get('position') or '').lower()
+    if position == 'long':
+        return amount
+    if position == 'short':
+        return -amount
+    if position == 'flat':
+        return 0.0
+    side = (params.get('side') or '').lower()
+    if side == 'buy':
+        return amount
+    if side == 'sell':
+        return -amount
+    if side == 'close':
+        return 0.0
+    return None
+
+
+# (side, amount, reduceOnly) of the one order that moves current to target, None if already there
+def planTargetOrder(current, target, minAmount=1e-9):
+    delta = target - current
+    if abs(delta) <= minAmount:
+        return None
+    side = 'buy' if delta > 0 else 'sell'
+    # shrinking a position without crossing zero never needs new margin
+    reduceOnly = current != 0 and abs(target) < abs(current) and target * current >= 0
+    return side, abs(delta), reduceOnly
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sys
+
+from async_engine import AsyncTradingAgent
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+from fake_exchange import FakeExchange  # noqa: E402
+
+
+class AsyncFake(object):
+    # the fake exchange behind the ccxt.async_support call style
+    def __init__(self, **kwargs):
+        self.sync = FakeExchange(latency=0, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+def agent(exchangeName='binance', **kwargs):
+    return AsyncTradingAgent(AsyncFake(), {'name': 'test'}, exchangeName, fillWatch={'min_interval': 0.01}, **kwargs)
+
+
+def test_string_amount_from_the_config_is_coerced():
+    a = agent()
+    params = {'symbol': 'BTC/USDT:USDT', 'side': 'buy', 'amount': '0.5'}
+    ret = asyncio.run(a.runBinanceOrder({}, params, False))
+    assert ret['createOrderRes'] is True
+    assert a.exchange.sync.positions['BTC/USDT:USDT'] == 0.5
+
+
+def test_invalid_amount_is_reported():
+    a = agent()
+    ret = asyncio.run(a.runBinanceOrder({}, {'symbol': 'BTC/USDT:USDT', 'side': 'buy', 'amount': 'abc'}, False))
+    assert ret['msg'] == "amount is not valid"
+    ret = asyncio.run(a.runTargetOrder({}, {'symbol': 'BTC/USDT:USDT', 'side': 'buy', 'amount': 'abc'}))
+    assert ret['msg'] == "amount is not valid"
+
+
+def test_protection_is_placed_after_the_fill():
+    a = agent(stopLossPct=1, takeProfitPct=2)
+
+    async def run():
+        await a.runBinanceOrder({}, {'symbol': 'BTC/USDT:USDT', 'side': 'buy', 'amount': 1}, False)
+        await asyncio.gather(*a.fillTasks.values())
+    asyncio.run(run())
+    resting = a.exchange.sync.fetch_open_orders('BTC/USDT:USDT')
+    assert sorted(o['side'] for o in resting) == ['sell', 'sell']
+    assert all(o['reduceOnly'] and o['amount'] == 1 for o in resting)
+
+
+def test_protection_is_attached_on_bybit():
+    a = agent('bybit', stopLossPct=1, takeProfitPct=2)
+    orders = []
+    create = a.exchange.sync.create_market_order
+
+    def record(symbol, side, amount, price=None, params={}):
+        orders.append(params)
+        return create(symbol, side, amount, price, params)
+    a.exchange.sync.create_market_order = record
+    asyncio.run(a.createOrder('BTC/USDT:USDT', 1, 'buy'))
+    assert orders == [{'stopLoss': {'triggerPrice': 99.0}, 'takeProfit': {'triggerPrice': 102.0}}]
+    assert a.fillTasks == {}
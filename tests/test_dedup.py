@@ -0,0 +1,64 @@
+import threading
+
+from dedup import DedupCache, reportsFailure
+
+
+def test_fingerprint_ignores_key_order_and_api_secret():
+    cache = DedupCache()
+    a = cache.fingerprint('/order', payload={'side': 'buy', 'amount': 1, 'apiSec': 'x'})
+    b = cache.fingerprint('/order', payload={'amount': 1, 'side': 'buy', 'apiSec': 'y'})
+    assert a == b
+    assert a != cache.fingerprint('/order/bybit/sub1', payload={'side': 'buy', 'amount': 1})
+
+
+def test_alert_id_and_time_take_the_long_ttl():
+    cache = DedupCache(ttl=60, fingerprintTtl=5)
+    byId = cache.fingerprint('/order', payload={'alertId': 'a1', 'side': 'buy'})
+    assert byId == cache.fingerprint('/order', payload={'alertId': 'a1', 'side': 'buy', 'price': 2})
+    byTime = cache.fingerprint('/order', payload={'time': '2026-10-18T09:00:00Z', 'side': 'buy'})
+    assert byTime != cache.fingerprint('/order', payload={'time': '2026-10-18T09:01:00Z', 'side': 'buy'})
+    bare = cache.fingerprint('/order', payload={'side': 'buy'})
+    assert (cache.ttlFor(byId), cache.ttlFor(byTime), cache.ttlFor(bare)) == (60, 60, 5)
+
+
+def test_duplicate_waits_for_the_original_response():
+    cache = DedupCache(waitTimeout=2)
+    owner, entry = cache.claim('k')
+    assert owner
+    again, same = cache.claim('k')
+    assert not again and same is entry
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(cache.wait(same)))
+    waiter.start()
+    cache.store('k', entry, 'response')
+    waiter.join(2)
+    assert got == ['response']
+
+
+def test_released_claim_lets_the_retry_run():
+    cache = DedupCache()
+    owner, entry = cache.claim('k')
+    cache.release('k', entry)
+    assert cache.wait(entry) is None
+    assert cache.claim('k')[0]
+
+
+def test_size_stays_bounded():
+    cache = DedupCache(maxSize=3)
+    for i in range(10):
+        owner, entry = cache.claim(str(i))
+        cache.store(str(i), entry, i)
+    assert cache.size() == 3
+
+
+def test_failed_orders_are_not_cached():
+    assert reportsFailure({'createOrderRes': False, 'msg': 'insufficient margin'})
+    assert not reportsFailure({'createOrderRes': True, 'msg': 'ok'})
+    # close / cancel / already at target did not try to create an order
+    assert not reportsFailure({'cancelLastOrder': True, 'closedPosition': True, 'createOrderRes': None, 'msg': ''})
+    assert not reportsFailure({'createOrderRes': None, 'msg': 'position already at target'})
+    # a retry would re-send the legs / accounts that went through
+    assert not reportsFailure({'legs': [{'ok': True}, {'ok': False}], 'createOrderRes': False})
+    assert reportsFailure({'legs': [{'ok': False}], 'createOrderRes': False})
+    assert not reportsFailure({'results': {'sub1': {'createOrderRes': True}, 'sub2': {'createOrderRes': False}}})
+    assert reportsFailure({'results': {'sub1': {'createOrderRes': False}}})
@@ -0,0 +1,72 @@
+from instrument_rules import InstrumentRules, TICK_SIZE
+from market_store import MarketStore
+
+
+def market(id, symbol, kind, step, tick, minCost, inverse=False):
+    contract = kind != 'spot'
+    return {'id': id, 'symbol': symbol, 'type': kind, 'spot': not contract, 'swap': kind == 'swap',
+            'future': kind == 'future', 'contract': contract, 'linear': contract and not inverse,
+            'inverse': inverse, 'contractSize': 1,
+            'precision': {'amount': step, 'price': tick},
+            'limits': {'amount': {'min': step}, 'cost': {'min': minCost}}}
+
+
+# the order ccxt binance.fetch_markets returns them in, whatever type is asked for
+MIXED = [
+    market('BTCUSDT', 'BTC/USDT', 'spot', 0.00001, 0.01, 5),
+    market('BTCUSDT', 'BTC/USDT:USDT', 'swap', 0.001, 0.1, 100),
+    market('BTCUSD_PERP', 'BTC/USD:BTC', 'swap', 1, 0.1, 0, inverse=True),
+]
+
+
+def test_shared_id_resolves_to_the_linear_contract():
+    rules = InstrumentRules({'spot': MIXED, 'future': MIXED}, TICK_SIZE)
+    btc = rules.get('BTCUSDT')
+    assert btc.symbol == 'BTC/USDT:USDT'
+    assert btc.step == 0.001
+    assert btc.minNotional == 100
+    assert rules.get('BTC/USDT').step == 0.00001
+
+
+def test_ids_and_symbols_share_one_canonical_symbol():
+    rules = InstrumentRules({'future': MIXED}, TICK_SIZE)
+    assert rules.canonical('BTCUSDT') == rules.canonical('btc/usdt:usdt') == 'BTC/USDT:USDT'
+    assert rules.canonical('UNKNOWN') == 'UNKNOWN'
+
+
+def test_normalize_uses_the_contract_step_and_notional():
+    rules = InstrumentRules({'future': MIXED}, TICK_SIZE)
+    amount, price, err = rules.normalize('btcusdt', 0.0123456, 50000.04)
+    assert amount == 0.012
+    assert price == 50000.0
+    assert err is None
+    _, _, err = rules.normalize('BTCUSDT', 0.001, 50000)
+    assert 'notional' in err
+
+
+def test_spot_client_keeps_spot_rules():
+    rules = InstrumentRules({'spot': MIXED}, TICK_SIZE, defaultType='spot')
+    assert rules.get('BTCUSDT').symbol == 'BTC/USDT'
+
+
+def test_delivery_client_prefers_inverse():
+    inverse = market('BTCUSDT', 'BTC/USDT:BTC', 'swap', 1, 0.1, 0, inverse=True)
+    rules = InstrumentRules({'future': MIXED + [inverse]}, TICK_SIZE, defaultType='delivery')
+    assert rules.get('BTCUSDT').inverse
+
+
+def test_tick_override_applies_to_the_winning_market():
+    rules = InstrumentRules({'future': MIXED}, TICK_SIZE, tickOverrides={'btcusdt': 0.5})
+    assert rules.get('BTCUSDT').price(100.3) == 100.5
+
+
+def test_contracts_of_an_inverse_market():
+    rules = InstrumentRules({'future': MIXED}, TICK_SIZE)
+    assert rules.get('BTC/USD:BTC').contracts(0.01, 50000) == 500
+
+
+def test_market_store_index_prefers_the_contract(tmp_path):
+    store = MarketStore(lambda: {}, str(tmp_path / 'markets.json'))
+    store._install({'spot': MIXED}, 1)
+    assert store.get('spot', 'BTCUSDT')['symbol'] == 'BTC/USDT:USDT'
+    assert store.rules.get('BTCUSDT').step == 0.001
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+import keyed_executor
+from keyed_executor import KeyedExecutor, QueueFullError
+from metrics import beginTrace, endTrace, stage
+
+
+def test_tasks_of_one_key_run_in_submission_order():
+    executor = KeyedExecutor(workers=8, maxDepth=64)
+    seen = []
+
+    def step(i):
+        time.sleep(0.001)
+        seen.append(i)
+    futures = [executor.submit('BTC', step, i) for i in range(30)]
+    for future in futures:
+        future.result(5)
+    assert seen == list(range(30))
+
+
+def test_different_keys_run_in_parallel():
+    executor = KeyedExecutor(workers=2)
+    started = threading.Barrier(2, timeout=2)
+    # both tasks only finish once the other one has started
+    futures = [executor.submit(key, started.wait) for key in ('BTC', 'ETH')]
+    for future in futures:
+        future.result(5)
+
+
+def test_full_queue_is_refused():
+    executor = KeyedExecutor(workers=1, maxDepth=2)
+    started, release = threading.Event(), threading.Event()
+    executor.submit('k', lambda: (started.set(), release.wait(2)))
+    assert started.wait(2)
+    executor.submit('k', lambda: None)
+    with pytest.raises(QueueFullError):
+        executor.submit('k', lambda: None)
+    release.set()
+
+
+def test_joint_task_waits_for_every_key_and_holds_them():
+    executor = KeyedExecutor(workers=4, maxDepth=8)
+    release = threading.Event()
+    order = []
+
+    def step(name, wait=None):
+        if wait is not None:
+            wait.wait(2)
+        order.append(name)
+        return name
+    executor.submit('a', step, 'a1')
+    executor.submit('b', step, 'b1', release)
+    legs = executor.submitAll(['a', 'b'], step, 'legs')
+    after = executor.submit('a', step, 'a2')
+    time.sleep(0.05)
+    # a1 is done, but the legs still wait for b1 and a2 waits for the legs
+    assert order == ['a1']
+    release.set()
+    assert after.result(2) == 'a2'
+    assert legs.result(2) == 'legs'
+    assert order == ['a1', 'b1', 'legs', 'a2']
+
+
+def test_joint_tasks_sharing_keys_do_not_deadlock():
+    executor = KeyedExecutor(workers=2, maxDepth=64)
+    done = []
+    futures = []
+    for i in range(20):
+        keys = ['x', 'y', 'z'] if i % 2 else ['z', 'y', 'x']
+        futures.append(executor.submitAll(keys, done.append, i))
+    for future in futures:
+        future.result(2)
+    assert done == list(range(20))
+
+
+def test_shared_executor_takes_the_largest_settings(monkeypatch):
+    monkeypatch.setattr(keyed_executor, '_shared', {})
+    first = keyed_executor.sharedExecutor(workers=4, maxDepth=8)
+    second = keyed_executor.sharedExecutor(workers=16, maxDepth=4)
+    assert first is second
+    assert (first.workers, first.maxDepth) == (16, 8)
+    assert first.submit('k', lambda: 'ran').result(2) == 'ran'
+
+
+def test_stages_run_on_the_pool_reach_the_request_trace():
+    executor = KeyedExecutor(workers=2)
+
+    def runOrder():
+        with stage('cancelLastOrder'):
+            pass
+        with stage('createOrder'):
+            pass
+    beginTrace()
+    executor.submit(('binance', 'a', 'BTC/USDT:USDT'), runOrder).result(timeout=5)
+    executor.submitAll([('binance', 'a', 'BTC/USDT:USDT'), ('binance', 'a', 'ETH/USDT:USDT')], runOrder).result(timeout=5)
+    timings = endTrace()
+    assert set(timings) == {'cancelLastOrder', 'createOrder', 'total'}
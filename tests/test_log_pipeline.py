@@ -0,0 +1,13 @@
+import json
+
+from log_pipeline import requestText
+
+
+def test_request_secrets_are_masked():
+    text = '{"apiSec": "s3cret", "side": "buy"}'
+    logged = requestText(text, json.loads(text))
+    assert 's3cret' not in logged
+    assert json.loads(logged) == {'apiSec': '***', 'side': 'buy'}
+    # text alerts and bodies without secrets are logged as they came
+    assert requestText('BTCUSDT buy', None) == 'BTCUSDT buy'
+    assert requestText('{"side": "buy"}', {'side': 'buy'}) == '{"side": "buy"}'
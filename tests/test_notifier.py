@@ -0,0 +1,42 @@
+from notifier import MessageNotifier
+
+
+class PlainSender(object):
+    def __init__(self, configPath=None):
+        self.sent = []
+
+    def sendMessageToMq(self, msg):
+        self.sent.append(msg)
+
+    def Stop(self):
+        pass
+
+
+class BatchSender(PlainSender):
+    def sendMessagesToMq(self, msgs):
+        self.sent.append(list(msgs))
+
+
+def notifier(senderClass):
+    senders = []
+
+    def factory(configPath):
+        senders.append(senderClass(configPath))
+        return senders[-1]
+    return MessageNotifier(batchSize=10, flushInterval=0.01, senderFactory=factory), senders
+
+
+def test_a_batch_goes_out_in_one_call_when_the_sender_can():
+    n, senders = notifier(BatchSender)
+    n._flush(['a', 'b', 'c'])
+    assert senders[0].sent == [['a', 'b', 'c']]
+    assert n.stats['sent'] == 3
+
+
+def test_plain_senders_get_one_message_at_a_time():
+    n, senders = notifier(PlainSender)
+    for msg in ('a', 'b'):
+        n.send(msg)
+    n.stop()
+    assert senders[0].sent == ['a', 'b']
+    assert n.stats == {'enqueued': 2, 'sent': 2, 'dropped': 0, 'failed': 0}
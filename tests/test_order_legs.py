@@ -0,0 +1,25 @@
+from instrument_rules import InstrumentRules
+from order_legs import parseLegs, sizeLegs
+
+MARKETS = {'BTC/USDT:USDT': [{'id': 'BTCUSDT', 'symbol': 'BTC/USDT:USDT', 'type': 'swap', 'spot': False,
+                              'contract': True, 'linear': True, 'inverse': False, 'contractSize': 1,
+                              'precision': {'amount': 0.001, 'price': 0.1},
+                              'limits': {'amount': {'min': 0.001}, 'cost': {'min': 5}}}]}
+
+
+def test_legs_are_rounded_to_the_symbol_rules():
+    legs, err = parseLegs([{'side': 'buy', 'amount': 0.0123}, {'side': 'sell', 'amount': 0.5, 'type': 'limit',
+                                                               'price': 100000.04}], 'BTCUSDT')
+    assert err is None
+    legs, err = sizeLegs(legs, InstrumentRules(MARKETS))
+    assert err is None
+    assert legs[0]['amount'] == 0.012
+    assert (legs[1]['amount'], legs[1]['price']) == (0.5, 100000.0)
+    # the exchange id is replaced by the unified symbol the order / position state is kept under
+    assert [leg['symbol'] for leg in legs] == ['BTC/USDT:USDT', 'BTC/USDT:USDT']
+
+
+def test_a_leg_below_the_minimum_rejects_the_bundle():
+    legs, _ = parseLegs([{'side': 'buy', 'amount': 0.5}, {'side': 'buy', 'amount': 0.0004}], 'BTCUSDT')
+    legs, err = sizeLegs(legs, InstrumentRules(MARKETS))
+    assert legs is None and err.startswith('leg 1:')
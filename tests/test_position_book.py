@@ -0,0 +1,83 @@
+import threading
+
+from position_book import PositionBook
+
+
+class SlowExchange(object):
+    '''Answers with a fixed snapshot; the first fetch_positions waits until released.'''
+
+    def __init__(self, contracts=0.0, openOrders=0):
+        self.contracts = contracts
+        self.openOrders = openOrders
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+
+    def fetch_positions(self, symbols=None, params={}):
+        self.fetching.set()
+        self.release.wait(5)
+        size = abs(self.contracts)
+        return [{'symbol': symbols[0], 'contracts': size, 'side': 'long' if self.contracts > 0 else 'short'}]
+
+    def fetch_open_orders(self, symbol=None, params={}):
+        return [{}] * self.openOrders
+
+
+def filled(amount):
+    return {'status': 'closed', 'filled': amount, 'type': 'market'}
+
+
+def test_reconcile_drops_a_snapshot_older_than_our_order():
+    exchange = SlowExchange(contracts=0.0)
+    book = PositionBook(exchange, ttl=30)
+    book.markDirty('BTC/USDT:USDT')
+    thread = threading.Thread(target=book.reconcile)
+    thread.start()
+    assert exchange.fetching.wait(5)
+    # the order fills while the (now stale) flat snapshot is in flight
+    book.onOrder('BTC/USDT:USDT', 'buy', 1.0, filled(1.0))
+    exchange.contracts = 1.0
+    exchange.release.set()
+    thread.join(5)
+    entry = book.entries['BTC/USDT:USDT']
+    assert entry.contracts == 1.0
+    assert entry.dirty
+    # not trusted, so the next read goes to the exchange instead of returning a stale 0
+    assert book.position('BTC/USDT:USDT') == 1.0
+
+
+def test_reconcile_overwrites_when_nothing_changed():
+    exchange = SlowExchange(contracts=-2.0, openOrders=1)
+    exchange.release.set()
+    book = PositionBook(exchange, ttl=30)
+    book.onOrder('BTC/USDT:USDT', 'buy', 1.0, filled(1.0))
+    book.reconcile()
+    entry = book.entries['BTC/USDT:USDT']
+    assert (entry.contracts, entry.openOrders, entry.dirty) == (-2.0, 1, False)
+
+
+def test_fetch_position_does_not_mark_a_raced_entry_fresh():
+    exchange = SlowExchange(contracts=0.0)
+    book = PositionBook(exchange, ttl=30)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(book.fetchPosition('ETH/USDT:USDT')))
+    thread.start()
+    assert exchange.fetching.wait(5)
+    book.onOrder('ETH/USDT:USDT', 'sell', 2.0, filled(2.0))
+    exchange.release.set()
+    thread.join(5)
+    assert book.entries['ETH/USDT:USDT'].contracts == -2.0
+    assert not book.isFresh('ETH/USDT:USDT')
+
+
+def test_orders_update_the_cached_position():
+    exchange = SlowExchange()
+    exchange.release.set()
+    book = PositionBook(exchange, ttl=30)
+    book.fetchPosition('BTC/USDT:USDT')
+    book.onOrder('BTC/USDT:USDT', 'buy', 0.5, filled(0.5))
+    book.onOrder('BTC/USDT:USDT', 'sell', 0.2, filled(0.2))
+    assert book.position('BTC/USDT:USDT') == 0.3
+    book.onOrder('BTC/USDT:USDT', 'buy', 1, {'status': 'open', 'filled': 0, 'type': 'limit'})
+    assert book.hasOpenOrders('BTC/USDT:USDT') is True
+    book.onCancelAll('BTC/USDT:USDT')
+    assert book.hasOpenOrders('BTC/USDT:USDT') is False
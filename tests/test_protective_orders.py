@@ -0,0 +1,42 @@
+import os
+import sys
+
+from exchange_adapters import ExchangeAdapter, BybitAdapter
+from protective_orders import protectionPrices, protectiveOrders, placeProtection
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+from fake_exchange import FakeExchange  # noqa: E402
+
+
+def test_protection_prices_follow_the_side():
+    assert protectionPrices('buy', 100, 1, 2) == (99.0, 102.0)
+    assert protectionPrices('sell', 100, 1, 2) == (101.0, 98.0)
+    assert protectionPrices('buy', 100, None, 2) == (None, 102.0)
+
+
+def test_protective_orders_close_the_position():
+    orders = protectiveOrders('BTC/USDT:USDT', 'buy', 0.5, 99, 102)
+    assert [kind for kind, _ in orders] == ['stopLoss', 'takeProfit']
+    for _, request in orders:
+        assert request['side'] == 'sell'
+        assert request['amount'] == 0.5
+        assert request['params']['reduceOnly'] is True
+
+
+def test_place_protection_batches_when_the_adapter_can():
+    exchange = FakeExchange(latency=0)
+    placed, missing = placeProtection(exchange, BybitAdapter('bybit'), 'BTC/USDT:USDT', 'sell', 2, 101, 98)
+    assert len(placed) == 2 and missing == []
+    assert exchange.calls == {'create_orders': 1}
+    assert all(o['side'] == 'buy' and o['reduceOnly'] for o in placed)
+
+
+def test_place_protection_reports_what_failed():
+    class Rejecting(FakeExchange):
+        def create_order(self, symbol=None, type='market', side=None, amount=None, price=None, params={}):
+            if 'takeProfitPrice' in params:
+                raise Exception('rejected')
+            return FakeExchange.create_order(self, symbol, type, side, amount, price, params)
+    placed, missing = placeProtection(Rejecting(latency=0), ExchangeAdapter('binance'), 'BTC/USDT:USDT', 'buy', 1,
+                                      99, 102)
+    assert len(placed) == 1 and missing == ['takeProfit']
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from rate_limiter import CLOSE, OPEN, POLL, RateScheduler, currentPriority, priority
+
+
+def test_nested_priority_keeps_the_more_urgent_level():
+    assert currentPriority() == OPEN
+    with priority(CLOSE):
+        with priority(POLL):
+            assert currentPriority() == CLOSE
+    with priority(POLL):
+        assert currentPriority() == POLL
+    assert currentPriority() == OPEN
+
+
+def test_waiters_take_tokens_by_priority_then_arrival():
+    scheduler = RateScheduler(rate=20, burst=1)
+    scheduler.acquire(1)
+    order = []
+
+    def call(name, level):
+        scheduler.acquire(1, level)
+        order.append(name)
+    threads = []
+    for name, level in (('poll', POLL), ('open1', OPEN), ('close', CLOSE), ('open2', OPEN)):
+        thread = threading.Thread(target=call, args=(name, level))
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + 2
+        # queue them one by one so arrival order is known
+        while sum(scheduler.depth.values()) < len(threads) and time.monotonic() < deadline:
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['close', 'open1', 'open2', 'poll']
+
+
+def test_idle_bucket_does_not_wait():
+    scheduler = RateScheduler(rate=1, burst=5)
+    assert all(scheduler.acquire(1) == 0.0 for _ in range(5))
+
+
+def test_weight_above_burst_is_charged_in_full():
+    scheduler = RateScheduler(rate=100, burst=5)
+    assert scheduler.acquire(20) == 0.0
+    # 15 units of debt plus the next call's weight refill at 100/s
+    waited = scheduler.acquire(1)
+    assert waited >= 0.14
@@ -0,0 +1,40 @@
+import configparser
+import json
+
+import pytest
+
+from shard_router import ShardRouter, accountGroups
+
+CONFIG = '''
+[account.sub.1]
+name = a
+[account.sub.2]
+name = b
+[group.majors]
+accounts = 1, 2
+'''
+
+
+def config(text):
+    conf = configparser.ConfigParser()
+    conf.read_string(text)
+    return conf
+
+
+def test_groups_are_parsed_once():
+    assert accountGroups(config(CONFIG)) == {'majors': [1, 2]}
+
+
+def test_bad_group_member_fails_at_load():
+    with pytest.raises(ValueError, match=r"\[group.majors\]"):
+        accountGroups(config(CONFIG.replace('1, 2', '1, two')))
+
+
+def test_ready_waits_for_every_worker(tmp_path):
+    router = ShardRouter(config(CONFIG), 2, socketDir=str(tmp_path))
+    status, _, body = router.ready()
+    assert status == 503 and json.loads(body)['starting'] == ['shard0', 'shard1']
+    for worker in router.workers:
+        worker.ready = True
+    status, _, body = router.ready()
+    assert status == 200 and json.loads(body)['ready'] is True
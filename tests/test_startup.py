@@ -0,0 +1,26 @@
+import startup
+from startup import Readiness, startInBackground
+
+
+def test_readiness_turns_ready_once_nothing_is_pending():
+    readiness = Readiness()
+    readiness.begin('bybit')
+    assert readiness.render()[1] == 503
+    readiness.finish('bybit')
+    body, status = readiness.render()
+    assert status == 200 and 'bybit' in body['seconds']
+
+
+def test_failed_background_start_exits(monkeypatch):
+    exits = []
+    monkeypatch.setattr(startup.os, '_exit', exits.append)
+    monkeypatch.setattr(startup.logging, 'shutdown', lambda: None)
+
+    def start():
+        raise Exception('bad config')
+    startInBackground('failing', start).join(2)
+    assert exits == [startup.START_FAILED_EXIT]
+    assert startup.sharedReadiness().render()[0]['failed'] == {'failing': 'bad config'}
+    # leave the process-wide tracker ready for the other tests
+    startup.sharedReadiness().begin('failing')
+    startup.sharedReadiness().finish('failing')
@@ -0,0 +1,27 @@
+from target_execution import targetPosition, planTargetOrder
+
+
+def test_target_from_position_then_side():
+    assert targetPosition({'position': 'long', 'amount': '0.5'}) == 0.5
+    assert targetPosition({'position': 'short', 'side': 'buy', 'amount': 2}) == -2
+    assert targetPosition({'position': 'flat', 'amount': 2}) == 0.0
+    assert targetPosition({'side': 'sell', 'amount': 1}) == -1
+    assert targetPosition({'side': 'close'}) == 0.0
+    assert targetPosition({'side': 'cancel', 'amount': 1}) is None
+
+
+def test_plan_opens_grows_and_flips_with_one_order():
+    assert planTargetOrder(0, 1) == ('buy', 1, False)
+    assert planTargetOrder(1, 3) == ('buy', 2, False)
+    # crossing zero needs margin for the new side, not reduce-only
+    assert planTargetOrder(1, -2) == ('sell', 3, False)
+
+
+def test_plan_shrinks_and_closes_reduce_only():
+    assert planTargetOrder(3, 1) == ('sell', 2, True)
+    assert planTargetOrder(-2, 0) == ('buy', 2, True)
+
+
+def test_plan_is_none_at_target():
+    assert planTargetOrder(1.5, 1.5) is None
+    assert planTargetOrder(1.0, 1.0 + 1e-12) is None
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+One process for every configured exchange. Loads binance_trading.py when
+binance_config.json/.ini exists and bybit_trading.py when bybit_config.ini
+exists, and serves both Flask apps behind one listener:
+
+    /order                      binance account of binance_config
+    /order/<exchange>/sub<N>    account N of bybit_config, on its exchange
+    /order/bybit/all, group/... every / a group of the bybit_config accounts
+    /metrics                    every exchange, one registry
+    /ready                      200 once every service has started
+
+ccxt, the notification sender, the keyed order executor, the market stores
+and the metrics registry are loaded once and shared by both services.
+
+The binance service keeps its own single-account flow (module-level
+state, its SL/TP modes); it is not built on the shared TradingAgent.
+Further accounts on any exchange, binance included, go in bybit_config.ini
+with exchange = <ccxt id> and are served by the agents.
+
+    python trading_service.py [--host 0.0.0.0] [--port 8080] [--fast-start]
+
+With --fast-start the listener comes up first and the services start in
+the background; their orders get 503 until /ready turns 200.
+'''
+import argparse
+import logging
+import os
+
+from log_pipeline import setupLogging
+from startup import startInBackground
+from config_reload import installSignal
+
+# (path, service, exact): binance owns /order itself, every /order/<exchange>/... path belongs to the
+# accounts of bybit_config.ini, whichever exchange they trade on
+ROUTES = (
+    ('/order', 'binance', True),
+    ('/order', 'bybit', False),
+)
+
+
+class PathDispatcher(object):
+    '''WSGI app that hands each request to the service owning its path.'''
+
+    def __init__(self, apps):
+        self.apps = apps
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        app = None
+        if path in ('/metrics', '/ready'):
+            # every service renders the same process-wide registry / readiness
+            app = next(iter(self.apps.values()), None)
+        else:
+            for prefix, name, exact in ROUTES:
+                if path == prefix if exact else path.startswith(prefix + '/'):
+                    app = self.apps.get(name)
+                    break
+        if app is None:
+            start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+            return [b'not found']
+        return app(environ, start_response)
+
+
+# import and start the services whose config file is present; fastStart starts them on background threads
+def loadServices(fastStart=False, budget=None):
+    modules = {}
+    starts = []
+    if os.path.exists('./binance_config.json') or os.path.exists('./binance_config.ini'):
+        import binance_trading
+        starts.append(('binance', binance_trading.startService))
+        modules['binance'] = binance_trading
+    if os.path.exists('./bybit_config.ini'):
+        import bybit_trading
+        starts.append(('bybit', bybit_trading.startAgents))
+        modules['bybit'] = bybit_trading
+    if fastStart and starts:
+        # only the main thread can take SIGHUP, the config watchers start on the startup threads
+        installSignal()
+    for name, start in starts:
+        if fastStart:
+            startInBackground(name, start, budget=budget)
+        else:
+            start()
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--fast-start', action='store_true', help='listen first, start the services in the background')
+    parser.add_argument('--start-budget', type=float, help='seconds a service may take to become ready before a warning')
+    args = parser.parse_args()
+
+    modules = loadServices(fastStart=args.fast_start, budget=args.start_budget)
+    if not modules:
+        raise SystemExit("no binance_config / bybit_config found")
+    # the services configure logging while importing, one log for the whole process instead
+    settings = {}
+    if 'bybit' in modules and modules['bybit'].config.has_section('logging'):
+        settings = dict(modules['bybit'].config.items('logging'))
+    elif 'binance' in modules:
+        settings = modules['binance'].config.get('logging', {})
+    setupLogging('trading_service.log', settings)
+    logging.info("trading service for {names} listening on {host}:{port}".format(
+        names=','.join(modules), host=args.host, port=args.port))
+
+    from werkzeug.serving import run_simple
+    run_simple(args.host, args.port, PathDispatcher(dict((name, m.app) for name, m in modules.items())),
+               threaded=True)
+
+
+if __name__ == '__main__':
+    main()